@@ -0,0 +1,261 @@
+"""Comandos administrativos do banco.
+
+Uso:
+    python admin.py contadores verificar
+    python admin.py contadores reconstruir
+    python admin.py indices plano
+    python admin.py indices aplicar [--remover-extras]
+    python admin.py geo preencher [--todos] [--lote N]
+    python admin.py busca preencher [--todos] [--lote N]
+    python admin.py analises situacao
+    python admin.py analises atualizar [--completo] [--nome NOME]
+    python admin.py exportar TIPO [--formato ndjson|csv|parquet] [--saida ARQUIVO]
+                             [--campos a,b] [--filtro JSON] [--gzip]
+    python admin.py importar ARQUIVO [--formato ndjson|csv] [--entidade TIPO] [--gzip]
+                             [--lote N] [--concorrencia N]
+"""
+
+import argparse
+import asyncio
+import sys
+import time
+
+from fastapi import HTTPException
+
+from analises import ANALISES, atualizar_analises, situacao_analises
+from exportacao import FORMATOS, LINHAS_POR_GRUPO, exportar
+from importacao import (
+    CONCORRENCIA_IMPORTACAO,
+    ENTIDADES,
+    FORMATOS_IMPORTACAO,
+    TAMANHO_LOTE_IMPORTACAO,
+    Importacao,
+)
+from models import Consulta
+from indices import aplicar_indices, planejar_indices
+from routers.utils import (
+    preencher_campos_busca,
+    preencher_localizacoes,
+    serializar,
+    verificar_contadores,
+)
+
+
+async def contadores(args):
+    relatorio = await verificar_contadores(corrigir=args.acao == "reconstruir", lote=args.lote)
+    for tipo, resultado in relatorio.items():
+        print(
+            f"{tipo:<12} verificados: {resultado['verificados']:>8}  "
+            f"divergentes: {resultado['divergentes']:>8}"
+        )
+    if args.acao == "verificar" and any(r["divergentes"] for r in relatorio.values()):
+        raise SystemExit(1)
+
+
+async def indices(args):
+    if args.acao == "plano":
+        plano = await planejar_indices()
+    else:
+        plano = await aplicar_indices(remover_extras=args.remover_extras)
+    for tipo, acoes in plano.items():
+        for nome in acoes["alterar"]:
+            print(f"~ {tipo}: {nome} (chave alterada, recriado)")
+        for indice in acoes["criar"]:
+            if indice.document["name"] not in acoes["alterar"]:
+                print(f"+ {tipo}: {indice.document['name']} {dict(indice.document['key'])}")
+        for nome in acoes["remover"]:
+            print(f"- {tipo}: {nome}")
+        if "erro" in acoes:
+            print(f"! {tipo}: {acoes['erro']}")
+    if not any(a["criar"] or a["remover"] for a in plano.values()):
+        print("Índices em dia.")
+
+
+async def geo(args):
+    relatorio = await preencher_localizacoes(lote=args.lote, todos=args.todos)
+    print(
+        f"terrenos atualizados: {relatorio['verificados']:>8}  "
+        f"sem coordenadas válidas: {relatorio['sem_coordenadas']:>8}"
+    )
+
+
+async def busca(args):
+    relatorio = await preencher_campos_busca(lote=args.lote, todos=args.todos)
+    for tipo, atualizados in relatorio.items():
+        print(f"{tipo:<12} atualizados: {atualizados:>8}")
+
+
+async def analises(args):
+    if args.acao == "situacao":
+        for item in await situacao_analises():
+            print(
+                f"{item['analise']:<22} grupos: {item['grupos']:>8}  "
+                f"marca: {item['marca']}  execuções: {item['execucoes']}"
+            )
+        return
+    nomes = [args.nome] if args.nome else None
+    for relatorio in await atualizar_analises(completo=args.completo, nomes=nomes):
+        print(
+            f"{relatorio['analise']:<22} {relatorio['modo']:<12} "
+            f"recalculados: {relatorio['grupos_recalculados']}  "
+            f"removidos: {relatorio['grupos_removidos']}  {relatorio['duracao_s']}s"
+        )
+
+
+async def exportar_colecao(args):
+    consulta = Consulta.model_validate_json(args.filtro) if args.filtro else None
+    try:
+        pedacos = exportar(
+            args.tipo, args.formato, consulta, args.campos, args.gzip, args.linhas_por_grupo
+        )
+    except HTTPException as e:
+        raise SystemExit(e.detail)
+    inicio = time.perf_counter()
+    total = 0
+    saida = sys.stdout.buffer if args.saida == "-" else open(args.saida, "wb")
+    try:
+        async for pedaco in pedacos:
+            saida.write(pedaco)
+            total += len(pedaco)
+    finally:
+        if saida is not sys.stdout.buffer:
+            saida.close()
+    print(
+        f"{args.tipo}: {total / 1_000_000:.1f} MB em {time.perf_counter() - inicio:.1f}s",
+        file=sys.stderr,
+    )
+
+
+async def _ler_arquivo(arquivo, tamanho: int = 1 << 16):
+    while True:
+        pedaco = arquivo.read(tamanho)
+        if not pedaco:
+            return
+        yield pedaco
+
+
+async def importar_arquivo(args):
+    # Os erros de cada linha vão para stdout em NDJSON e o progresso para stderr
+    def ao_errar(erro):
+        print(serializar(erro).decode(), flush=True)
+
+    def ao_progredir(situacao):
+        print(
+            f"{situacao['linhas']} linhas, {sum(situacao['inseridos'].values())} inseridos, "
+            f"{situacao['erros']} erros, {situacao['duracao_s']:.1f}s",
+            file=sys.stderr,
+        )
+
+    formato = args.formato or ("csv" if ".csv" in args.arquivo else "ndjson")
+    compactado = args.gzip or args.arquivo.endswith(".gz")
+    try:
+        importacao = Importacao(
+            formato,
+            args.entidade,
+            args.lote,
+            args.concorrencia,
+            limite_erros=0,
+            ao_errar=ao_errar,
+            ao_progredir=ao_progredir,
+        )
+    except HTTPException as e:
+        raise SystemExit(e.detail)
+    entrada = sys.stdin.buffer if args.arquivo == "-" else open(args.arquivo, "rb")
+    try:
+        resumo = await importacao.executar(_ler_arquivo(entrada), compactado)
+    finally:
+        if entrada is not sys.stdin.buffer:
+            entrada.close()
+    del resumo["detalhes"], resumo["erros_omitidos"]
+    print(serializar(resumo).decode(), file=sys.stderr)
+    if resumo["interrompida"]:
+        raise SystemExit(1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    comandos = parser.add_subparsers(dest="comando", required=True)
+
+    parser_contadores = comandos.add_parser(
+        "contadores", help="Verifica ou reconstrói os contadores de gasto com obras"
+    )
+    parser_contadores.add_argument("acao", choices=["verificar", "reconstruir"])
+    parser_contadores.add_argument("--lote", type=int, default=1000)
+    parser_contadores.set_defaults(funcao=contadores)
+
+    parser_indices = comandos.add_parser(
+        "indices", help="Mostra ou aplica a diferença entre os índices declarados e os do banco"
+    )
+    parser_indices.add_argument("acao", choices=["plano", "aplicar"])
+    parser_indices.add_argument(
+        "--remover-extras",
+        action="store_true",
+        help="Remove também os índices que não estão declarados em models.py",
+    )
+    parser_indices.set_defaults(funcao=indices)
+
+    parser_geo = comandos.add_parser(
+        "geo", help="Preenche a localização GeoJSON dos terrenos a partir do endereço"
+    )
+    parser_geo.add_argument("acao", choices=["preencher"])
+    parser_geo.add_argument(
+        "--todos", action="store_true", help="Recalcula também os que já têm localização"
+    )
+    parser_geo.add_argument("--lote", type=int, default=1000)
+    parser_geo.set_defaults(funcao=geo)
+
+    parser_busca = comandos.add_parser(
+        "busca", help="Preenche os campos usados nas buscas textual e por prefixo"
+    )
+    parser_busca.add_argument("acao", choices=["preencher"])
+    parser_busca.add_argument(
+        "--todos", action="store_true", help="Recalcula também os que já têm os campos"
+    )
+    parser_busca.add_argument("--lote", type=int, default=1000)
+    parser_busca.set_defaults(funcao=busca)
+
+    parser_analises = comandos.add_parser(
+        "analises", help="Atualiza as coleções de resumo das análises"
+    )
+    parser_analises.add_argument("acao", choices=["situacao", "atualizar"])
+    parser_analises.add_argument(
+        "--completo", action="store_true", help="Recalcula todos os grupos"
+    )
+    parser_analises.add_argument("--nome", choices=list(ANALISES))
+    parser_analises.set_defaults(funcao=analises)
+
+    parser_exportar = comandos.add_parser(
+        "exportar", help="Exporta uma coleção em NDJSON, CSV ou Parquet"
+    )
+    parser_exportar.add_argument("tipo", choices=["pessoa", "terreno", "construcao", "obra"])
+    parser_exportar.add_argument("--formato", choices=list(FORMATOS), default="ndjson")
+    parser_exportar.add_argument("--saida", default="-", help="Arquivo de saída; - para stdout")
+    parser_exportar.add_argument("--campos", help="Colunas separadas por vírgula")
+    parser_exportar.add_argument(
+        "--filtro", help='Consulta em JSON, ex. {"filtros": [{"campo": "custo", "valor": 10}]}'
+    )
+    parser_exportar.add_argument("--gzip", action="store_true")
+    parser_exportar.add_argument("--linhas-por-grupo", type=int, default=LINHAS_POR_GRUPO)
+    parser_exportar.set_defaults(funcao=exportar_colecao)
+
+    parser_importar = comandos.add_parser(
+        "importar", help="Importa um arquivo NDJSON ou CSV em lotes"
+    )
+    parser_importar.add_argument("arquivo", help="Arquivo de entrada; - para stdin")
+    parser_importar.add_argument(
+        "--formato", choices=FORMATOS_IMPORTACAO, help="Padrão: pela extensão do arquivo"
+    )
+    parser_importar.add_argument(
+        "--entidade", choices=list(ENTIDADES), help="Para linhas sem o campo entidade"
+    )
+    parser_importar.add_argument("--gzip", action="store_true", help="Padrão: se termina em .gz")
+    parser_importar.add_argument("--lote", type=int, default=TAMANHO_LOTE_IMPORTACAO)
+    parser_importar.add_argument("--concorrencia", type=int, default=CONCORRENCIA_IMPORTACAO)
+    parser_importar.set_defaults(funcao=importar_arquivo)
+
+    args = parser.parse_args()
+    asyncio.run(args.funcao(args))
+
+
+if __name__ == "__main__":
+    main()
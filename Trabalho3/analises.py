@@ -0,0 +1,341 @@
+"""Análises servidas a partir de coleções de resumo.
+
+Cada análise é um pipeline de agregação sobre um tipo que agrupa os
+documentos e grava um documento por grupo numa coleção de resumo com $merge.
+Os endpoints de /analises só leem essas coleções, que têm poucos documentos.
+
+A atualização é incremental: toda escrita marca `atualizado_em` nos
+documentos (routers.utils.campos_derivados e os $inc dos contadores), e cada
+execução recalcula por inteiro só os grupos com algum documento marcado
+desde a execução anterior. A marca de cada análise fica em
+analises_controle. Os grupos que perdem documentos, por exclusão ou por
+mudança de chave (ex. um terreno que muda de cidade), entram pelos valores
+antigos guardados em analises_saidas (routers.utils.registrar_saidas). A
+atualização completa recalcula tudo e remove os grupos que deixaram de
+existir; o agendador faz uma completa a cada ANALISES_COMPLETA_A_CADA rodadas.
+
+Os resumos refletem a última atualização: com o agendador ligado, atrasam
+no máximo ANALISES_INTERVALO segundos (mais a duração da atualização).
+
+Variáveis de ambiente:
+    ANALISES_INTERVALO        segundos entre atualizações agendadas; padrão
+                              300, 0 desliga o agendador
+    ANALISES_COMPLETA_A_CADA  padrão 24
+"""
+
+import asyncio
+import os
+import time
+from datetime import timedelta
+from typing import Callable, Dict, List, NamedTuple, Optional, Tuple
+
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+from db import ColecaoPreguicosa
+from logs import logging
+from routers.utils import CAMPOS_GRUPO_ANALISES, agora, map, saidas_collection
+
+logger = logging.getLogger(__name__)
+
+controle_collection = ColecaoPreguicosa("analises_controle")
+
+# Intervalo padrão do agendador, em segundos
+ANALISES_INTERVALO = 300
+
+# Folga na leitura da marca para escritas de servidores com o relógio atrasado;
+# recalcular um grupo a mais não muda o resultado
+MARGEM_RELOGIO = timedelta(seconds=5)
+
+
+class Analise(NamedTuple):
+    tipo: str  # tipo de origem, como em routers.utils.map
+    colecao: str  # coleção de resumo
+    chave: Dict[str, str]  # campo do grupo -> caminho no documento preparado
+    acumuladores: dict  # campos do $group
+    preparar: list = []  # etapas antes do agrupamento
+    finalizar: list = []  # etapas depois do agrupamento
+    # Filtro sobre a origem que alcança os documentos dos grupos informados;
+    # por padrão, igualdade nos caminhos da chave
+    filtro_origem: Optional[Callable[[List[dict]], dict]] = None
+    # Campos do documento de origem de que a chave depende
+    campos_grupo: Tuple[str, ...] = ()
+
+
+def _area(largura: str, altura: str) -> dict:
+    return {"$multiply": [{"$ifNull": [largura, 0]}, {"$ifNull": [altura, 0]}]}
+
+
+# Mês como um inteiro (ano * 12 + mês - 1), para o $range entre início e fim
+def _indice_mes(data) -> dict:
+    return {"$add": [{"$multiply": [{"$year": data}, 12]}, {"$month": data}, -1]}
+
+
+_MES_INICIO = _indice_mes("$inicio")
+_MES_FIM = _indice_mes({"$ifNull": ["$fim", "$inicio"]})
+
+
+def _meses_das_obras(chaves: List[dict]) -> dict:
+    """Obras com algum mês entre o primeiro e o último mês informados."""
+    meses = [c["mes"] for c in chaves if c.get("mes") is not None]
+    if not meses:
+        return {"_id": {"$exists": False}}
+    inicio = min(meses)
+    ultimo = max(meses)
+    fim = ultimo.replace(year=ultimo.year + ultimo.month // 12, month=ultimo.month % 12 + 1)
+    return {
+        "inicio": {"$lt": fim},
+        "$or": [{"fim": {"$gte": inicio}}, {"inicio": {"$gte": inicio}}],
+    }
+
+
+ANALISES: Dict[str, Analise] = {
+    # Terrenos, área, preço por m² e gastos com obras por cidade
+    "locais": Analise(
+        tipo="terreno",
+        colecao="analise_locais",
+        chave={"estado": "$endereco.estado", "cidade": "$endereco.cidade"},
+        campos_grupo=("endereco",),
+        acumuladores={
+            "terrenos": {"$sum": 1},
+            "disponiveis": {"$sum": {"$cond": ["$disponivel", 1, 0]}},
+            "area_total": {"$sum": _area("$largura", "$altua")},
+            "valor_terrenos": {"$sum": "$preco"},
+            "custo_obras": {"$sum": "$custo_total_obras"},
+            "quantidade_obras": {"$sum": "$quantidade_obras"},
+        },
+        finalizar=[
+            {
+                "$set": {
+                    "preco_m2": {
+                        "$cond": [
+                            {"$gt": ["$area_total", 0]},
+                            {"$divide": ["$valor_terrenos", "$area_total"]},
+                            None,
+                        ]
+                    }
+                }
+            }
+        ],
+    ),
+    # Gasto das obras por mês, com o custo de cada obra dividido igualmente
+    # entre os meses de início a fim (sem fim, tudo no mês de início)
+    "obras_por_mes": Analise(
+        tipo="obra",
+        colecao="analise_obras_por_mes",
+        chave={"mes": "$mes"},
+        acumuladores={"gasto": {"$sum": "$custo_mes"}, "obras": {"$sum": 1}},
+        preparar=[
+            {
+                "$set": {
+                    "meses": {
+                        "$range": [_MES_INICIO, {"$add": [{"$max": [_MES_INICIO, _MES_FIM]}, 1]}]
+                    }
+                }
+            },
+            {"$set": {"custo_mes": {"$divide": [{"$ifNull": ["$custo", 0]}, {"$size": "$meses"}]}}},
+            {"$unwind": "$meses"},
+            {
+                "$set": {
+                    "mes": {
+                        "$dateFromParts": {
+                            "year": {"$floor": {"$divide": ["$meses", 12]}},
+                            "month": {"$add": [{"$mod": ["$meses", 12]}, 1]},
+                        }
+                    }
+                }
+            },
+        ],
+        filtro_origem=_meses_das_obras,
+        campos_grupo=("inicio", "fim"),
+    ),
+    # Custo das construções por tipo
+    "construcoes_por_tipo": Analise(
+        tipo="construcao",
+        colecao="analise_construcoes_por_tipo",
+        chave={"tipo": "$tipo"},
+        campos_grupo=("tipo",),
+        acumuladores={
+            "construcoes": {"$sum": 1},
+            "custo_total": {"$sum": "$custo_total"},
+            "custo_medio": {"$avg": "$custo_total"},
+            "custo_obras": {"$sum": "$custo_total_obras"},
+        },
+    ),
+}
+
+
+for _analise in ANALISES.values():
+    CAMPOS_GRUPO_ANALISES[_analise.tipo].update(_analise.campos_grupo)
+
+
+def _filtro_grupos(analise: Analise, chaves: List[dict]) -> dict:
+    return {
+        "$or": [
+            {caminho[1:]: chave.get(campo) for campo, caminho in analise.chave.items()}
+            for chave in chaves
+        ]
+    }
+
+
+def pipeline_analise(analise: Analise, marca, chaves: Optional[List[dict]] = None) -> list:
+    """Pipeline que recalcula os grupos informados (todos, se None) e os grava
+    no resumo com a marca da execução em atualizado_em."""
+    etapas = []
+    if chaves is not None:
+        filtro = (analise.filtro_origem or (lambda c: _filtro_grupos(analise, c)))(chaves)
+        etapas.append({"$match": filtro})
+    etapas += analise.preparar
+    if chaves is not None and analise.preparar:
+        # O filtro da origem pode trazer documentos de outros grupos
+        etapas.append({"$match": _filtro_grupos(analise, chaves)})
+    return etapas + [
+        {"$group": {"_id": analise.chave, **analise.acumuladores}},
+        *analise.finalizar,
+        {
+            "$set": {
+                **{campo: f"$_id.{campo}" for campo in analise.chave},
+                "atualizado_em": marca,
+            }
+        },
+        {
+            "$merge": {
+                "into": analise.colecao,
+                "on": "_id",
+                "whenMatched": "replace",
+                "whenNotMatched": "insert",
+            }
+        },
+    ]
+
+
+async def grupos_alterados(analise: Analise, desde) -> List[dict]:
+    """Chaves dos grupos com algum documento escrito a partir de `desde`,
+    inclusive os grupos de onde saíram documentos excluídos ou com a chave
+    alterada."""
+    agrupar = [*analise.preparar, {"$group": {"_id": analise.chave}}]
+    escritos = map[analise.tipo]["collection"].aggregate(
+        [{"$match": {"atualizado_em": {"$gte": desde}}}, *agrupar]
+    )
+    saidas = saidas_collection.aggregate(
+        [
+            {"$match": {"tipo": analise.tipo, "em": {"$gte": desde}}},
+            {"$replaceWith": "$documento"},
+            *agrupar,
+        ]
+    )
+    chaves = {}
+    for cursor in (escritos, saidas):
+        async for d in cursor:
+            chaves.setdefault(tuple(sorted(d["_id"].items())), d["_id"])
+    return list(chaves.values())
+
+
+async def atualizar_analise(nome: str, completo: bool = False) -> dict:
+    analise = ANALISES[nome]
+    inicio = time.perf_counter()
+    marca = agora()
+    controle = await controle_collection.find_one({"_id": nome}) or {}
+    chaves = None
+    if not completo and controle.get("marca") is not None:
+        chaves = await grupos_alterados(analise, controle["marca"] - MARGEM_RELOGIO)
+    resumo = ColecaoPreguicosa(analise.colecao)
+    removidos = 0
+    if chaves is None or chaves:
+        await map[analise.tipo]["collection"].aggregate(
+            pipeline_analise(analise, marca, chaves)
+        ).to_list(None)
+        # Grupos recalculados que não foram regravados ficaram vazios
+        obsoletos = {"atualizado_em": {"$lt": marca}}
+        if chaves is not None:
+            obsoletos["_id"] = {"$in": chaves}
+        removidos = (await resumo.delete_many(obsoletos)).deleted_count
+    relatorio = {
+        "analise": nome,
+        "modo": "completo" if chaves is None else "incremental",
+        "grupos_recalculados": None if chaves is None else len(chaves),
+        "grupos_removidos": removidos,
+        "duracao_s": round(time.perf_counter() - inicio, 4),
+    }
+    await controle_collection.update_one(
+        {"_id": nome},
+        {
+            "$set": {
+                "marca": marca,
+                "ultima_execucao": relatorio,
+                **({"ultima_completa": marca} if chaves is None else {}),
+            },
+            "$inc": {"execucoes": 1},
+        },
+        upsert=True,
+    )
+    logger.info("Análise atualizada: %s", relatorio)
+    return relatorio
+
+
+async def atualizar_analises(completo: bool = False, nomes: Optional[List[str]] = None) -> list:
+    relatorios = [await atualizar_analise(nome, completo) for nome in (nomes or ANALISES)]
+    await limpar_saidas()
+    return relatorios
+
+
+async def limpar_saidas():
+    """Remove as saídas que todas as análises já consideraram."""
+    cursor = controle_collection.find({"_id": {"$in": list(ANALISES)}})
+    marcas = [c["marca"] async for c in cursor if c.get("marca") is not None]
+    if len(marcas) == len(ANALISES):
+        await saidas_collection.delete_many({"em": {"$lt": min(marcas) - MARGEM_RELOGIO}})
+
+
+async def situacao_analises() -> list:
+    cursor = controle_collection.find({"_id": {"$in": list(ANALISES)}})
+    controles = {c["_id"]: c async for c in cursor}
+    situacao = []
+    for nome, analise in ANALISES.items():
+        controle = controles.get(nome, {})
+        situacao.append(
+            {
+                "analise": nome,
+                "colecao": analise.colecao,
+                "grupos": await ColecaoPreguicosa(analise.colecao).estimated_document_count(),
+                "marca": controle.get("marca"),
+                "ultima_completa": controle.get("ultima_completa"),
+                "execucoes": controle.get("execucoes", 0),
+                "ultima_execucao": controle.get("ultima_execucao"),
+            }
+        )
+    return situacao
+
+
+async def _obter_vez(intervalo: float) -> Optional[int]:
+    """Reserva a próxima rodada para este processo, para que só um dos
+    workers atualize as análises a cada intervalo. Retorna o número da
+    rodada, ou None se outro processo já a reservou."""
+    inicio = agora()
+    try:
+        vez = await controle_collection.find_one_and_update(
+            {"_id": "agendador", "ate": {"$not": {"$gt": inicio}}},
+            {
+                "$set": {"ate": inicio + timedelta(seconds=intervalo * 0.9), "pid": os.getpid()},
+                "$inc": {"rodadas": 1},
+            },
+            upsert=True,
+            return_document=ReturnDocument.AFTER,
+        )
+    except DuplicateKeyError:
+        return None
+    return vez["rodadas"]
+
+
+async def agendar_analises(intervalo: float, completa_a_cada: int = 24):
+    """Atualiza as análises a cada `intervalo` segundos até ser cancelado."""
+    while True:
+        await asyncio.sleep(intervalo)
+        try:
+            rodada = await _obter_vez(intervalo)
+            if rodada is not None:
+                await atualizar_analises(completo=(rodada - 1) % completa_a_cada == 0)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error("Erro ao atualizar as análises: %s", e)
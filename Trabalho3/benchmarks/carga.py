@@ -0,0 +1,282 @@
+"""Teste de carga das rotas de leitura com linha de base comparável.
+
+Dispara requisições concorrentes contra cada cenário (listagem, paginação,
+filtros, gastos, contagens e terrenos de uma pessoa) e mede vazão, latência
+p50/p95/p99 e idas ao MongoDB por requisição. As idas vêm de /metrics, lido
+antes e depois de cada cenário, então o servidor deve ter um só worker.
+
+Com --memoria a aplicação roda no próprio processo sobre o banco em memória
+(BACKEND=memoria), populado com a escala pedida, sem MongoDB nem rede. Serve
+para medir o custo do lado Python isolado da latência do banco.
+
+O resultado é gravado em JSON; com --comparar, as métricas são confrontadas
+com uma execução anterior e o processo termina com código 1 se algum cenário
+piorar além da tolerância.
+
+Uso (com o banco populado por benchmarks.dados):
+    python -m benchmarks.dados --escala 10k
+    python -m benchmarks.carga --saida base.json
+    python -m benchmarks.carga --comparar base.json --tolerancia 0.15
+    python -m benchmarks.carga --memoria 10k --saida memoria.json
+"""
+
+import argparse
+import asyncio
+import contextlib
+import importlib
+import json
+import os
+import random
+import re
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+from typing import Callable, Dict, List, NamedTuple
+
+import httpx
+
+from benchmarks.dados import ESCALAS, popular
+from benchmarks.escalabilidade import DIRETORIO, esperar_servidor, subir
+
+
+class Cenario(NamedTuple):
+    nome: str
+    rota: str  # molde da rota, como aparece em /metrics
+    caminho: Callable[[dict, random.Random], str]
+
+
+CENARIOS: List[Cenario] = [
+    Cenario("pessoas_listar", "/pessoas/", lambda a, r: "/pessoas/"),
+    Cenario("pessoas_quantidade", "/pessoas/quantidade_usuarios",
+            lambda a, r: "/pessoas/quantidade_usuarios"),
+    Cenario("pessoas_paginacao", "/pessoas/paginacao",
+            lambda a, r: f"/pessoas/paginacao?pagina={r.randrange(1, 20)}&limite=20"),
+    Cenario("pessoas_filtro_regex", "/pessoas/filter/",
+            lambda a, r: f"/pessoas/filter/?atributo=nome&busca={r.choice(a['nomes'])}"),
+    Cenario("pessoas_filtro_texto", "/pessoas/filter/",
+            lambda a, r: f"/pessoas/filter/?atributo=profissao&busca={r.choice(a['profissoes'])}&modo=texto"),
+    Cenario("pessoas_gasto", "/pessoas/total_gasto_obras/{cliente_id}",
+            lambda a, r: f"/pessoas/total_gasto_obras/{r.choice(a['pessoa'])}"),
+    Cenario("pessoas_gasto_detalhado", "/pessoas/total_gasto_obras/{cliente_id}",
+            lambda a, r: f"/pessoas/total_gasto_obras/{r.choice(a['pessoa'])}?detalhar=true"),
+    Cenario("pessoas_terrenos", "/pessoas/terrenos/{pessoa_id}",
+            lambda a, r: f"/pessoas/terrenos/{r.choice(a['pessoa'])}"),
+    Cenario("terrenos_paginacao", "/terrenos/paginacao",
+            lambda a, r: f"/terrenos/paginacao?pagina={r.randrange(1, 20)}&limite=20"),
+    Cenario("terrenos_quantidade", "/terrenos/quantidade_terrenos",
+            lambda a, r: "/terrenos/quantidade_terrenos"),
+    Cenario("terrenos_filtro_prefixo", "/terrenos/filter/",
+            lambda a, r: f"/terrenos/filter/?atributo=endereco.cidade&busca={r.choice(a['cidades'])[:3]}&modo=prefixo"),
+    Cenario("terrenos_gasto", "/terrenos/terreno/gastos_obras/{terreno_id}",
+            lambda a, r: f"/terrenos/terreno/gastos_obras/{r.choice(a['terreno'])}?detalhar=true"),
+    Cenario("construcoes_paginacao", "/contrucoes/paginacao",
+            lambda a, r: f"/contrucoes/paginacao?pagina={r.randrange(1, 20)}&limite=20"),
+    Cenario("construcoes_quantidade", "/contrucoes/quantidade_construcoes",
+            lambda a, r: "/contrucoes/quantidade_construcoes"),
+    Cenario("construcoes_filtro_regex", "/contrucoes/filter/",
+            lambda a, r: f"/contrucoes/filter/?atributo=tipo&busca={r.choice(a['tipos'])}"),
+    Cenario("obras_paginacao", "/obras/paginacao",
+            lambda a, r: f"/obras/paginacao?pagina={r.randrange(1, 20)}&limite=20"),
+    Cenario("obras_quantidade", "/obras/quantidade_obras",
+            lambda a, r: "/obras/quantidade_obras"),
+    Cenario("obras_filtro_texto", "/obras/filter/",
+            lambda a, r: f"/obras/filter/?atributo=nome&busca={r.choice(a['etapas'])}&modo=texto"),
+]
+
+PREFIXOS = {"pessoa": "/pessoas", "terreno": "/terrenos", "construcao": "/contrucoes", "obra": "/obras"}
+
+
+async def coletar_amostra(cliente: httpx.AsyncClient, tamanho: int = 200) -> dict:
+    """Ids e valores reais do banco para montar os caminhos dos cenários."""
+    amostra = {}
+    for tipo, prefixo in PREFIXOS.items():
+        resposta = await cliente.get(f"{prefixo}/paginacao", params={"limite": tamanho})
+        amostra[f"_{tipo}"] = resposta.json()["data"]
+        amostra[tipo] = [d["id"] for d in amostra[f"_{tipo}"]] or ["0" * 24]
+    amostra["nomes"] = [p["nome"].split()[0] for p in amostra["_pessoa"]] or ["Ana"]
+    amostra["profissoes"] = [p["profissao"] for p in amostra["_pessoa"]] or ["engenheira"]
+    amostra["cidades"] = [t["endereco"]["cidade"] for t in amostra["_terreno"]] or ["Fortaleza"]
+    amostra["tipos"] = [c["tipo"] for c in amostra["_construcao"]] or ["casa"]
+    amostra["etapas"] = [o["nome"].split()[0] for o in amostra["_obra"]] or ["pintura"]
+    return amostra
+
+
+_LINHA_COMANDOS = re.compile(
+    r'^mongodb_commands_by_route_total\{method="GET",route="([^"]*)"\} (\d+)$', re.M
+)
+
+
+async def comandos_por_rota(cliente: httpx.AsyncClient) -> Dict[str, int]:
+    texto = (await cliente.get("/metrics")).text
+    return {rota: int(total) for rota, total in _LINHA_COMANDOS.findall(texto)}
+
+
+def percentil(ordenados: List[float], p: float) -> float:
+    if not ordenados:
+        return 0.0
+    return ordenados[min(len(ordenados) - 1, int(p / 100 * len(ordenados)))]
+
+
+async def executar_cenario(
+    cliente: httpx.AsyncClient,
+    cenario: Cenario,
+    amostra: dict,
+    concorrencia: int,
+    requisicoes: int,
+    semente: int,
+) -> dict:
+    rng = random.Random(f"{semente}-{cenario.nome}")
+    caminhos = [cenario.caminho(amostra, rng) for _ in range(requisicoes)]
+    latencias: List[float] = []
+    erros = 0
+    fila = iter(caminhos)
+
+    async def trabalhador():
+        nonlocal erros
+        for caminho in fila:
+            inicio = time.perf_counter()
+            resposta = await cliente.get(caminho)
+            latencias.append(time.perf_counter() - inicio)
+            if resposta.status_code >= 400:
+                erros += 1
+
+    antes = await comandos_por_rota(cliente)
+    inicio = time.perf_counter()
+    await asyncio.gather(*(trabalhador() for _ in range(concorrencia)))
+    decorrido = time.perf_counter() - inicio
+    depois = await comandos_por_rota(cliente)
+
+    latencias.sort()
+    comandos = depois.get(cenario.rota, 0) - antes.get(cenario.rota, 0)
+    return {
+        "requisicoes": len(latencias),
+        "erros": erros,
+        "req_s": round(len(latencias) / decorrido, 1),
+        "p50_ms": round(percentil(latencias, 50) * 1000, 2),
+        "p95_ms": round(percentil(latencias, 95) * 1000, 2),
+        "p99_ms": round(percentil(latencias, 99) * 1000, 2),
+        "idas_por_requisicao": round(comandos / len(latencias), 2),
+    }
+
+
+def comparar(atual: dict, anterior: dict, tolerancia: float) -> List[str]:
+    """Mostra a variação de cada cenário e retorna os que pioraram."""
+    piores = []
+    print(f"{'cenário':<28} {'req/s':>16} {'p95 ms':>18} {'idas':>12}")
+    for nome, novo in atual["cenarios"].items():
+        velho = anterior["cenarios"].get(nome)
+        if velho is None:
+            continue
+        vazao = novo["req_s"] / velho["req_s"] - 1 if velho["req_s"] else 0.0
+        p95 = novo["p95_ms"] / velho["p95_ms"] - 1 if velho["p95_ms"] else 0.0
+        idas = novo["idas_por_requisicao"] - velho["idas_por_requisicao"]
+        print(
+            f"{nome:<28} {novo['req_s']:>8} ({vazao:+6.0%}) "
+            f"{novo['p95_ms']:>9} ({p95:+6.0%}) {novo['idas_por_requisicao']:>6} ({idas:+.1f})"
+        )
+        if vazao < -tolerancia or p95 > tolerancia or idas > 0:
+            piores.append(nome)
+    return piores
+
+
+def commit_atual() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=DIRETORIO, capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "desconhecido"
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--url", help="servidor já em execução; sem ele, sobe serve.py")
+    parser.add_argument(
+        "--memoria", choices=ESCALAS, help="roda no processo sobre o banco em memória"
+    )
+    parser.add_argument("--porta", type=int, default=8766)
+    parser.add_argument("--concorrencia", type=int, default=32)
+    parser.add_argument("--requisicoes", type=int, default=2000, help="por cenário")
+    parser.add_argument("--aquecimento", type=int, default=100, help="por cenário, descartadas")
+    parser.add_argument("--cenarios", nargs="+", help="nomes dos cenários (padrão: todos)")
+    parser.add_argument("--semente", type=int, default=42)
+    parser.add_argument("--saida", default="benchmark.json")
+    parser.add_argument("--comparar", help="JSON de uma execução anterior")
+    parser.add_argument("--tolerancia", type=float, default=0.10)
+    args = parser.parse_args()
+
+    cenarios = [c for c in CENARIOS if not args.cenarios or c.nome in args.cenarios]
+    processo = None
+    url = args.url
+    transporte = None
+    pilha = contextlib.AsyncExitStack()
+    if args.memoria:
+        os.environ["BACKEND"] = "memoria"
+        app = importlib.import_module("main").app
+        await pilha.enter_async_context(app.router.lifespan_context(app))
+        await popular(*ESCALAS[args.memoria], semente=args.semente)
+        url = "http://memoria"
+        transporte = httpx.ASGITransport(app=app)
+    elif url is None:
+        url = f"http://127.0.0.1:{args.porta}"
+        processo = subir(1, args.porta)
+    try:
+        if transporte is None:
+            await esperar_servidor(url)
+        limites = httpx.Limits(
+            max_connections=args.concorrencia, max_keepalive_connections=args.concorrencia
+        )
+        async with httpx.AsyncClient(
+            base_url=url, limits=limites, timeout=60, transport=transporte
+        ) as cliente:
+            amostra = await coletar_amostra(cliente)
+            resultados = {}
+            for cenario in cenarios:
+                if args.aquecimento:
+                    await executar_cenario(
+                        cliente, cenario, amostra, args.concorrencia, args.aquecimento, args.semente
+                    )
+                resultados[cenario.nome] = await executar_cenario(
+                    cliente, cenario, amostra, args.concorrencia, args.requisicoes, args.semente
+                )
+                r = resultados[cenario.nome]
+                print(
+                    f"{cenario.nome:<28} {r['req_s']:>8} req/s  p50 {r['p50_ms']:>7} ms  "
+                    f"p95 {r['p95_ms']:>7} ms  p99 {r['p99_ms']:>7} ms  "
+                    f"{r['idas_por_requisicao']:>5} idas  {r['erros']} erros"
+                )
+    finally:
+        await pilha.aclose()
+        if processo is not None:
+            processo.terminate()
+            processo.wait()
+
+    relatorio = {
+        "data": datetime.now(timezone.utc).isoformat(),
+        "commit": commit_atual(),
+        "parametros": {
+            "backend": "memoria" if args.memoria else "mongo",
+            "escala": args.memoria,
+            "concorrencia": args.concorrencia,
+            "requisicoes": args.requisicoes,
+            "semente": args.semente,
+        },
+        "cenarios": resultados,
+    }
+    with open(args.saida, "w", encoding="utf-8") as arquivo:
+        json.dump(relatorio, arquivo, indent=2, ensure_ascii=False)
+    print(f"resultado gravado em {args.saida}")
+
+    if args.comparar:
+        with open(args.comparar, encoding="utf-8") as arquivo:
+            anterior = json.load(arquivo)
+        piores = comparar(relatorio, anterior, args.tolerancia)
+        if piores:
+            print("pioraram:", ", ".join(piores))
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,197 @@
+"""Popula o banco com uma massa de dados sintética e reprodutível.
+
+Cada pessoa recebe uma árvore pessoa → terrenos → construções → obras com a
+abertura pedida. A semente é fixa, então duas execuções com os mesmos
+parâmetros geram exatamente os mesmos documentos (inclusive os _id) e os
+resultados de benchmarks diferentes podem ser comparados. Os contadores de
+gasto (custo_total_obras, quantidade_obras) já são gravados consistentes.
+
+Uso (apaga as coleções do banco configurado em MONGO_URI/MONGO_BANCO):
+    python -m benchmarks.dados --escala 100k
+    python -m benchmarks.dados --pessoas 50 --terrenos 4 --construcoes 3 --obras 10
+"""
+
+import argparse
+import asyncio
+import random
+import time
+from datetime import datetime, timedelta
+
+from bson import ObjectId
+
+import db
+from indices import aplicar_indices
+from routers.utils import TAMANHO_LOTE_INSERCAO, campos_busca, map
+
+# Abertura por nível para cada escala: pessoas, terrenos por pessoa,
+# construções por terreno e obras por construção
+ESCALAS = {
+    "10k": (100, 5, 4, 5),
+    "100k": (1_000, 5, 4, 5),
+    "1m": (10_000, 5, 4, 5),
+}
+SEMENTE = 42
+
+NOMES = ["Ana", "Bruno", "Carla", "Diego", "Elisa", "Fábio", "Gabriela", "Heitor"]
+SOBRENOMES = ["Silva", "Souza", "Oliveira", "Santos", "Pereira", "Costa", "Lima"]
+PROFISSOES = ["engenheira", "arquiteto", "médica", "professor", "advogada", "pedreiro"]
+CIDADES = [
+    ("Fortaleza", "CE"), ("Quixadá", "CE"), ("Recife", "PE"), ("Natal", "RN"),
+    ("Salvador", "BA"), ("São Paulo", "SP"), ("Curitiba", "PR"), ("Manaus", "AM"),
+]
+TIPOS_CONSTRUCAO = ["casa", "prédio", "galpão", "loja", "escola"]
+ETAPAS_OBRA = ["fundação", "alvenaria", "telhado", "elétrica", "hidráulica", "pintura"]
+
+
+def _oid(rng: random.Random) -> ObjectId:
+    """ObjectId derivado da semente, para que os ids se repitam entre execuções."""
+    return ObjectId(rng.getrandbits(96).to_bytes(12, "big"))
+
+
+def gerar_arvore(rng: random.Random, indice: int, terrenos: int, construcoes: int, obras: int):
+    """Gera os documentos de uma pessoa e de toda a sua árvore."""
+    pessoa_id = _oid(rng)
+    docs = {"pessoa": [], "terreno": [], "construcao": [], "obra": []}
+    custo_pessoa, quantidade_pessoa = 0.0, 0
+    for _ in range(terrenos):
+        terreno_id = _oid(rng)
+        cidade, estado = rng.choice(CIDADES)
+        custo_terreno, quantidade_terreno = 0.0, 0
+        construcoes_ids = []
+        for _ in range(construcoes):
+            construcao_id = _oid(rng)
+            obras_ids = []
+            custo_construcao = 0.0
+            inicio_base = datetime(2020, 1, 1) + timedelta(days=rng.randrange(1500))
+            for etapa in range(obras):
+                obra_id = _oid(rng)
+                custo = round(rng.uniform(1_000, 50_000), 2)
+                inicio = inicio_base + timedelta(days=30 * etapa)
+                docs["obra"].append({
+                    "_id": obra_id,
+                    "nome": f"{rng.choice(ETAPAS_OBRA)} {etapa + 1}",
+                    "descricao": "Obra gerada para benchmark",
+                    "inicio": inicio,
+                    "fim": inicio + timedelta(days=rng.randrange(5, 60)),
+                    "custo": custo,
+                    "contrucao_id": str(construcao_id),
+                })
+                obras_ids.append(obra_id)
+                custo_construcao += custo
+            docs["construcao"].append({
+                "_id": construcao_id,
+                "nome": f"{rng.choice(TIPOS_CONSTRUCAO)} {indice}",
+                "descricao": "Construção gerada para benchmark",
+                "custo_total": round(rng.uniform(50_000, 2_000_000), 2),
+                "tipo": rng.choice(TIPOS_CONSTRUCAO),
+                "area": round(rng.uniform(40, 2_000), 1),
+                "terreno_id": terreno_id,
+                "obras_ids": obras_ids,
+                "custo_total_obras": custo_construcao,
+                "quantidade_obras": len(obras_ids),
+            })
+            construcoes_ids.append(construcao_id)
+            custo_terreno += custo_construcao
+            quantidade_terreno += len(obras_ids)
+        docs["terreno"].append({
+            "_id": terreno_id,
+            "largura": round(rng.uniform(8, 60), 1),
+            "altua": round(rng.uniform(15, 120), 1),
+            "disponivel": rng.random() < 0.3,
+            "preco": round(rng.uniform(30_000, 3_000_000), 2),
+            "descricao": f"Terreno em {cidade}",
+            "endereco": {
+                "rua": f"Rua {rng.choice(SOBRENOMES)}",
+                "numero": rng.randrange(1, 3000),
+                "cidade": cidade,
+                "estado": estado,
+                "cep": f"{rng.randrange(10_000_000, 99_999_999)}",
+                "longitude": f"{rng.uniform(-73, -35):.6f}",
+                "latitude": f"{rng.uniform(-33, 5):.6f}",
+            },
+            "pessoas_ids": [pessoa_id],
+            "construcoes_ids": construcoes_ids,
+            "custo_total_obras": custo_terreno,
+            "quantidade_obras": quantidade_terreno,
+        })
+        custo_pessoa += custo_terreno
+        quantidade_pessoa += quantidade_terreno
+    nome = f"{rng.choice(NOMES)} {rng.choice(SOBRENOMES)}"
+    docs["pessoa"].append({
+        "_id": pessoa_id,
+        "nome": nome,
+        "email": f"pessoa{indice}@exemplo.com",
+        "idade": rng.randrange(18, 90),
+        "telefone": f"85 9{rng.randrange(10_000_000, 99_999_999)}",
+        "profissao": rng.choice(PROFISSOES),
+        "terrenos_ids": [t["_id"] for t in docs["terreno"]],
+        "custo_total_obras": custo_pessoa,
+        "quantidade_obras": quantidade_pessoa,
+    })
+    return docs
+
+
+async def popular(
+    pessoas: int,
+    terrenos: int,
+    construcoes: int,
+    obras: int,
+    semente: int = SEMENTE,
+    tamanho_lote: int = TAMANHO_LOTE_INSERCAO,
+) -> dict:
+    """Apaga as coleções e insere a massa de dados em lotes.
+
+    Os documentos são gerados e enviados aos poucos, então a memória usada
+    não cresce com o tamanho da massa. Retorna a quantidade por tipo.
+    """
+    for tipo in map:
+        await map[tipo]["collection"].drop()
+
+    rng = random.Random(semente)
+    pendentes = {tipo: [] for tipo in map}
+    totais = {tipo: 0 for tipo in map}
+
+    async def enviar(tipo: str):
+        lote, pendentes[tipo] = pendentes[tipo], []
+        if lote:
+            for doc in lote:
+                doc.update(campos_busca(tipo, doc))
+            await map[tipo]["collection"].insert_many(lote, ordered=False)
+            totais[tipo] += len(lote)
+
+    for indice in range(pessoas):
+        for tipo, docs in gerar_arvore(rng, indice, terrenos, construcoes, obras).items():
+            pendentes[tipo].extend(docs)
+        cheios = [t for t, docs in pendentes.items() if len(docs) >= tamanho_lote]
+        await asyncio.gather(*(enviar(t) for t in cheios))
+    await asyncio.gather(*(enviar(t) for t in pendentes))
+    await aplicar_indices()
+    return totais
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--escala", choices=ESCALAS, default="10k")
+    parser.add_argument("--pessoas", type=int)
+    parser.add_argument("--terrenos", type=int, help="terrenos por pessoa")
+    parser.add_argument("--construcoes", type=int, help="construções por terreno")
+    parser.add_argument("--obras", type=int, help="obras por construção")
+    parser.add_argument("--semente", type=int, default=SEMENTE)
+    args = parser.parse_args()
+
+    padrao = ESCALAS[args.escala]
+    abertura = [
+        valor if valor is not None else p
+        for valor, p in zip((args.pessoas, args.terrenos, args.construcoes, args.obras), padrao)
+    ]
+    inicio = time.perf_counter()
+    totais = await popular(*abertura, semente=args.semente)
+    decorrido = time.perf_counter() - inicio
+    for tipo, total in totais.items():
+        print(f"{tipo:>12}: {total}")
+    print(f"inserido em {decorrido:.1f}s")
+    db.fechar()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,106 @@
+"""Mede a vazão da API com 1..N workers.
+
+Para cada quantidade de workers sobe `serve.py` num subprocesso, espera a
+porta responder e dispara requisições concorrentes contra as rotas de
+listagem e de gasto. Ao final mostra req/s e a eficiência em relação a um
+worker (vazão / (workers × vazão com 1 worker)).
+
+Uso (com um mongod local populado):
+    python -m benchmarks.escalabilidade --workers 1 2 4 --duracao 10
+"""
+
+import argparse
+import asyncio
+import os
+import subprocess
+import sys
+import time
+
+import httpx
+
+DIRETORIO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+async def esperar_servidor(url: str, tempo_maximo: float = 30):
+    limite = time.monotonic() + tempo_maximo
+    async with httpx.AsyncClient() as cliente:
+        while time.monotonic() < limite:
+            try:
+                await cliente.get(f"{url}/metrics")
+                return
+            except httpx.TransportError:
+                await asyncio.sleep(0.2)
+    raise RuntimeError(f"servidor em {url} não respondeu em {tempo_maximo}s")
+
+
+async def rotas_de_teste(cliente: httpx.AsyncClient) -> list:
+    rotas = ["/pessoas/paginacao?limite=20", "/terrenos/paginacao?limite=20"]
+    resposta = await cliente.get("/pessoas/paginacao", params={"limite": 20})
+    for pessoa in resposta.json().get("data", []):
+        rotas.append(f"/pessoas/total_gasto_obras/{pessoa['id']}")
+    return rotas
+
+
+async def carga(url: str, concorrencia: int, duracao: float) -> dict:
+    limites = httpx.Limits(max_connections=concorrencia, max_keepalive_connections=concorrencia)
+    async with httpx.AsyncClient(base_url=url, limits=limites, timeout=30) as cliente:
+        rotas = await rotas_de_teste(cliente)
+        feitas = erros = 0
+        fim = time.monotonic() + duracao
+
+        async def trabalhador(deslocamento: int):
+            nonlocal feitas, erros
+            i = deslocamento
+            while time.monotonic() < fim:
+                resposta = await cliente.get(rotas[i % len(rotas)])
+                i += 1
+                feitas += 1
+                if resposta.status_code >= 500:
+                    erros += 1
+
+        inicio = time.monotonic()
+        await asyncio.gather(*(trabalhador(i) for i in range(concorrencia)))
+        decorrido = time.monotonic() - inicio
+    return {"requisicoes": feitas, "erros": erros, "req_s": feitas / decorrido}
+
+
+def subir(workers: int, porta: int) -> subprocess.Popen:
+    ambiente = {**os.environ, "LOG_ARQUIVO": os.devnull, "LOG_NIVEL": "WARNING"}
+    return subprocess.Popen(
+        [sys.executable, "serve.py", "--workers", str(workers), "--port", str(porta)],
+        cwd=DIRETORIO,
+        env=ambiente,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--porta", type=int, default=8765)
+    parser.add_argument("--concorrencia", type=int, default=64)
+    parser.add_argument("--duracao", type=float, default=10)
+    args = parser.parse_args()
+
+    url = f"http://127.0.0.1:{args.porta}"
+    resultados = []
+    for workers in args.workers:
+        processo = subir(workers, args.porta)
+        try:
+            await esperar_servidor(url)
+            resultado = await carga(url, args.concorrencia, args.duracao)
+        finally:
+            processo.terminate()
+            processo.wait()
+        resultados.append((workers, resultado))
+
+    base = resultados[0][1]["req_s"] / resultados[0][0]
+    print(f"{'workers':>8} {'req/s':>10} {'erros':>7} {'eficiência':>11}")
+    for workers, r in resultados:
+        eficiencia = r["req_s"] / (workers * base)
+        print(f"{workers:>8} {r['req_s']:>10.1f} {r['erros']:>7} {eficiencia:>10.0%}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
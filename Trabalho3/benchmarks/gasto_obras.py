@@ -0,0 +1,112 @@
+"""Compara o cálculo de gasto por pessoa feito em laço com o feito por agregação.
+
+Uso (com um mongod local rodando):
+    python -m benchmarks.gasto_obras --terrenos 50 --construcoes 4 --obras 10
+"""
+
+import argparse
+import asyncio
+import random
+import time
+
+import motor.motor_asyncio
+from bson import ObjectId
+
+from routers.utils import pipeline_gastos
+
+
+async def popular(db, terrenos: int, construcoes: int, obras: int) -> ObjectId:
+    """Cria uma pessoa com a árvore de terrenos/construções/obras pedida."""
+    for nome in ("pessoas", "terrenos", "construcao", "obras"):
+        await db[nome].drop()
+
+    rng = random.Random(42)
+    pessoa_id = ObjectId()
+    terrenos_docs, construcoes_docs, obras_docs = [], [], []
+    for _ in range(terrenos):
+        terreno_id = ObjectId()
+        construcoes_ids = []
+        for _ in range(construcoes):
+            construcao_id = ObjectId()
+            obras_ids = [ObjectId() for _ in range(obras)]
+            obras_docs.extend(
+                {"_id": o, "custo": rng.uniform(1_000, 50_000), "contrucao_id": str(construcao_id)}
+                for o in obras_ids
+            )
+            construcoes_docs.append(
+                {"_id": construcao_id, "terreno_id": terreno_id, "obras_ids": obras_ids}
+            )
+            construcoes_ids.append(construcao_id)
+        terrenos_docs.append(
+            {"_id": terreno_id, "pessoas_ids": [pessoa_id], "construcoes_ids": construcoes_ids}
+        )
+
+    await db["pessoas"].insert_one(
+        {"_id": pessoa_id, "terrenos_ids": [t["_id"] for t in terrenos_docs]}
+    )
+    await db["terrenos"].insert_many(terrenos_docs)
+    await db["construcao"].insert_many(construcoes_docs)
+    await db["obras"].insert_many(obras_docs)
+    return pessoa_id
+
+
+async def gasto_em_laco(db, pessoa_id: ObjectId) -> float:
+    """Implementação antiga: um find_one por nó da árvore."""
+    pessoa = await db["pessoas"].find_one({"_id": pessoa_id})
+    total = 0.0
+    for t in pessoa["terrenos_ids"]:
+        terreno = await db["terrenos"].find_one({"_id": t})
+        for c in terreno["construcoes_ids"]:
+            construcao = await db["construcao"].find_one({"_id": c})
+            for o in construcao["obras_ids"]:
+                obra = await db["obras"].find_one({"_id": o})
+                if obra:
+                    total += float(obra["custo"])
+    return total
+
+
+async def gasto_em_agregacao(db, pessoa_id: ObjectId) -> float:
+    pipeline = [{"$match": {"_id": pessoa_id}}, *pipeline_gastos("pessoa")]
+    data = await db["pessoas"].aggregate(pipeline).to_list(length=1)
+    return data[0]["gasto_total"]
+
+
+async def cronometrar(funcao, *args, repeticoes: int):
+    inicio = time.perf_counter()
+    for _ in range(repeticoes):
+        resultado = await funcao(*args)
+    return resultado, (time.perf_counter() - inicio) / repeticoes
+
+
+async def main(args):
+    client = motor.motor_asyncio.AsyncIOMotorClient(args.uri)
+    db = client[args.banco]
+    pessoa_id = await popular(db, args.terrenos, args.construcoes, args.obras)
+
+    total_laco, tempo_laco = await cronometrar(
+        gasto_em_laco, db, pessoa_id, repeticoes=args.repeticoes
+    )
+    total_agg, tempo_agg = await cronometrar(
+        gasto_em_agregacao, db, pessoa_id, repeticoes=args.repeticoes
+    )
+
+    nos = 1 + args.terrenos * (1 + args.construcoes * (1 + args.obras))
+    print(f"nós na árvore: {nos}")
+    print(f"laço:      {tempo_laco * 1000:10.2f} ms  total={total_laco:.2f}")
+    print(f"agregação: {tempo_agg * 1000:10.2f} ms  total={total_agg:.2f}")
+    print(f"speedup:   {tempo_laco / tempo_agg:10.1f}x")
+    assert abs(total_laco - total_agg) < 1e-6 * max(1.0, total_laco)
+
+    await client.drop_database(args.banco)
+    client.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--uri", default="mongodb://localhost:27017")
+    parser.add_argument("--banco", default="benchmark_gastos")
+    parser.add_argument("--terrenos", type=int, default=50)
+    parser.add_argument("--construcoes", type=int, default=4)
+    parser.add_argument("--obras", type=int, default=10)
+    parser.add_argument("--repeticoes", type=int, default=5)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,104 @@
+"""Mede documentos/s na conversão de documentos do banco para a resposta JSON.
+
+Compara o caminho antigo (from_mongo validando cada modelo e o FastAPI
+validando e serializando de novo pelo response_model) com o caminho direto
+(conversor gerado por modelo + serialização para bytes).
+
+Não precisa de banco:
+    python -m benchmarks.serializacao --documentos 20000
+"""
+
+import argparse
+import random
+import time
+from datetime import datetime, timedelta
+from typing import List
+
+from bson import ObjectId
+from fastapi.encoders import jsonable_encoder
+from pydantic import TypeAdapter
+
+from models import Obra, Terreno
+from routers.utils import serializar
+
+
+def gerar_obras(n: int, rng: random.Random) -> list:
+    return [
+        {
+            "_id": ObjectId(),
+            "nome": f"Obra {i}",
+            "descricao": "Reforma da fachada e troca do telhado",
+            "inicio": datetime(2024, 1, 1) + timedelta(days=rng.randint(0, 365)),
+            "fim": None,
+            "custo": rng.uniform(1_000, 50_000),
+            "contrucao_id": str(ObjectId()),
+        }
+        for i in range(n)
+    ]
+
+
+def gerar_terrenos(n: int, rng: random.Random) -> list:
+    return [
+        {
+            "_id": ObjectId(),
+            "largura": rng.uniform(8, 30),
+            "altua": rng.uniform(20, 50),
+            "disponivel": rng.random() < 0.5,
+            "preco": rng.uniform(50_000, 500_000),
+            "descricao": "Terreno plano com escritura",
+            "endereco": {
+                "rua": "Rua A",
+                "numero": i,
+                "cidade": "Fortaleza",
+                "estado": "CE",
+                "cep": "60000-000",
+                "longitude": "-38.5",
+                "latitude": "-3.7",
+            },
+            "pessoas_ids": [ObjectId() for _ in range(2)],
+            "construcoes_ids": [ObjectId() for _ in range(3)],
+            "custo_total_obras": 0.0,
+            "quantidade_obras": 0,
+        }
+        for i in range(n)
+    ]
+
+
+def caminho_antigo(modelo, docs: list) -> bytes:
+    # O FastAPI valida o retorno contra List[modelo] e serializa o resultado
+    adaptador = TypeAdapter(List[modelo])
+    modelos = [modelo.from_mongo(d) for d in docs]
+    validados = adaptador.validate_python(jsonable_encoder(modelos))
+    return adaptador.dump_json(validados)
+
+
+def caminho_direto(modelo, docs: list) -> bytes:
+    return serializar([modelo.documento_resposta(d) for d in docs])
+
+
+def medir(funcao, modelo, docs: list, repeticoes: int) -> float:
+    inicio = time.perf_counter()
+    for _ in range(repeticoes):
+        funcao(modelo, docs)
+    return len(docs) * repeticoes / (time.perf_counter() - inicio)
+
+
+def main(args):
+    rng = random.Random(42)
+    for modelo, docs in (
+        (Obra, gerar_obras(args.documentos, rng)),
+        (Terreno, gerar_terrenos(args.documentos, rng)),
+    ):
+        antigo = medir(caminho_antigo, modelo, docs, args.repeticoes)
+        direto = medir(caminho_direto, modelo, docs, args.repeticoes)
+        print(
+            f"{modelo.__name__:<8} antigo: {antigo:>10.0f} docs/s  "
+            f"direto: {direto:>10.0f} docs/s  ({direto / antigo:.1f}x)"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--documentos", type=int, default=20_000)
+    parser.add_argument("--repeticoes", type=int, default=3)
+    main(parser.parse_args())
@@ -0,0 +1,154 @@
+"""Exclusão em cascata guiada pelos relacionamentos de models.RELACOES.
+
+Os ids de todos os descendentes são coletados nível a nível com consultas
+$in em lote, excluídos com delete_many e retirados das listas de quem os
+referencia com $pull em lote. Quando o servidor suporta transações (replica
+set ou mongos) tudo acontece em uma única transação.
+"""
+
+from contextlib import asynccontextmanager
+from typing import Dict, List
+
+from bson import ObjectId
+from fastapi import HTTPException
+
+from db import obter_cliente
+from logs import logging
+from models import RELACOES
+from routers.utils import (
+    cache,
+    map,
+    propagar_gastos,
+    propagar_gastos_terrenos,
+    registrar_saidas,
+)
+
+logger = logging.getLogger(__name__)
+
+# Quantidade máxima de ids por consulta $in
+TAMANHO_LOTE_CASCATA = 10_000
+
+_suporta_transacoes = None
+
+
+async def suporta_transacoes() -> bool:
+    global _suporta_transacoes
+    if _suporta_transacoes is None:
+        hello = await obter_cliente().admin.command("hello")
+        _suporta_transacoes = "setName" in hello or hello.get("msg") == "isdbgrid"
+    return _suporta_transacoes
+
+
+@asynccontextmanager
+async def transacao():
+    """Abre uma sessão com transação se o servidor suportar; senão, devolve None."""
+    if not await suporta_transacoes():
+        yield None
+        return
+    async with await obter_cliente().start_session() as sessao:
+        async with sessao.start_transaction():
+            yield sessao
+
+
+def _lotes(ids: List[ObjectId]):
+    for inicio in range(0, len(ids), TAMANHO_LOTE_CASCATA):
+        yield ids[inicio : inicio + TAMANHO_LOTE_CASCATA]
+
+
+async def coletar_descendentes(tipo: str, ids: List[ObjectId], sessao=None) -> Dict[str, List[ObjectId]]:
+    """Retorna os ids a excluir por tipo, começando pelos informados."""
+    coletados = {tipo: list(ids)}
+    pendentes = [(tipo, list(ids))]
+    while pendentes:
+        tipo_pai, ids_pai = pendentes.pop()
+        for filho in RELACOES[tipo_pai]["filhos"]:
+            ids_filhos = []
+            for lote in _lotes(ids_pai):
+                # Algumas referências foram gravadas como str, então busca os
+                # dois formatos
+                valores = lote + [str(i) for i in lote]
+                cursor = map[filho.tipo]["collection"].find(
+                    {filho.campo_pai: {"$in": valores}}, {"_id": 1}, session=sessao
+                )
+                ids_filhos.extend([d["_id"] async for d in cursor])
+            if ids_filhos:
+                coletados.setdefault(filho.tipo, []).extend(ids_filhos)
+                pendentes.append((filho.tipo, ids_filhos))
+    return coletados
+
+
+async def _descontar_gastos(tipo: str, raiz: dict, sessao=None):
+    """Tira os gastos com obras da raiz excluída dos níveis acima dela."""
+    if tipo == "obra":
+        await propagar_gastos(
+            {ObjectId(raiz["contrucao_id"]): (-raiz.get("custo", 0), -1)}, sessao
+        )
+    elif tipo == "construcao" and raiz.get("terreno_id") is not None:
+        await propagar_gastos_terrenos(
+            {
+                ObjectId(raiz["terreno_id"]): (
+                    -raiz.get("custo_total_obras", 0),
+                    -raiz.get("quantidade_obras", 0),
+                )
+            },
+            sessao,
+        )
+    elif tipo == "terreno":
+        # O próprio terreno será excluído; o update dele não encontra nada
+        await propagar_gastos_terrenos(
+            {
+                raiz["_id"]: (
+                    -raiz.get("custo_total_obras", 0),
+                    -raiz.get("quantidade_obras", 0),
+                )
+            },
+            sessao,
+        )
+
+
+async def excluir_em_cascata(tipo: str, id: str) -> Dict[str, int]:
+    """Exclui o documento, todos os seus descendentes e as referências a eles.
+
+    Retorna quantos documentos de cada tipo foram excluídos.
+    """
+    raiz_id = ObjectId(id)
+    async with transacao() as sessao:
+        raiz = await map[tipo]["collection"].find_one({"_id": raiz_id}, session=sessao)
+        if raiz is None:
+            raise HTTPException(
+                detail=str(map[tipo]["type"].__name__) + " not found", status_code=404
+            )
+        coletados = await coletar_descendentes(tipo, [raiz_id], sessao)
+
+        # Os contadores são ajustados antes do $pull, que desfaz os vínculos
+        # usados para encontrar as pessoas donas do terreno
+        await _descontar_gastos(tipo, raiz, sessao)
+
+        excluidos = {}
+        for tipo_excluido, ids in coletados.items():
+            excluidos[tipo_excluido] = 0
+            for lote in _lotes(ids):
+                # Os grupos das análises que perdem esses documentos
+                await registrar_saidas(tipo_excluido, {"_id": {"$in": lote}}, sessao=sessao)
+                resultado = await map[tipo_excluido]["collection"].delete_many(
+                    {"_id": {"$in": lote}}, session=sessao
+                )
+                excluidos[tipo_excluido] += resultado.deleted_count
+            for referencia in RELACOES[tipo_excluido]["referencias"]:
+                # Os descendentes só são referenciados pelos próprios pais,
+                # que também foram excluídos
+                if referencia.tipo in coletados:
+                    continue
+                for lote in _lotes(ids):
+                    await map[referencia.tipo]["collection"].update_many(
+                        {referencia.campo_ids: {"$in": lote}},
+                        {"$pull": {referencia.campo_ids: {"$in": lote}}},
+                        session=sessao,
+                    )
+
+    for tipo_excluido, ids in coletados.items():
+        await cache.invalidar(tipo_excluido, *ids)
+    for referencia in RELACOES[tipo]["referencias"]:
+        await cache.invalidar_referencias(referencia.tipo, referencia.campo_ids, raiz_id)
+    logger.info("Exclusão em cascata de %s %s: %s", tipo, id, excluidos)
+    return excluidos
@@ -1,11 +1,119 @@
+"""Conexão com o MongoDB.
+
+O cliente é configurado por variáveis de ambiente (ou por um arquivo .env) e
+criado no lifespan da aplicação, que também aquece o pool de conexões e o
+fecha no desligamento. Scripts fora da aplicação (admin.py, benchmarks)
+criam o cliente sob demanda no primeiro uso.
+
+Variáveis de ambiente:
+    MONGO_URI                         padrão mongodb://localhost:27017
+    MONGO_BANCO                       padrão mydb2
+    MONGO_MAX_POOL                    padrão 100
+    MONGO_MIN_POOL                    conexões mantidas abertas, padrão 10
+    MONGO_WAIT_QUEUE_TIMEOUT_MS       espera por uma conexão livre, padrão 5000
+    MONGO_CONNECT_TIMEOUT_MS          padrão 5000
+    MONGO_SOCKET_TIMEOUT_MS           padrão 30000
+    MONGO_SERVER_SELECTION_TIMEOUT_MS padrão 5000
+    MONGO_COMPRESSORES                ex. "zstd,snappy,zlib", padrão "zlib"
+    BACKEND                           "mongo" (padrão) ou "memoria", que troca o
+                                      MongoDB pelo banco em memória de memoria.py
+
+Toda a aplicação acessa os dados pelas coleções deste módulo, então o
+backend é trocado aqui sem mudar os routers.
+"""
+
+import asyncio
+import os
+from typing import Optional
+
 import motor.motor_asyncio
-from motor.motor_asyncio import AsyncIOMotorCollection
+from dotenv import load_dotenv
+from motor.motor_asyncio import AsyncIOMotorClient, AsyncIOMotorCollection, AsyncIOMotorDatabase
+from memoria import ClienteMemoria
+from metricas import ouvinte_comandos
+
+load_dotenv()
+
+client: Optional[AsyncIOMotorClient] = None
+# Processo que criou o cliente; depois de um fork o filho cria o seu
+_pid_cliente: Optional[int] = None
+
+
+def backend() -> str:
+    return os.getenv("BACKEND", "mongo").lower()
+
+
+def configuracao_cliente() -> dict:
+    """Opções do AsyncIOMotorClient lidas do ambiente."""
+    return {
+        "host": os.getenv("MONGO_URI", "mongodb://localhost:27017"),
+        "maxPoolSize": int(os.getenv("MONGO_MAX_POOL", "100")),
+        "minPoolSize": int(os.getenv("MONGO_MIN_POOL", "10")),
+        "waitQueueTimeoutMS": int(os.getenv("MONGO_WAIT_QUEUE_TIMEOUT_MS", "5000")),
+        "connectTimeoutMS": int(os.getenv("MONGO_CONNECT_TIMEOUT_MS", "5000")),
+        "socketTimeoutMS": int(os.getenv("MONGO_SOCKET_TIMEOUT_MS", "30000")),
+        "serverSelectionTimeoutMS": int(
+            os.getenv("MONGO_SERVER_SELECTION_TIMEOUT_MS", "5000")
+        ),
+        "compressors": os.getenv("MONGO_COMPRESSORES", "zlib"),
+        "event_listeners": [ouvinte_comandos],
+    }
+
+
+def obter_cliente() -> AsyncIOMotorClient:
+    """Retorna o cliente atual, criando-o se ainda não existir."""
+    global client, _pid_cliente
+    if client is None and backend() == "memoria":
+        client = ClienteMemoria()
+    elif client is None or (
+        _pid_cliente != os.getpid() and not isinstance(client, ClienteMemoria)
+    ):
+        # O cliente herdado de um fork não é fechado: os sockets dele ainda
+        # pertencem ao processo pai
+        client = motor.motor_asyncio.AsyncIOMotorClient(**configuracao_cliente())
+    _pid_cliente = os.getpid()
+    return client
+
+
+def obter_banco() -> AsyncIOMotorDatabase:
+    return obter_cliente()[os.getenv("MONGO_BANCO", "mydb2")]
+
+
+async def conectar(aquecer: bool = True) -> AsyncIOMotorClient:
+    """Cria o cliente e, se pedido, abre minPoolSize conexões antes de
+    retornar, para que as primeiras requisições não paguem o handshake."""
+    cliente = obter_cliente()
+    if aquecer:
+        conexoes = max(1, configuracao_cliente()["minPoolSize"])
+        await asyncio.gather(*(cliente.admin.command("ping") for _ in range(conexoes)))
+    return cliente
+
+
+def fechar():
+    global client
+    if client is not None:
+        client.close()
+        client = None
+
+
+class ColecaoPreguicosa:
+    """Coleção resolvida no banco do cliente atual a cada uso.
+
+    Permite que os módulos importem as coleções na carga sem criar o cliente
+    nesse momento, e que o cliente seja recriado (ex. depois de um fork).
+    """
+
+    def __init__(self, nome: str):
+        self.name = nome
+
+    def colecao(self) -> AsyncIOMotorCollection:
+        return obter_banco()[self.name]
 
-client = motor.motor_asyncio.AsyncIOMotorClient()
+    def __getattr__(self, atributo):
+        return getattr(self.colecao(), atributo)
 
-db = client["mydb2"]
 
-pessoas_collection = db["pessoas"]
-terrenos_collection = db["terrenos"]
-construcao_collection = db["construcao"]
-obras_collection = db["obras"]
+pessoas_collection = ColecaoPreguicosa("pessoas")
+terrenos_collection = ColecaoPreguicosa("terrenos")
+construcao_collection = ColecaoPreguicosa("construcao")
+obras_collection = ColecaoPreguicosa("obras")
@@ -0,0 +1,303 @@
+"""Exportação de coleções inteiras em NDJSON, CSV ou Parquet.
+
+Os documentos são lidos de um único cursor (sem skip nem contagens) e
+serializados em pedaços conforme chegam, então a memória usada não depende
+do tamanho da coleção: no máximo um lote do cursor e um pedaço (ou, no
+Parquet, um grupo de linhas). Os filtros são os mesmos da consulta
+estruturada (models.Consulta) e `campos` restringe as colunas.
+
+No CSV e no Parquet os campos aninhados viram colunas próprias
+(endereco.cidade) e as listas de ids viram texto, separado por "|" no CSV e
+uma coluna de lista de strings no Parquet. O Parquet depende do pacote
+opcional pyarrow.
+"""
+
+import csv
+import io
+import zlib
+from datetime import datetime
+from types import UnionType
+from typing import AsyncIterator, List, NamedTuple, Optional, Union, get_args, get_origin
+
+from fastapi import HTTPException
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel
+
+from logs import logging
+from models import Consulta
+from routers.utils import compilar_consulta, map, projecao_campos, serializar
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:  # pyarrow é opcional; sem ele o formato parquet fica indisponível
+    pyarrow = None
+
+logger = logging.getLogger(__name__)
+
+FORMATOS = {
+    "ndjson": ("application/x-ndjson", "ndjson"),
+    "csv": ("text/csv; charset=utf-8", "csv"),
+    "parquet": ("application/vnd.apache.parquet", "parquet"),
+}
+# Documentos pedidos ao banco por lote do cursor
+TAMANHO_LOTE_EXPORTACAO = 2000
+# Linhas serializadas por pedaço enviado no NDJSON e no CSV
+LINHAS_POR_PEDACO = 1000
+# Linhas por grupo de linhas (row group) do Parquet
+LINHAS_POR_GRUPO = 50_000
+NIVEL_GZIP = 6
+
+
+class Coluna(NamedTuple):
+    caminho: str  # ex. endereco.cidade
+    tipo: type
+    lista: bool
+
+
+def colunas_do_modelo(modelo, prefixo: str = "") -> List[Coluna]:
+    """Colunas escalares do modelo, com os submodelos expandidos."""
+    colunas = []
+    for nome, campo in modelo.model_fields.items():
+        anotacao = campo.annotation
+        while get_origin(anotacao) in (Union, UnionType):
+            anotacao = next(a for a in get_args(anotacao) if a is not type(None))
+        lista = get_origin(anotacao) is list
+        if lista:
+            anotacao = get_args(anotacao)[0]
+        if not lista and isinstance(anotacao, type) and issubclass(anotacao, BaseModel):
+            colunas.extend(colunas_do_modelo(anotacao, f"{prefixo}{nome}."))
+        else:
+            colunas.append(Coluna(prefixo + nome, anotacao, lista))
+    return colunas
+
+
+def _selecionar_colunas(colunas: List[Coluna], projecao: Optional[dict]) -> List[Coluna]:
+    if projecao is None:
+        return colunas
+    return [
+        c
+        for c in colunas
+        if c.caminho == "id"
+        or any(c.caminho == p or c.caminho.startswith(p + ".") for p in projecao)
+    ]
+
+
+def _obter(doc: dict, caminho: str):
+    for parte in caminho.split("."):
+        if not isinstance(doc, dict):
+            return None
+        doc = doc.get(parte)
+    return doc
+
+
+async def documentos_exportacao(
+    tipo: str, filtro: dict, projecao: Optional[dict]
+) -> AsyncIterator[dict]:
+    """Documentos no formato de resposta do modelo, conforme chegam do cursor."""
+    modelo = map[tipo]["type"]
+    cursor = map[tipo]["collection"].find(filtro, projecao).batch_size(TAMANHO_LOTE_EXPORTACAO)
+    async for d in cursor:
+        resposta = modelo.documento_resposta(d)
+        if projecao is not None:
+            # Sem os padrões que o conversor completaria nos campos não pedidos
+            resposta = {c: v for c, v in resposta.items() if c == "id" or c in d}
+        yield resposta
+
+
+async def _ndjson(documentos: AsyncIterator[dict], colunas: List[Coluna]):
+    pedaco = []
+    async for doc in documentos:
+        pedaco.append(serializar(doc))
+        if len(pedaco) >= LINHAS_POR_PEDACO:
+            yield b"\n".join(pedaco) + b"\n"
+            pedaco = []
+    if pedaco:
+        yield b"\n".join(pedaco) + b"\n"
+
+
+def _texto_csv(valor) -> str:
+    if valor is None:
+        return ""
+    if isinstance(valor, list):
+        return "|".join(_texto_csv(v) for v in valor)
+    if isinstance(valor, datetime):
+        return valor.isoformat()
+    if isinstance(valor, bool):
+        return "true" if valor else "false"
+    return str(valor)
+
+
+async def _csv(documentos: AsyncIterator[dict], colunas: List[Coluna]):
+    saida = io.StringIO()
+    escritor = csv.writer(saida, lineterminator="\n")
+    escritor.writerow([c.caminho for c in colunas])
+    linhas = 0
+    async for doc in documentos:
+        escritor.writerow([_texto_csv(_obter(doc, c.caminho)) for c in colunas])
+        linhas += 1
+        if linhas >= LINHAS_POR_PEDACO:
+            yield saida.getvalue().encode()
+            saida.seek(0)
+            saida.truncate()
+            linhas = 0
+    yield saida.getvalue().encode()
+
+
+class _SaidaEmPedacos:
+    """Arquivo só de escrita cujo conteúdo é recolhido a cada grupo de linhas,
+    para que o Parquet seja transmitido sem ser montado inteiro em memória."""
+
+    def __init__(self):
+        self.partes = []
+        self.posicao = 0
+        self.closed = False
+
+    def write(self, dados) -> int:
+        self.partes.append(bytes(dados))
+        self.posicao += len(dados)
+        return len(dados)
+
+    def tell(self) -> int:
+        return self.posicao
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def recolher(self) -> bytes:
+        dados = b"".join(self.partes)
+        self.partes = []
+        return dados
+
+
+def _esquema_parquet(colunas: List[Coluna]):
+    tipos = {
+        int: pyarrow.int64(),
+        float: pyarrow.float64(),
+        bool: pyarrow.bool_(),
+        datetime: pyarrow.timestamp("ms"),
+    }
+    campos = []
+    for coluna in colunas:
+        tipo = tipos.get(coluna.tipo, pyarrow.string())
+        if coluna.lista:
+            tipo = pyarrow.list_(tipo)
+        campos.append(pyarrow.field(coluna.caminho, tipo))
+    return pyarrow.schema(campos)
+
+
+def _valor_parquet(valor, texto: bool):
+    if texto and valor is not None and not isinstance(valor, (str, list)):
+        return str(valor)
+    return valor
+
+
+async def _parquet(
+    documentos: AsyncIterator[dict],
+    colunas: List[Coluna],
+    linhas_por_grupo: int = LINHAS_POR_GRUPO,
+):
+    esquema = _esquema_parquet(colunas)
+    textuais = [c.tipo not in (int, float, bool, datetime) and not c.lista for c in colunas]
+    saida = _SaidaEmPedacos()
+    escritor = pyarrow.parquet.ParquetWriter(
+        pyarrow.PythonFile(saida, mode="w"), esquema, compression="snappy"
+    )
+    valores = [[] for _ in colunas]
+
+    def gravar_grupo():
+        tabela = pyarrow.Table.from_arrays(
+            [pyarrow.array(v, type=esquema.field(i).type) for i, v in enumerate(valores)],
+            schema=esquema,
+        )
+        escritor.write_table(tabela, row_group_size=linhas_por_grupo)
+        for v in valores:
+            v.clear()
+
+    try:
+        async for doc in documentos:
+            for i, coluna in enumerate(colunas):
+                valores[i].append(_valor_parquet(_obter(doc, coluna.caminho), textuais[i]))
+            if len(valores[0]) >= linhas_por_grupo:
+                gravar_grupo()
+                yield saida.recolher()
+        if valores[0]:
+            gravar_grupo()
+    finally:
+        escritor.close()
+    yield saida.recolher()
+
+
+async def _gzip(pedacos: AsyncIterator[bytes]):
+    compressor = zlib.compressobj(NIVEL_GZIP, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    async for pedaco in pedacos:
+        dados = compressor.compress(pedaco)
+        if dados:
+            yield dados
+    yield compressor.flush()
+
+
+async def _registrar_erros(tipo: str, pedacos: AsyncIterator[bytes]):
+    try:
+        async for pedaco in pedacos:
+            yield pedaco
+    except Exception as e:
+        # O status já foi enviado, então só resta registrar e encerrar
+        logger.error("Erro ao exportar documentos do tipo %s: %s", tipo, e)
+        raise
+
+
+def exportar(
+    tipo: str,
+    formato: str = "ndjson",
+    consulta: Optional[Consulta] = None,
+    campos: Optional[str] = None,
+    compactar: bool = False,
+    linhas_por_grupo: int = LINHAS_POR_GRUPO,
+) -> AsyncIterator[bytes]:
+    """Valida o pedido e devolve o gerador dos bytes exportados.
+
+    A validação acontece aqui, antes do primeiro pedaço, para que erros no
+    pedido virem um 400 e não uma resposta interrompida.
+    """
+    if formato not in FORMATOS:
+        raise HTTPException(status_code=400, detail=f"Formato {formato} não suportado.")
+    if formato == "parquet" and pyarrow is None:
+        raise HTTPException(
+            status_code=400, detail="O formato parquet requer o pacote pyarrow instalado."
+        )
+    if linhas_por_grupo < 1:
+        raise HTTPException(status_code=400, detail="linhas_por_grupo precisa ser maior que 0")
+    filtro, _ = compilar_consulta(tipo, consulta or Consulta())
+    projecao = projecao_campos(tipo, campos)
+    # O id vem primeiro, seguido dos campos na ordem do modelo
+    colunas = sorted(colunas_do_modelo(map[tipo]["type"]), key=lambda c: c.caminho != "id")
+    colunas = _selecionar_colunas(colunas, projecao)
+    documentos = documentos_exportacao(tipo, filtro, projecao)
+    if formato == "parquet":
+        pedacos = _parquet(documentos, colunas, linhas_por_grupo)
+    else:
+        pedacos = {"ndjson": _ndjson, "csv": _csv}[formato](documentos, colunas)
+    if compactar:
+        pedacos = _gzip(pedacos)
+    logger.info("Exportando %s em %s (gzip: %s)", tipo, formato, compactar)
+    return _registrar_erros(tipo, pedacos)
+
+
+def resposta_exportacao(
+    tipo: str,
+    formato: str = "ndjson",
+    consulta: Optional[Consulta] = None,
+    campos: Optional[str] = None,
+    compactar: bool = False,
+    linhas_por_grupo: int = LINHAS_POR_GRUPO,
+) -> StreamingResponse:
+    pedacos = exportar(tipo, formato, consulta, campos, compactar, linhas_por_grupo)
+    media_type, extensao = FORMATOS[formato]
+    cabecalhos = {"Content-Disposition": f'attachment; filename="{tipo}.{extensao}"'}
+    if compactar:
+        cabecalhos["Content-Encoding"] = "gzip"
+    return StreamingResponse(pedacos, media_type=media_type, headers=cabecalhos)
@@ -0,0 +1,434 @@
+"""Importação de arquivos grandes em NDJSON ou CSV.
+
+O arquivo é lido como um fluxo de pedaços e dividido em linhas conforme
+chega. As linhas são validadas contra os modelos *Base em lotes e gravadas
+com insert_many não ordenado (routers.utils.inserir_em_lote), com no máximo
+`concorrencia` lotes em gravação ao mesmo tempo; enquanto todos estão
+ocupados a leitura do arquivo fica parada, então a memória usada depende do
+tamanho do lote e não do arquivo.
+
+Um mesmo arquivo pode misturar entidades: cada linha pode trazer o campo
+`entidade` (pessoa, terreno, construcao ou obra), que tem precedência sobre
+a entidade padrão da importação. O campo `id` de uma linha é uma chave
+local: ela recebe um ObjectId novo ao ser lida, e as referências
+(`terreno_id` das construções, `contrucao_id` das obras) são resolvidas
+primeiro contra as chaves de linhas anteriores do arquivo e depois contra
+os documentos já existentes no banco. Por isso os pais precisam vir antes
+dos filhos. As chaves lidas ficam em memória até o fim da importação.
+
+No CSV os campos aninhados vêm em colunas com ponto (endereco.cidade), como
+na exportação, e células vazias são tratadas como ausentes.
+
+Cada lote de construções e de obras atualiza as listas do pai
+(construcoes_ids, obras_ids) com um bulk_write agrupado por pai, e os lotes
+de obras propagam os gastos como em /obras/bulk.
+"""
+
+import asyncio
+import codecs
+import csv
+import itertools
+import time
+import zlib
+from collections import defaultdict
+from typing import AsyncIterator, Callable, Dict, List, NamedTuple, Optional
+
+from bson import ObjectId
+from fastapi import HTTPException
+from pymongo import UpdateOne
+
+from logs import logging
+from metricas import metricas
+from models import ConstrucaoBase, ObraBase, PessoaBase, TerrenoBase
+from routers.utils import (
+    buscar_por_ids,
+    cache,
+    desserializar,
+    inserir_em_lote,
+    map,
+    propagar_gastos,
+    validar_lote,
+)
+
+logger = logging.getLogger(__name__)
+
+FORMATOS_IMPORTACAO = ("ndjson", "csv")
+# Na ordem em que os lotes pendentes são gravados: pais antes dos filhos
+ENTIDADES = {
+    "pessoa": PessoaBase,
+    "terreno": TerrenoBase,
+    "construcao": ConstrucaoBase,
+    "obra": ObraBase,
+}
+TAMANHO_LOTE_IMPORTACAO = 1000
+CONCORRENCIA_IMPORTACAO = 4
+CONCORRENCIA_MAXIMA = 16
+# Erros de linha devolvidos no resumo; os demais só são contados
+LIMITE_ERROS = 1000
+# Uma linha maior que isso indica um arquivo sem quebras de linha
+TAMANHO_MAXIMO_LINHA = 1_000_000
+
+
+class Referencia(NamedTuple):
+    campo: str  # campo do filho com a chave do pai
+    tipo: str  # tipo do pai
+    lista: str  # lista de filhos no pai
+    converter: Callable  # como o id do pai é gravado no filho
+
+
+REFERENCIAS = {
+    "construcao": Referencia("terreno_id", "terreno", "construcoes_ids", ObjectId),
+    "obra": Referencia("contrucao_id", "construcao", "obras_ids", str),
+}
+
+# Importações em andamento neste processo, para GET /importar/
+EM_ANDAMENTO: Dict[str, "Importacao"] = {}
+
+
+class ErroImportacao(Exception):
+    """Erro que impede a leitura do restante do arquivo."""
+
+
+class _Chave:
+    """Linha do arquivo que pode ser referenciada por outras."""
+
+    __slots__ = ("tipo", "id", "lote")
+
+    def __init__(self, tipo: str, id: ObjectId):
+        self.tipo = tipo
+        self.id = id
+        self.lote: Optional[int] = None  # definido quando o lote da linha é despachado
+
+
+class _Linha(NamedTuple):
+    numero: int
+    registro: dict
+    id: ObjectId
+    chave: Optional[_Chave]  # a própria linha, se tiver id
+    pai: Optional[_Chave]  # pai encontrado entre as linhas anteriores do arquivo
+
+
+async def _descompactar(pedacos: AsyncIterator[bytes]):
+    descompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    async for pedaco in pedacos:
+        dados = descompressor.decompress(pedaco)
+        if dados:
+            yield dados
+    yield descompressor.flush()
+
+
+async def _linhas(pedacos: AsyncIterator[bytes]):
+    """(número, texto) de cada linha, sem carregar o arquivo inteiro."""
+    decodificador = codecs.getincrementaldecoder("utf-8-sig")()
+    resto = ""
+    numero = 0
+    async for pedaco in pedacos:
+        texto = resto + decodificador.decode(pedaco)
+        linhas = texto.split("\n")
+        resto = linhas.pop()
+        if len(resto) > TAMANHO_MAXIMO_LINHA:
+            raise ErroImportacao(
+                f"Linha {numero + len(linhas) + 1} maior que {TAMANHO_MAXIMO_LINHA} caracteres"
+            )
+        for linha in linhas:
+            numero += 1
+            yield numero, linha.rstrip("\r")
+    resto += decodificador.decode(b"", final=True)
+    if resto.strip():
+        yield numero + 1, resto.rstrip("\r")
+
+
+async def _registros_ndjson(pedacos: AsyncIterator[bytes]):
+    async for numero, linha in _linhas(pedacos):
+        if not linha.strip():
+            continue
+        try:
+            registro = desserializar(linha)
+        except ValueError as e:  # JSONDecodeError do orjson e do json
+            yield numero, None, f"JSON inválido: {e}"
+            continue
+        if not isinstance(registro, dict):
+            yield numero, None, "Cada linha deve ser um objeto JSON"
+            continue
+        yield numero, registro, None
+
+
+def _registro_csv(cabecalho: List[str], valores: List[str]) -> dict:
+    registro = {}
+    for coluna, valor in zip(cabecalho, valores):
+        if valor == "":
+            continue
+        *caminho, campo = coluna.split(".")
+        destino = registro
+        for parte in caminho:
+            destino = destino.setdefault(parte, {})
+        destino[campo] = valor
+    return registro
+
+
+async def _registros_csv(pedacos: AsyncIterator[bytes]):
+    cabecalho = None
+    pendente, inicio = "", 0
+    async for numero, linha in _linhas(pedacos):
+        # Um campo entre aspas pode conter quebras de linha; a linha só
+        # termina quando as aspas estão fechadas
+        pendente = f"{pendente}\n{linha}" if pendente else linha
+        inicio = inicio or numero
+        if pendente.count('"') % 2:
+            continue
+        texto, numero_registro = pendente, inicio
+        pendente, inicio = "", 0
+        if not texto.strip():
+            continue
+        valores = next(csv.reader([texto]))
+        if cabecalho is None:
+            cabecalho = [c.strip() for c in valores]
+            continue
+        if len(valores) != len(cabecalho):
+            yield numero_registro, None, (
+                f"Esperadas {len(cabecalho)} colunas, encontradas {len(valores)}"
+            )
+            continue
+        yield numero_registro, _registro_csv(cabecalho, valores), None
+    if pendente:
+        yield inicio, None, "Aspas não fechadas até o fim do arquivo"
+
+
+def validar_parametros(
+    formato: str, entidade: Optional[str], tamanho_lote: int, concorrencia: int
+):
+    if formato not in FORMATOS_IMPORTACAO:
+        raise HTTPException(status_code=400, detail=f"Formato {formato} não suportado.")
+    if entidade is not None and entidade not in ENTIDADES:
+        raise HTTPException(status_code=400, detail=f"Entidade {entidade} não existe.")
+    if tamanho_lote < 1:
+        raise HTTPException(status_code=400, detail="tamanho_lote precisa ser maior que 0")
+    if not 1 <= concorrencia <= CONCORRENCIA_MAXIMA:
+        raise HTTPException(
+            status_code=400,
+            detail=f"concorrencia deve estar entre 1 e {CONCORRENCIA_MAXIMA}",
+        )
+
+
+class Importacao:
+    """Estado de uma importação: chaves lidas, lotes pendentes e em gravação
+    e os contadores do progresso."""
+
+    _sequencia = itertools.count(1)
+
+    def __init__(
+        self,
+        formato: str = "ndjson",
+        entidade: Optional[str] = None,
+        tamanho_lote: int = TAMANHO_LOTE_IMPORTACAO,
+        concorrencia: int = CONCORRENCIA_IMPORTACAO,
+        limite_erros: Optional[int] = LIMITE_ERROS,
+        ao_errar: Optional[Callable[[dict], None]] = None,
+        ao_progredir: Optional[Callable[[dict], None]] = None,
+    ):
+        validar_parametros(formato, entidade, tamanho_lote, concorrencia)
+        self.id = f"{time.strftime('%Y%m%d%H%M%S')}-{next(self._sequencia)}"
+        self.formato = formato
+        self.entidade = entidade
+        self.tamanho_lote = tamanho_lote
+        self.limite_erros = limite_erros
+        self.ao_errar = ao_errar
+        self.ao_progredir = ao_progredir
+        self.semaforo = asyncio.Semaphore(concorrencia)
+        self.chaves: Dict[str, _Chave] = {}
+        self.pendentes: Dict[str, List[_Linha]] = defaultdict(list)
+        self.tarefas: Dict[int, asyncio.Task] = {}
+        self.falhos = set()  # ids pré-gerados de linhas que não foram gravadas
+        self.lidas = 0
+        self.inseridos = defaultdict(int)
+        self.total_erros = 0
+        self.erros: List[dict] = []
+        self.inicio = time.perf_counter()
+
+    def situacao(self) -> dict:
+        return {
+            "id": self.id,
+            "formato": self.formato,
+            "linhas": self.lidas,
+            "inseridos": dict(self.inseridos),
+            "erros": self.total_erros,
+            "lotes_em_gravacao": sum(not t.done() for t in self.tarefas.values()),
+            "duracao_s": round(time.perf_counter() - self.inicio, 4),
+        }
+
+    def _erro(self, numero: int, tipo: Optional[str], mensagem: str):
+        erro = {"linha": numero, "entidade": tipo, "erro": mensagem}
+        self.total_erros += 1
+        metricas.incrementar("importacao_linhas_total", tipo=tipo or "", resultado="erro")
+        if self.ao_errar is not None:
+            self.ao_errar(erro)
+        if self.limite_erros is None or len(self.erros) < self.limite_erros:
+            self.erros.append(erro)
+
+    def _ler(self, numero: int, registro: dict):
+        tipo = registro.pop("entidade", None) or self.entidade
+        if tipo not in ENTIDADES:
+            self._erro(numero, None, f"Entidade {tipo} não existe" if tipo else "Entidade não informada")
+            return
+        valor = registro.pop("id", None)
+        id = ObjectId()
+        chave = None
+        if valor not in (None, ""):
+            if str(valor) in self.chaves:
+                self._erro(numero, tipo, f"id {valor} repetido no arquivo")
+                return
+            chave = self.chaves[str(valor)] = _Chave(tipo, id)
+        pai = None
+        referencia = REFERENCIAS.get(tipo)
+        if referencia is not None and registro.get(referencia.campo) is not None:
+            registro[referencia.campo] = str(registro[referencia.campo])
+            pai = self.chaves.get(registro[referencia.campo])
+        self.pendentes[tipo].append(_Linha(numero, registro, id, chave, pai))
+
+    async def _despachar(self, tipo: str):
+        """Grava o lote pendente do tipo em uma tarefa, depois de despachar
+        os lotes pendentes dos pais, de que ele pode depender."""
+        referencia = REFERENCIAS.get(tipo)
+        if referencia is not None and self.pendentes.get(referencia.tipo):
+            await self._despachar(referencia.tipo)
+        linhas = self.pendentes.pop(tipo, None)
+        if not linhas:
+            return
+        # Com todos os lotes ocupados, a leitura espera aqui
+        await self.semaforo.acquire()
+        lote = len(self.tarefas) + 1
+        for linha in linhas:
+            if linha.chave is not None:
+                linha.chave.lote = lote
+        self.tarefas[lote] = asyncio.create_task(self._gravar_lote(tipo, linhas))
+
+    async def _resolver_pais(self, tipo: str, linhas: List[_Linha], documentos: Dict[int, dict]):
+        """Troca a chave do pai pelo seu ObjectId; descarta as linhas cujo pai
+        falhou ou não existe."""
+        referencia = REFERENCIAS[tipo]
+        dependencias = {l.pai.lote for l in linhas if l.pai is not None and l.numero in documentos}
+        await asyncio.gather(*(self.tarefas[d] for d in dependencias if d is not None))
+        externos = await buscar_por_ids(
+            referencia.tipo,
+            {documentos[l.numero][referencia.campo] for l in linhas if l.pai is None and l.numero in documentos},
+            {"_id": 1},
+        )
+        for linha in linhas:
+            if linha.numero not in documentos:
+                continue
+            valor = documentos[linha.numero][referencia.campo]
+            if linha.pai is not None:
+                if linha.pai.tipo != referencia.tipo:
+                    motivo = f"{referencia.campo} {valor} é uma linha de {linha.pai.tipo}"
+                elif linha.pai.id in self.falhos:
+                    motivo = f"{referencia.campo} {valor} não foi importado"
+                else:
+                    documentos[linha.numero][referencia.campo] = referencia.converter(linha.pai.id)
+                    continue
+            elif ObjectId.is_valid(valor) and ObjectId(valor) in externos:
+                documentos[linha.numero][referencia.campo] = referencia.converter(ObjectId(valor))
+                continue
+            else:
+                motivo = f"{referencia.campo} {valor} não encontrado"
+            del documentos[linha.numero]
+            self.falhos.add(linha.id)
+            self._erro(linha.numero, tipo, motivo)
+
+    async def _atualizar_pais(self, tipo: str, documentos: Dict[int, dict], ids: Dict[int, ObjectId]):
+        referencia = REFERENCIAS[tipo]
+        por_pai = defaultdict(list)
+        deltas = defaultdict(lambda: (0, 0))
+        for numero, id in ids.items():
+            pai = ObjectId(documentos[numero][referencia.campo])
+            por_pai[pai].append(id)
+            if tipo == "obra":
+                custo, quantidade = deltas[pai]
+                deltas[pai] = (custo + documentos[numero]["custo"], quantidade + 1)
+        if not por_pai:
+            return
+        await map[referencia.tipo]["collection"].bulk_write(
+            [
+                UpdateOne({"_id": p}, {"$addToSet": {referencia.lista: {"$each": f}}})
+                for p, f in por_pai.items()
+            ],
+            ordered=False,
+        )
+        await cache.invalidar(referencia.tipo, *por_pai)
+        await propagar_gastos(deltas)
+
+    async def _gravar_lote(self, tipo: str, linhas: List[_Linha]):
+        ids = {}
+        try:
+            validos, erros = validar_lote(ENTIDADES[tipo], [l.registro for l in linhas])
+            documentos = {}
+            for posicao, linha in enumerate(linhas):
+                if posicao in erros:
+                    self.falhos.add(linha.id)
+                    self._erro(linha.numero, tipo, erros[posicao])
+                else:
+                    documentos[linha.numero] = {"_id": linha.id, **validos[posicao].model_dump()}
+            if tipo in REFERENCIAS:
+                await self._resolver_pais(tipo, linhas, documentos)
+            ids, erros_insercao = await inserir_em_lote(tipo, documentos, len(linhas))
+            for numero, mensagem in erros_insercao.items():
+                self.falhos.add(documentos[numero]["_id"])
+                self._erro(numero, tipo, mensagem)
+            self.inseridos[tipo] += len(ids)
+            metricas.incrementar("importacao_linhas_total", len(ids), tipo=tipo, resultado="inserida")
+            if tipo in REFERENCIAS:
+                await self._atualizar_pais(tipo, documentos, ids)
+        except Exception as e:
+            logger.error("Erro ao gravar lote de %s da importação %s: %s", tipo, self.id, e)
+            for linha in linhas:
+                if linha.numero not in ids and linha.id not in self.falhos:
+                    self.falhos.add(linha.id)
+                    self._erro(linha.numero, tipo, "Erro ao gravar o lote")
+        finally:
+            self.semaforo.release()
+        if self.ao_progredir is not None:
+            self.ao_progredir(self.situacao())
+
+    async def executar(self, pedacos: AsyncIterator[bytes], compactado: bool = False) -> dict:
+        """Lê o arquivo inteiro e espera todos os lotes; retorna o resumo."""
+        if compactado:
+            pedacos = _descompactar(pedacos)
+        leitor = _registros_ndjson if self.formato == "ndjson" else _registros_csv
+        EM_ANDAMENTO[self.id] = self
+        logger.info("Importação %s iniciada (%s, entidade %s)", self.id, self.formato, self.entidade)
+        fatal = None
+        try:
+            async for numero, registro, erro in leitor(pedacos):
+                self.lidas += 1
+                if erro is not None:
+                    self._erro(numero, None, erro)
+                    continue
+                self._ler(numero, registro)
+                for tipo, linhas in list(self.pendentes.items()):
+                    if len(linhas) >= self.tamanho_lote:
+                        await self._despachar(tipo)
+        except (ErroImportacao, zlib.error, UnicodeDecodeError) as e:
+            # As linhas lidas até aqui ainda são gravadas
+            fatal = str(e)
+            logger.error("Importação %s interrompida: %s", self.id, e)
+        try:
+            for tipo in ENTIDADES:
+                await self._despachar(tipo)
+        finally:
+            # Lotes já despachados terminam mesmo se a leitura falhou
+            await asyncio.gather(*self.tarefas.values())
+            EM_ANDAMENTO.pop(self.id, None)
+        resumo = {
+            **self.situacao(),
+            "interrompida": fatal,
+            "erros_omitidos": self.total_erros - len(self.erros),
+            "detalhes": sorted(self.erros, key=lambda e: e["linha"]),
+        }
+        del resumo["lotes_em_gravacao"]
+        logger.info(
+            "Importação %s concluída: %s linhas, %s inseridos, %s erros",
+            self.id,
+            self.lidas,
+            dict(self.inseridos),
+            self.total_erros,
+        )
+        return resumo
@@ -0,0 +1,69 @@
+from models import INDICES
+from routers.utils import map
+from logs import logging
+
+logger = logging.getLogger(__name__)
+
+
+def _chave(indice: dict) -> dict:
+    """Chave comparável de um índice. O banco descreve índices de texto como
+    {_fts, _ftsx}, então eles são comparados pelos campos de `weights`."""
+    chave = dict(indice["key"])
+    if "_fts" in chave:
+        return {campo: "text" for campo in indice.get("weights", {})}
+    return chave
+
+
+async def planejar_indices() -> dict:
+    """Compara os índices declarados em models.INDICES com os do banco.
+
+    Retorna, por tipo, os índices que precisam ser criados, os nomes dos
+    declarados que mudaram de chave (e precisam ser recriados) e os nomes
+    dos existentes que não estão declarados.
+    """
+    plano = {}
+    for tipo, declarados in INDICES.items():
+        existentes = {
+            i["name"]: _chave(i)
+            async for i in map[tipo]["collection"].list_indexes()
+            if i["name"] != "_id_"
+        }
+        criar, alterar = [], []
+        for indice in declarados:
+            nome = indice.document["name"]
+            chave = _chave(indice.document)
+            if nome not in existentes:
+                criar.append(indice)
+            elif existentes[nome] != chave:
+                alterar.append(nome)
+                criar.append(indice)
+        nomes_declarados = {i.document["name"] for i in declarados}
+        remover = [n for n in existentes if n not in nomes_declarados]
+        plano[tipo] = {"criar": criar, "alterar": alterar, "remover": remover}
+    return plano
+
+
+async def aplicar_indices(remover_extras: bool = False) -> dict:
+    """Cria os índices declarados que faltam e recria os que mudaram de
+    chave. É idempotente.
+
+    Índices não declarados só são removidos com remover_extras=True, para que
+    a inicialização da aplicação nunca apague nada sozinha. Um erro em um
+    tipo é registrado em plano[tipo]["erro"] e não impede os demais.
+    """
+    plano = await planejar_indices()
+    for tipo, acoes in plano.items():
+        colecao = map[tipo]["collection"]
+        try:
+            # Um índice declarado com a chave alterada precisa sair antes de
+            # ser recriado, senão create_indexes falha com conflito de opções
+            for nome in acoes["alterar"] + (acoes["remover"] if remover_extras else []):
+                logger.info("Removendo índice %s de %s", nome, tipo)
+                await colecao.drop_index(nome)
+            if acoes["criar"]:
+                nomes = await colecao.create_indexes(acoes["criar"])
+                logger.info("Índices criados em %s: %s", tipo, nomes)
+        except Exception as e:
+            logger.error("Erro ao aplicar os índices de %s: %s", tipo, e)
+            acoes["erro"] = str(e)
+    return plano
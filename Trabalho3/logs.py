@@ -1,9 +1,119 @@
+"""Configuração de logs da aplicação.
+
+As mensagens vão para uma fila e são gravadas no arquivo por uma thread
+separada (QueueListener), então nenhuma escrita em disco acontece na thread
+do event loop. O arquivo é rotacionado por tamanho ou por tempo.
+
+Variáveis de ambiente:
+    LOG_ARQUIVO          arquivo de saída (padrão app.log); "{pid}" é
+                         trocado pelo id do processo
+    LOG_NIVEL            nível raiz (padrão INFO)
+    LOG_NIVEIS           níveis por logger, ex. "routers.utils=WARNING"
+    LOG_AMOSTRAGEM       fração de mensagens INFO/DEBUG mantidas por logger,
+                         ex. "routers.utils=0.1,routers.pessoa=0.5"
+    LOG_ROTACAO          "tamanho" (padrão) ou "tempo"
+    LOG_TAMANHO_MAXIMO   bytes antes de rotacionar (padrão 10 MB)
+    LOG_INTERVALO        quando rotacionar por tempo (padrão "midnight")
+    LOG_BACKUPS          quantos arquivos antigos manter (padrão 5)
+    LOG_JSON             "1" para gravar uma linha JSON por mensagem
+"""
+
+import atexit
+import json
 import logging
+import logging.handlers
+import os
+import queue
+import random
+
+FORMATO = "%(asctime)s - %(levelname)s - %(message)s"
+FORMATO_DATA = "%d/%m/%Y %H:%M:%S"
+
+
+def _pares(valor: str) -> dict:
+    """Lê "chave=valor,chave=valor" de uma variável de ambiente."""
+    pares = {}
+    for item in filter(None, (i.strip() for i in valor.split(","))):
+        chave, _, v = item.partition("=")
+        pares[chave.strip()] = v.strip()
+    return pares
+
+
+class FiltroAmostragem(logging.Filter):
+    """Mantém só uma fração das mensagens INFO/DEBUG dos loggers configurados.
+
+    Avisos e erros sempre passam.
+    """
+
+    def __init__(self, taxas: dict):
+        super().__init__()
+        self.taxas = taxas
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno > logging.INFO:
+            return True
+        taxa = self.taxas.get(record.name)
+        return taxa is None or random.random() < taxa
+
+
+class FormatadorJson(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        dados = {
+            "momento": self.formatTime(record, FORMATO_DATA),
+            "nivel": record.levelname,
+            "logger": record.name,
+            "mensagem": record.getMessage(),
+        }
+        if record.exc_info:
+            dados["excecao"] = self.formatException(record.exc_info)
+        return json.dumps(dados, ensure_ascii=False)
+
+
+def _handler_arquivo() -> logging.Handler:
+    arquivo = os.getenv("LOG_ARQUIVO", "app.log").replace("{pid}", str(os.getpid()))
+    backups = int(os.getenv("LOG_BACKUPS", "5"))
+    if os.getenv("LOG_ROTACAO", "tamanho") == "tempo":
+        handler = logging.handlers.TimedRotatingFileHandler(
+            arquivo,
+            when=os.getenv("LOG_INTERVALO", "midnight"),
+            backupCount=backups,
+            encoding="utf-8",
+        )
+    else:
+        handler = logging.handlers.RotatingFileHandler(
+            arquivo,
+            maxBytes=int(os.getenv("LOG_TAMANHO_MAXIMO", str(10 * 1024 * 1024))),
+            backupCount=backups,
+            encoding="utf-8",
+        )
+    if os.getenv("LOG_JSON") == "1":
+        handler.setFormatter(FormatadorJson())
+    else:
+        handler.setFormatter(logging.Formatter(FORMATO, FORMATO_DATA))
+    return handler
+
+
+def configurar():
+    fila = queue.SimpleQueue()
+    handler_fila = logging.handlers.QueueHandler(fila)
+    handler_fila.addFilter(
+        FiltroAmostragem(
+            {nome: float(taxa) for nome, taxa in _pares(os.getenv("LOG_AMOSTRAGEM", "")).items()}
+        )
+    )
+
+    raiz = logging.getLogger()
+    raiz.setLevel(os.getenv("LOG_NIVEL", "INFO"))
+    raiz.addHandler(handler_fila)
+    for nome, nivel in _pares(os.getenv("LOG_NIVEIS", "")).items():
+        logging.getLogger(nome).setLevel(nivel.upper())
+
+    listener = logging.handlers.QueueListener(
+        fila, _handler_arquivo(), respect_handler_level=True
+    )
+    listener.start()
+    atexit.register(listener.stop)
+    return listener
+
 
-logging.basicConfig(
-    level=logging.INFO,
-    format="%(asctime)s - %(levelname)s - %(message)s",
-    datefmt="%d/%m/%Y %H:%M:%S",
-    filename="app.log",
-    filemode="a",
-)
+listener = configurar()
@@ -1,9 +1,67 @@
+from contextlib import asynccontextmanager
+import asyncio
+import os
+
 from fastapi import FastAPI
-from routers import pessoa, terreno, contrucao, obra
+from fastapi.responses import PlainTextResponse
+from routers import pessoa, terreno, contrucao, obra, analises, importacao
+from analises import ANALISES_INTERVALO, agendar_analises
+import db
+from indices import aplicar_indices
+from logs import logging
+from metricas import metricas, middleware_metricas
+
+logger = logging.getLogger(__name__)
+
+
+async def criar_indices():
+    try:
+        await aplicar_indices()
+    except Exception as e:
+        logger.error("Erro ao criar índices: %s", e)
+
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # O cliente é criado aqui, e não na importação, para que cada worker
+    # tenha o seu e o pool já esteja aberto quando chegarem as requisições
+    try:
+        await db.conectar(aquecer=True)
+    except Exception as e:
+        logger.error("Erro ao aquecer o pool de conexões: %s", e)
+    # Os índices são criados em segundo plano para não atrasar a subida
+    # da aplicação quando uma coleção grande ainda não tem algum deles
+    tarefa_indices = asyncio.create_task(criar_indices())
+    tarefas = [tarefa_indices]
+    intervalo = float(os.getenv("ANALISES_INTERVALO", str(ANALISES_INTERVALO)))
+    if intervalo > 0:
+        completa_a_cada = int(os.getenv("ANALISES_COMPLETA_A_CADA", "24"))
+        tarefas.append(asyncio.create_task(agendar_analises(intervalo, completa_a_cada)))
+    yield
+    for tarefa in tarefas:
+        tarefa.cancel()
+    db.fechar()
 
-routers = [pessoa.router, terreno.router, contrucao.router, obra.router]
+
+app = FastAPI(lifespan=lifespan)
+app.middleware("http")(middleware_metricas)
+
+routers = [
+    pessoa.router,
+    terreno.router,
+    contrucao.router,
+    obra.router,
+    analises.router,
+    importacao.router,
+]
 
 for router in routers:
     app.include_router(router)
+
+
+# Métricas no formato texto do Prometheus
+@app.get("/metrics", include_in_schema=False)
+async def exportar_metricas():
+    return PlainTextResponse(
+        metricas.exportar(), media_type="text/plain; version=0.0.4; charset=utf-8"
+    )
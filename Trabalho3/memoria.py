@@ -0,0 +1,1846 @@
+"""Banco em memória com a interface assíncrona das coleções do Motor.
+
+Selecionado com BACKEND=memoria (ver db.py). Implementa o subconjunto da API
+que a aplicação usa:
+  - consultas: operadores de comparação, $in/$nin, $exists, $regex, $not,
+    $size, $all, $elemMatch, $geoWithin, $and/$or/$nor, $expr e $text, com
+    caminhos aninhados e a semântica de arrays do MongoDB;
+  - atualizações: $set, $unset, $inc, $mul, $min, $max, $rename,
+    $setOnInsert, $currentDate, $addToSet, $push, $pull e $pullAll, com upsert;
+  - agregação: $geoNear (como primeira etapa), $match, $project,
+    $addFields/$set, $unset, $lookup (com ou sem pipeline), $unwind, $group,
+    $sort, $skip, $limit, $count, $replaceRoot, $replaceWith, $facet e $merge;
+  - índices: cada campo declarado em um índice ganha um índice de hash usado
+    nas igualdades e $in; o índice de texto vira um índice invertido; os
+    campos 2dsphere só habilitam o $geoNear, que percorre a coleção.
+
+Os documentos são copiados na entrada e na saída, então quem chama nunca
+compartilha estado com o banco. Cada operação é registrada em metricas como
+uma ida ao banco, para que as contagens por requisição continuem
+comparáveis com as do MongoDB. Os dados vivem no processo: cada worker tem
+o seu banco e tudo se perde ao encerrar.
+
+A busca textual normaliza caixa e acentos e reduz só os plurais
+(texto.radical), uma aproximação do stemmer do índice "portuguese" do
+servidor. As distâncias são calculadas numa esfera (haversine) e as arestas
+dos polígonos são retas no plano longitude/latitude, o que só difere do
+servidor em áreas grandes.
+"""
+
+import heapq
+import math
+import re
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+from functools import lru_cache
+from typing import Dict, Iterable, List, Optional
+
+from bson import ObjectId
+from bson.regex import Regex
+from pymongo import (
+    DeleteMany,
+    DeleteOne,
+    InsertOne,
+    ReplaceOne,
+    ReturnDocument,
+    UpdateMany,
+    UpdateOne,
+)
+from pymongo.errors import BulkWriteError, DuplicateKeyError, OperationFailure, WriteError
+from pymongo.results import (
+    BulkWriteResult,
+    DeleteResult,
+    InsertManyResult,
+    InsertOneResult,
+    UpdateResult,
+)
+
+from metricas import registrar_ida
+from texto import normalizar, termos_busca, tokens as palavras
+
+_AUSENTE = object()
+
+
+def _copiar(valor):
+    """Cópia profunda dos tipos que aparecem em documentos."""
+    if isinstance(valor, dict):
+        return {k: _copiar(v) for k, v in valor.items()}
+    if isinstance(valor, list):
+        return [_copiar(v) for v in valor]
+    return valor
+
+
+# Valores e caminhos
+
+
+def _valores(doc, partes: List[str]) -> list:
+    """Valores encontrados no caminho, descendo por dentro dos arrays."""
+    atuais = [doc]
+    for parte in partes:
+        proximos = []
+        for atual in atuais:
+            if isinstance(atual, dict):
+                if parte in atual:
+                    proximos.append(atual[parte])
+            elif isinstance(atual, list):
+                if parte.isdigit() and int(parte) < len(atual):
+                    proximos.append(atual[int(parte)])
+                proximos.extend(
+                    item[parte] for item in atual if isinstance(item, dict) and parte in item
+                )
+        atuais = proximos
+    return atuais
+
+
+def _expandir(valores: list) -> list:
+    """Os próprios valores e, para os arrays, também os seus elementos."""
+    expandidos = []
+    for valor in valores:
+        expandidos.append(valor)
+        if isinstance(valor, list):
+            expandidos.extend(valor)
+    return expandidos
+
+
+def _obter(doc: dict, partes: List[str], padrao=_AUSENTE):
+    atual = doc
+    for parte in partes:
+        if isinstance(atual, dict) and parte in atual:
+            atual = atual[parte]
+        elif isinstance(atual, list) and parte.isdigit() and int(parte) < len(atual):
+            atual = atual[int(parte)]
+        else:
+            return padrao
+    return atual
+
+
+def _definir(doc: dict, partes: List[str], valor):
+    atual = doc
+    for parte in partes[:-1]:
+        if isinstance(atual, list):
+            if not parte.isdigit() or int(parte) >= len(atual):
+                raise WriteError(f"Cannot create field '{parte}' in an array", 28)
+            atual = atual[int(parte)]
+            continue
+        proximo = atual.get(parte)
+        if proximo is None:
+            proximo = atual[parte] = {}
+        elif not isinstance(proximo, (dict, list)):
+            raise WriteError(
+                f"Cannot create field '{partes[-1]}' in element {{{parte}: {proximo!r}}}", 28
+            )
+        atual = proximo
+    if isinstance(atual, list) and partes[-1].isdigit():
+        indice = int(partes[-1])
+        atual.extend([None] * (indice + 1 - len(atual)))
+        atual[indice] = valor
+    else:
+        atual[partes[-1]] = valor
+
+
+def _remover(doc: dict, partes: List[str]):
+    pai = _obter(doc, partes[:-1]) if len(partes) > 1 else doc
+    if isinstance(pai, dict):
+        pai.pop(partes[-1], None)
+
+
+# Comparação na ordem de tipos do BSON
+
+
+def _classe(valor) -> int:
+    if valor is None or valor is _AUSENTE:
+        return 1
+    if isinstance(valor, bool):
+        return 8
+    if isinstance(valor, (int, float)):
+        return 2
+    if isinstance(valor, str):
+        return 3
+    if isinstance(valor, dict):
+        return 4
+    if isinstance(valor, list):
+        return 5
+    if isinstance(valor, ObjectId):
+        return 7
+    if isinstance(valor, datetime):
+        return 9
+    return 10
+
+
+def _chave_ordem(valor):
+    classe = _classe(valor)
+    if classe == 1:
+        return (1, 0)
+    if classe in (4, 5, 10):
+        return (classe, repr(valor))
+    if classe == 9 and valor.tzinfo is not None:
+        valor = valor.astimezone(timezone.utc).replace(tzinfo=None)
+    return (classe, valor)
+
+
+def _igual(a, b) -> bool:
+    if isinstance(a, bool) != isinstance(b, bool):
+        return False
+    return _classe(a) == _classe(b) and a == b
+
+
+def _comparar(a, b, operador: str) -> bool:
+    if _classe(a) != _classe(b) or _classe(a) in (4, 5, 10):
+        return False
+    a, b = _chave_ordem(a)[1], _chave_ordem(b)[1]
+    if operador == "$gt":
+        return a > b
+    if operador == "$gte":
+        return a >= b
+    if operador == "$lt":
+        return a < b
+    return a <= b
+
+
+@lru_cache(maxsize=512)
+def _regex(padrao: str, opcoes: str) -> re.Pattern:
+    flags = 0
+    for opcao, flag in (("i", re.I), ("m", re.M), ("s", re.S), ("x", re.X)):
+        if opcao in opcoes:
+            flags |= flag
+    return re.compile(padrao, flags)
+
+
+def _como_regex(valor) -> Optional[re.Pattern]:
+    if isinstance(valor, re.Pattern):
+        return valor
+    if isinstance(valor, Regex):
+        return valor.try_compile()
+    return None
+
+
+# Consultas
+
+
+def _eh_operador(condicao) -> bool:
+    return isinstance(condicao, dict) and bool(condicao) and all(
+        k.startswith("$") for k in condicao
+    )
+
+
+def corresponde(doc: dict, filtro: dict) -> bool:
+    """Diz se o documento satisfaz o filtro (sem $text, tratado pela coleção)."""
+    for chave, condicao in filtro.items():
+        if chave == "$and":
+            if not all(corresponde(doc, f) for f in condicao):
+                return False
+        elif chave == "$or":
+            if not any(corresponde(doc, f) for f in condicao):
+                return False
+        elif chave == "$nor":
+            if any(corresponde(doc, f) for f in condicao):
+                return False
+        elif chave == "$expr":
+            if not _verdadeiro(avaliar(condicao, doc)):
+                return False
+        elif chave in ("$text", "$comment"):
+            continue
+        elif chave.startswith("$"):
+            raise OperationFailure(f"unknown top level operator: {chave}", 2)
+        elif not _corresponde_campo(_valores(doc, chave.split(".")), condicao):
+            return False
+    return True
+
+
+def _corresponde_campo(valores: list, condicao) -> bool:
+    if _eh_operador(condicao):
+        opcoes = condicao.get("$options", "")
+        return all(
+            _operador(valores, op, arg, opcoes)
+            for op, arg in condicao.items()
+            if op != "$options"
+        )
+    return _operador(valores, "$eq", condicao, "")
+
+
+def _operador(valores: list, operador: str, arg, opcoes: str) -> bool:
+    if operador == "$eq":
+        padrao = _como_regex(arg)
+        if padrao is not None:
+            return any(isinstance(v, str) and padrao.search(v) for v in _expandir(valores))
+        if arg is None:
+            return not valores or any(v is None for v in _expandir(valores))
+        return any(_igual(v, arg) for v in _expandir(valores))
+    if operador == "$ne":
+        return not _operador(valores, "$eq", arg, opcoes)
+    if operador == "$in":
+        return any(_operador(valores, "$eq", a, opcoes) for a in arg)
+    if operador == "$nin":
+        return not _operador(valores, "$in", arg, opcoes)
+    if operador in ("$gt", "$gte", "$lt", "$lte"):
+        return any(_comparar(v, arg, operador) for v in _expandir(valores))
+    if operador == "$exists":
+        return bool(valores) == bool(arg)
+    if operador == "$regex":
+        padrao = _como_regex(arg) or _regex(arg, opcoes)
+        return any(isinstance(v, str) and padrao.search(v) for v in _expandir(valores))
+    if operador == "$not":
+        if _como_regex(arg) is not None:
+            return not _operador(valores, "$eq", arg, opcoes)
+        return not _corresponde_campo(valores, arg)
+    if operador == "$size":
+        return any(isinstance(v, list) and len(v) == arg for v in valores)
+    if operador == "$all":
+        return all(_operador(valores, "$eq", a, opcoes) for a in arg)
+    if operador == "$geoWithin":
+        return any(_dentro(_ponto(v), arg) for v in valores)
+    if operador == "$elemMatch":
+        for valor in valores:
+            if not isinstance(valor, list):
+                continue
+            for item in valor:
+                if _eh_operador(arg):
+                    if _corresponde_campo([item], arg):
+                        return True
+                elif isinstance(item, dict) and corresponde(item, arg):
+                    return True
+        return False
+    raise OperationFailure(f"unknown operator: {operador}", 2)
+
+
+def _valores_igualdade(condicao) -> Optional[list]:
+    """Valores de uma condição de igualdade ou $in que podem usar um índice
+    de hash; None quando a condição precisa de uma varredura."""
+    if _eh_operador(condicao):
+        if set(condicao) == {"$eq"}:
+            valores = [condicao["$eq"]]
+        elif set(condicao) == {"$in"}:
+            valores = list(condicao["$in"])
+        else:
+            return None
+    elif isinstance(condicao, dict):
+        return None
+    else:
+        valores = [condicao]
+    if any(isinstance(v, (dict, list)) or _como_regex(v) is not None for v in valores):
+        return None
+    return valores
+
+
+def _chave_hash(valor):
+    # True == 1 em Python, mas não no MongoDB
+    if isinstance(valor, bool):
+        return ("bool", valor)
+    if isinstance(valor, datetime) and valor.tzinfo is not None:
+        return valor.astimezone(timezone.utc).replace(tzinfo=None)
+    return valor
+
+
+def _hashavel(valor) -> bool:
+    return not isinstance(valor, (dict, list))
+
+
+def _chave_id(valor):
+    """Forma hashável de um _id, que também pode ser um documento (ex. os
+    grupos gravados por um $merge)."""
+    if isinstance(valor, dict):
+        return ("documento", tuple((c, _chave_id(v)) for c, v in valor.items()))
+    return _chave_hash(valor)
+
+
+# Geometria
+
+# Raio da Terra usado pelo servidor para converter radianos em metros
+RAIO_TERRA_M = 6378100
+
+
+def _ponto(valor) -> Optional[tuple]:
+    """(longitude, latitude) de um Point GeoJSON ou de um par legado."""
+    if isinstance(valor, dict) and valor.get("type") == "Point":
+        valor = valor.get("coordinates")
+    if (
+        isinstance(valor, (list, tuple))
+        and len(valor) == 2
+        and all(isinstance(c, (int, float)) and not isinstance(c, bool) for c in valor)
+    ):
+        return float(valor[0]), float(valor[1])
+    return None
+
+
+def distancia_m(a: tuple, b: tuple) -> float:
+    lon1, lat1, lon2, lat2 = map(math.radians, (*a, *b))
+    h = (
+        math.sin((lat2 - lat1) / 2) ** 2
+        + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    )
+    return 2 * RAIO_TERRA_M * math.asin(min(1.0, math.sqrt(h)))
+
+
+def _no_anel(ponto: tuple, anel: list) -> bool:
+    x, y = ponto
+    dentro = False
+    for (x1, y1), (x2, y2) in zip(anel, anel[1:] + anel[:1]):
+        if (y1 > y) != (y2 > y) and x < x1 + (y - y1) * (x2 - x1) / (y2 - y1):
+            dentro = not dentro
+    return dentro
+
+
+def _dentro(ponto: Optional[tuple], especificacao: dict) -> bool:
+    if ponto is None:
+        return False
+    if "$geometry" in especificacao:
+        geometria = especificacao["$geometry"]
+        if geometria.get("type") == "Polygon":
+            poligonos = [geometria["coordinates"]]
+        elif geometria.get("type") == "MultiPolygon":
+            poligonos = geometria["coordinates"]
+        else:
+            raise OperationFailure("$geoWithin not supported with provided geometry", 2)
+        # O primeiro anel é a borda; os demais são buracos
+        return any(
+            _no_anel(ponto, externo) and not any(_no_anel(ponto, buraco) for buraco in buracos)
+            for externo, *buracos in poligonos
+        )
+    if "$box" in especificacao:
+        (x1, y1), (x2, y2) = especificacao["$box"]
+        return min(x1, x2) <= ponto[0] <= max(x1, x2) and min(y1, y2) <= ponto[1] <= max(y1, y2)
+    if "$centerSphere" in especificacao:
+        centro, raio = especificacao["$centerSphere"]
+        return distancia_m(ponto, tuple(centro)) <= raio * RAIO_TERRA_M
+    if "$polygon" in especificacao:
+        return _no_anel(ponto, [tuple(v) for v in especificacao["$polygon"]])
+    raise OperationFailure("unknown geo specifier", 2)
+
+
+# Expressões de agregação
+
+
+def _verdadeiro(valor) -> bool:
+    return valor not in (None, False, 0, _AUSENTE)
+
+
+def _caminho_agregacao(valor, partes: List[str]):
+    for parte in partes:
+        if isinstance(valor, dict):
+            valor = valor.get(parte, _AUSENTE)
+        elif isinstance(valor, list):
+            valor = [
+                v
+                for v in (_caminho_agregacao(item, [parte]) for item in valor)
+                if v is not _AUSENTE
+            ]
+        else:
+            return _AUSENTE
+        if valor is _AUSENTE:
+            return _AUSENTE
+    return valor
+
+
+def _numeros(valor) -> list:
+    itens = valor if isinstance(valor, list) else [valor]
+    return [v for v in itens if isinstance(v, (int, float)) and not isinstance(v, bool)]
+
+
+def _argumentos(arg, doc, variaveis) -> list:
+    if isinstance(arg, list):
+        return [avaliar(a, doc, variaveis) for a in arg]
+    return [avaliar(arg, doc, variaveis)]
+
+
+def _acumular(operador: str, valores: list):
+    """$sum/$avg/$min/$max aplicados a uma lista de valores já avaliados."""
+    if operador == "$sum":
+        return sum(n for v in valores for n in _numeros(v))
+    if operador == "$avg":
+        numeros = [n for v in valores for n in _numeros(v)]
+        return sum(numeros) / len(numeros) if numeros else None
+    itens = [
+        i
+        for v in valores
+        for i in (v if isinstance(v, list) else [v])
+        if i is not None and i is not _AUSENTE
+    ]
+    if not itens:
+        return None
+    escolher = min if operador == "$min" else max
+    return escolher(itens, key=_chave_ordem)
+
+
+def avaliar(expressao, doc, variaveis: Optional[dict] = None):
+    """Avalia uma expressão de agregação sobre o documento."""
+    if isinstance(expressao, str) and expressao.startswith("$$"):
+        nome, *partes = expressao[2:].split(".")
+        if nome in ("ROOT", "CURRENT"):
+            base = doc
+        elif variaveis and nome in variaveis:
+            base = variaveis[nome]
+        else:
+            raise OperationFailure(f"Use of undefined variable: {nome}", 17276)
+        return _caminho_agregacao(base, partes) if partes else base
+    if isinstance(expressao, str) and expressao.startswith("$"):
+        return _caminho_agregacao(doc, expressao[1:].split("."))
+    if isinstance(expressao, list):
+        return [avaliar(e, doc, variaveis) for e in expressao]
+    if not isinstance(expressao, dict):
+        return expressao
+    if len(expressao) == 1:
+        operador, arg = next(iter(expressao.items()))
+        if operador.startswith("$"):
+            return _avaliar_operador(operador, arg, doc, variaveis)
+    return {
+        chave: valor
+        for chave, valor in ((k, avaliar(v, doc, variaveis)) for k, v in expressao.items())
+        if valor is not _AUSENTE
+    }
+
+
+def _avaliar_operador(operador: str, arg, doc, variaveis):
+    if operador == "$literal":
+        return arg
+    if operador in ("$sum", "$avg", "$min", "$max"):
+        return _acumular(operador, _argumentos(arg, doc, variaveis))
+    if operador == "$cond":
+        if isinstance(arg, dict):
+            arg = [arg["if"], arg["then"], arg["else"]]
+        se, entao, senao = arg
+        return avaliar(entao if _verdadeiro(avaliar(se, doc, variaveis)) else senao, doc, variaveis)
+    if operador == "$ifNull":
+        *opcoes, padrao = arg
+        for opcao in opcoes:
+            valor = avaliar(opcao, doc, variaveis)
+            if valor is not None and valor is not _AUSENTE:
+                return valor
+        return avaliar(padrao, doc, variaveis)
+    if operador == "$dateFromParts":
+        partes = {c: avaliar(v, doc, variaveis) for c, v in arg.items()}
+        if any(v is None or v is _AUSENTE for v in partes.values()):
+            return None
+        return datetime(
+            int(partes["year"]),
+            int(partes.get("month", 1)),
+            int(partes.get("day", 1)),
+            int(partes.get("hour", 0)),
+            int(partes.get("minute", 0)),
+            int(partes.get("second", 0)),
+        )
+
+    valores = _argumentos(arg, doc, variaveis)
+    if operador == "$size":
+        if not isinstance(valores[0], list):
+            raise OperationFailure("The argument to $size must be an array", 17124)
+        return len(valores[0])
+    if operador in ("$add", "$multiply"):
+        if any(v is None or v is _AUSENTE for v in valores):
+            return None
+        if operador == "$multiply":
+            resultado = 1
+            for v in valores:
+                resultado *= v
+            return resultado
+        datas = [v for v in valores if isinstance(v, datetime)]
+        total = sum(v for v in valores if not isinstance(v, datetime))
+        if datas:
+            return datas[0] + timedelta(milliseconds=total)
+        return total
+    if operador in ("$subtract", "$divide", "$mod"):
+        a, b = valores
+        if a is None or b is None or a is _AUSENTE or b is _AUSENTE:
+            return None
+        if operador == "$subtract":
+            if isinstance(a, datetime) and isinstance(b, datetime):
+                return int((a - b).total_seconds() * 1000)
+            return a - b
+        if b == 0:
+            raise OperationFailure("can't divide by zero", 2)
+        return a / b if operador == "$divide" else a % b
+    if operador in ("$eq", "$ne", "$gt", "$gte", "$lt", "$lte"):
+        a, b = (None if v is _AUSENTE else v for v in valores)
+        if operador == "$eq":
+            return _igual(a, b)
+        if operador == "$ne":
+            return not _igual(a, b)
+        ca, cb = _chave_ordem(a), _chave_ordem(b)
+        return {"$gt": ca > cb, "$gte": ca >= cb, "$lt": ca < cb, "$lte": ca <= cb}[operador]
+    if operador == "$and":
+        return all(_verdadeiro(v) for v in valores)
+    if operador == "$or":
+        return any(_verdadeiro(v) for v in valores)
+    if operador == "$not":
+        return not _verdadeiro(valores[0])
+    if operador == "$in":
+        valor, lista = valores
+        return any(_igual(valor, item) for item in lista)
+    if operador == "$concat":
+        if any(v is None or v is _AUSENTE for v in valores):
+            return None
+        return "".join(valores)
+    if operador == "$toString":
+        valor = valores[0]
+        if valor is None or valor is _AUSENTE:
+            return None
+        return valor.isoformat() if isinstance(valor, datetime) else str(valor)
+    if operador == "$toObjectId":
+        return ObjectId(valores[0]) if valores[0] not in (None, _AUSENTE) else None
+    if operador in ("$toDouble", "$toInt"):
+        valor = valores[0]
+        if valor is None or valor is _AUSENTE:
+            return None
+        return float(valor) if operador == "$toDouble" else int(valor)
+    if operador in ("$year", "$month", "$dayOfMonth"):
+        data = valores[0]
+        if not isinstance(data, datetime):
+            return None
+        return {"$year": data.year, "$month": data.month, "$dayOfMonth": data.day}[operador]
+    if operador == "$dateToString":
+        data = avaliar(arg["date"], doc, variaveis)
+        if not isinstance(data, datetime):
+            return None
+        return data.strftime(arg.get("format", "%Y-%m-%dT%H:%M:%S.%LZ").replace("%L", "000"))
+    if operador == "$arrayElemAt":
+        lista, indice = valores
+        if not isinstance(lista, list) or not -len(lista) <= indice < len(lista):
+            return _AUSENTE
+        return lista[indice]
+    if operador in ("$first", "$last"):
+        lista = valores[0]
+        if not isinstance(lista, list) or not lista:
+            return _AUSENTE
+        return lista[0] if operador == "$first" else lista[-1]
+    if operador in ("$floor", "$ceil"):
+        valor = valores[0]
+        if valor is None or valor is _AUSENTE:
+            return None
+        return math.floor(valor) if operador == "$floor" else math.ceil(valor)
+    if operador == "$range":
+        inicio, fim, *passo = valores
+        return list(range(int(inicio), int(fim), int(passo[0]) if passo else 1))
+    if operador == "$round":
+        valor, casas = (valores + [0])[:2]
+        return None if valor is None else round(valor, casas)
+    raise OperationFailure(f"Unrecognized expression '{operador}'", 168)
+
+
+# Projeção e ordenação
+
+
+def _incluir(origem: dict, destino: dict, partes: List[str]):
+    chave = partes[0]
+    if chave not in origem:
+        return
+    valor = origem[chave]
+    if len(partes) == 1:
+        destino[chave] = _copiar(valor)
+    elif isinstance(valor, dict):
+        _incluir(valor, destino.setdefault(chave, {}), partes[1:])
+    elif isinstance(valor, list):
+        itens = destino.setdefault(chave, [{} for item in valor if isinstance(item, dict)])
+        for item, alvo in zip((i for i in valor if isinstance(i, dict)), itens):
+            _incluir(item, alvo, partes[1:])
+
+
+def projetar(doc: dict, projecao: Optional[dict], score: Optional[float] = None) -> dict:
+    """Aplica uma projeção de find (inclusão ou exclusão, com $meta textScore)."""
+    if not projecao:
+        return _copiar(doc)
+    metas = {c: v for c, v in projecao.items() if isinstance(v, dict)}
+    for campo, valor in metas.items():
+        if valor != {"$meta": "textScore"}:
+            raise OperationFailure(f"Unsupported projection option: {campo}: {valor}", 2)
+    comuns = {c: v for c, v in projecao.items() if c not in metas}
+    valor_id = comuns.pop("_id", None)
+    incluir_id = valor_id not in (0, False)
+    # {"_id": 1} sozinho também é uma projeção de inclusão
+    if any(v not in (0, False) for v in comuns.values()) or (
+        not comuns and valor_id not in (None, 0, False)
+    ):
+        resultado = {"_id": doc["_id"]} if incluir_id and "_id" in doc else {}
+        for campo, valor in comuns.items():
+            if valor in (0, False):
+                raise OperationFailure("Cannot do exclusion in inclusion projection", 31253)
+            _incluir(doc, resultado, campo.split("."))
+    else:
+        resultado = _copiar(doc)
+        if not incluir_id:
+            resultado.pop("_id", None)
+        for campo in comuns:
+            _remover(resultado, campo.split("."))
+    for campo in metas:
+        resultado[campo] = score if score is not None else 0.0
+    return resultado
+
+
+def _normalizar_ordenacao(chave, direcao=None) -> list:
+    if isinstance(chave, str):
+        return [(chave, 1 if direcao is None else direcao)]
+    if isinstance(chave, dict):
+        return list(chave.items())
+    return list(chave)
+
+
+def _chave_campo(doc: dict, campo: str, decrescente: bool):
+    valores = _valores(doc, campo.split("."))
+    itens = _expandir(valores) if valores and isinstance(valores[0], list) else valores
+    itens = [v for v in itens if not isinstance(v, list)] or [None]
+    escolher = max if decrescente else min
+    return escolher((_chave_ordem(v) for v in itens))
+
+
+def ordenar(docs: list, ordenacao: list, scores: Optional[dict] = None) -> list:
+    # Ordenações estáveis aplicadas da última chave para a primeira
+    for campo, direcao in reversed(ordenacao):
+        if isinstance(direcao, dict):  # {"$meta": "textScore"}
+            docs.sort(key=lambda d: (scores or {}).get(_chave_id(d["_id"]), 0.0), reverse=True)
+            continue
+        decrescente = direcao in (-1, "desc", "descending")
+        docs.sort(key=lambda d: _chave_campo(d, campo, decrescente), reverse=decrescente)
+    return docs
+
+
+# Atualizações
+
+
+def _adicionar(lista: list, itens: list, unico: bool):
+    for item in itens:
+        if not unico or not any(_igual(existente, item) for existente in lista):
+            lista.append(_copiar(item))
+
+
+def _retirar(lista: list, condicao) -> list:
+    if _eh_operador(condicao):
+        return [item for item in lista if not _corresponde_campo([item], condicao)]
+    if isinstance(condicao, dict):
+        return [
+            item for item in lista if not (isinstance(item, dict) and corresponde(item, condicao))
+        ]
+    return [item for item in lista if not _igual(item, condicao)]
+
+
+def _lista_do_campo(doc: dict, campo: str, operador: str) -> list:
+    partes = campo.split(".")
+    atual = _obter(doc, partes)
+    if atual is _AUSENTE:
+        atual = []
+        _definir(doc, partes, atual)
+    if not isinstance(atual, list):
+        raise WriteError(f"Cannot apply {operador} to non-array field {campo}", 2)
+    return atual
+
+
+def aplicar_atualizacao(doc: dict, atualizacao: dict, inserindo: bool = False):
+    """Aplica os operadores de atualização ao documento, no lugar."""
+    for operador, campos in atualizacao.items():
+        if operador == "$setOnInsert" and not inserindo:
+            continue
+        for campo, valor in campos.items():
+            partes = campo.split(".")
+            if partes[0] == "_id" and operador != "$setOnInsert" and not (
+                operador == "$set" and _igual(doc.get("_id"), valor)
+            ):
+                raise WriteError(
+                    "Performing an update on the path '_id' would modify the immutable "
+                    "field '_id'",
+                    66,
+                )
+            if operador in ("$set", "$setOnInsert"):
+                _definir(doc, partes, _copiar(valor))
+            elif operador == "$unset":
+                _remover(doc, partes)
+            elif operador in ("$inc", "$mul"):
+                atual = _obter(doc, partes, 0)
+                if not _numeros(atual) or isinstance(atual, list):
+                    raise WriteError(
+                        f"Cannot apply {operador} to a value of non-numeric type", 14
+                    )
+                _definir(doc, partes, atual + valor if operador == "$inc" else atual * valor)
+            elif operador in ("$min", "$max"):
+                atual = _obter(doc, partes)
+                if atual is _AUSENTE or _comparar(
+                    valor, atual, "$lt" if operador == "$min" else "$gt"
+                ):
+                    _definir(doc, partes, _copiar(valor))
+            elif operador == "$rename":
+                atual = _obter(doc, partes)
+                if atual is not _AUSENTE:
+                    _remover(doc, partes)
+                    _definir(doc, valor.split("."), atual)
+            elif operador == "$currentDate":
+                _definir(doc, partes, datetime.now(timezone.utc).replace(tzinfo=None))
+            elif operador in ("$addToSet", "$push"):
+                lista = _lista_do_campo(doc, campo, operador)
+                itens = valor["$each"] if isinstance(valor, dict) and "$each" in valor else [valor]
+                _adicionar(lista, itens, operador == "$addToSet")
+            elif operador in ("$pull", "$pullAll"):
+                atual = _obter(doc, partes)
+                if atual is _AUSENTE:
+                    continue
+                if not isinstance(atual, list):
+                    raise WriteError(f"Cannot apply {operador} to a non-array value", 2)
+                if operador == "$pull":
+                    atual[:] = _retirar(atual, valor)
+                else:
+                    atual[:] = [i for i in atual if not any(_igual(i, v) for v in valor)]
+            else:
+                raise WriteError(f"Unknown modifier: {operador}", 9)
+
+
+def _eh_substituicao(atualizacao) -> bool:
+    if isinstance(atualizacao, list):
+        raise OperationFailure("Atualizações com pipeline não são suportadas em memória", 2)
+    return not any(k.startswith("$") for k in atualizacao)
+
+
+def _documento_upsert(filtro: dict) -> dict:
+    """Documento inicial de um upsert: as igualdades do filtro."""
+    doc = {}
+    for chave, condicao in filtro.items():
+        if chave == "$and":
+            for sub in condicao:
+                doc.update(_documento_upsert(sub))
+        elif chave.startswith("$"):
+            continue
+        elif _eh_operador(condicao):
+            if "$eq" in condicao:
+                _definir(doc, chave.split("."), _copiar(condicao["$eq"]))
+        else:
+            _definir(doc, chave.split("."), _copiar(condicao))
+    return doc
+
+
+# Coleções
+
+
+class _Ida:
+    """Mede uma operação e a registra como ida ao banco."""
+
+    def __init__(self, comando: str):
+        self.comando = comando
+        self.documentos = 0
+
+    def __enter__(self):
+        self.inicio = time.perf_counter()
+        return self
+
+    def __exit__(self, tipo_erro, erro, rastro):
+        registrar_ida(
+            self.comando, time.perf_counter() - self.inicio, self.documentos, tipo_erro is not None
+        )
+
+
+class CursorMemoria:
+    """Cursor de find/aggregate. A consulta só roda no primeiro consumo."""
+
+    def __init__(self, executar, comando: str, planejar=None):
+        self._executar = executar
+        self._comando = comando
+        self._planejar = planejar
+        self._resultado: Optional[list] = None
+        self._ordenacao: list = []
+        self._pular = 0
+        self._limite = 0
+
+    def sort(self, chave, direcao=None):
+        self._ordenacao = _normalizar_ordenacao(chave, direcao)
+        return self
+
+    def skip(self, quantidade: int):
+        self._pular = quantidade
+        return self
+
+    def limit(self, quantidade: int):
+        self._limite = quantidade
+        return self
+
+    def batch_size(self, tamanho: int):
+        return self
+
+    def _docs(self) -> list:
+        if self._resultado is None:
+            with _Ida(self._comando) as ida:
+                self._resultado = self._executar(self._ordenacao, self._pular, self._limite)
+                ida.documentos = len(self._resultado)
+        return self._resultado
+
+    async def explain(self) -> dict:
+        if self._planejar is None:
+            raise OperationFailure(f"explain not supported for {self._comando}", 2)
+        with _Ida("explain"):
+            return self._planejar(self._ordenacao, self._pular, self._limite)
+
+    async def to_list(self, length: Optional[int] = None) -> list:
+        docs = self._docs()
+        return docs[:length] if length else list(docs)
+
+    def __aiter__(self):
+        return self._iterar()
+
+    async def _iterar(self):
+        for doc in self._docs():
+            yield doc
+
+    async def next(self):
+        docs = self._docs()
+        if not docs:
+            raise StopAsyncIteration
+        return docs.pop(0)
+
+    __anext__ = next
+
+
+class ColecaoMemoria:
+    def __init__(self, banco: "BancoMemoria", nome: str):
+        self.banco = banco
+        self.database = banco
+        self.name = nome
+        self._limpar()
+
+    def _limpar(self):
+        self._docs: Dict[object, dict] = {}
+        self._sequencia: Dict[object, int] = {}
+        self._proxima = 0
+        self._indices: Dict[str, dict] = {
+            "_id_": {"v": 2, "key": {"_id": 1}, "name": "_id_"}
+        }
+        # Chave de cada índice como foi pedida (a de texto é descrita com _fts)
+        self._chaves: Dict[str, dict] = {"_id_": {"_id": 1}}
+        # campo -> valor -> ids; ids cujo valor não é hashável ficam à parte
+        self._hash: Dict[str, Dict[object, set]] = {}
+        self._sem_chave: Dict[str, set] = {}
+        self._unicos: set = set()
+        self._pesos_texto: Dict[str, int] = {}
+        self._texto: Dict[str, set] = defaultdict(set)
+
+    # Índices
+
+    def _chaves_indice(self, doc: dict, campo: str):
+        valores = _expandir(_valores(doc, campo.split(".")))
+        if not valores:
+            return [None], False
+        chaves = [_chave_hash(v) for v in valores if _hashavel(v)]
+        return chaves, len(chaves) < len(valores)
+
+    def _indexar(self, doc: dict):
+        id = _chave_id(doc["_id"])
+        for campo, indice in self._hash.items():
+            chaves, sem_chave = self._chaves_indice(doc, campo)
+            for chave in chaves:
+                indice.setdefault(chave, set()).add(id)
+            if sem_chave:
+                self._sem_chave[campo].add(id)
+        for token in self._tokens_doc(doc):
+            self._texto[token].add(id)
+
+    def _desindexar(self, doc: dict):
+        id = _chave_id(doc["_id"])
+        for campo, indice in self._hash.items():
+            chaves, _ = self._chaves_indice(doc, campo)
+            for chave in chaves:
+                ids = indice.get(chave)
+                if ids is not None:
+                    ids.discard(id)
+                    if not ids:
+                        del indice[chave]
+            self._sem_chave[campo].discard(id)
+        for token in self._tokens_doc(doc):
+            self._texto[token].discard(id)
+
+    def _tokens_doc(self, doc: dict) -> set:
+        tokens = set()
+        for campo in self._pesos_texto:
+            for valor in _expandir(_valores(doc, campo.split("."))):
+                if isinstance(valor, str):
+                    tokens.update(palavras(valor))
+        return tokens
+
+    def _verificar_unicos(self, doc: dict, ignorar=None):
+        if ignorar is None and _chave_id(doc["_id"]) in self._docs:
+            raise DuplicateKeyError(
+                f"E11000 duplicate key error collection: {self.name} index: _id_ "
+                f"dup key: {{ _id: {doc['_id']!r} }}",
+                11000,
+            )
+        for campo in self._unicos:
+            chaves, _ = self._chaves_indice(doc, campo)
+            for chave in chaves:
+                if self._hash[campo].get(chave, set()) - {ignorar}:
+                    raise DuplicateKeyError(
+                        f"E11000 duplicate key error collection: {self.name} index: "
+                        f"{campo}_1 dup key: {{ {campo}: {chave!r} }}",
+                        11000,
+                    )
+
+    def _guardar(self, doc: dict):
+        self._verificar_unicos(doc)
+        self._docs[_chave_id(doc["_id"])] = doc
+        self._sequencia[_chave_id(doc["_id"])] = self._proxima
+        self._proxima += 1
+        self._indexar(doc)
+
+    def _substituir(self, antigo: dict, novo: dict):
+        self._desindexar(antigo)
+        try:
+            self._verificar_unicos(novo, ignorar=_chave_id(antigo["_id"]))
+        except DuplicateKeyError:
+            self._indexar(antigo)
+            raise
+        self._docs[_chave_id(novo["_id"])] = novo
+        self._indexar(novo)
+
+    def _descartar(self, doc: dict):
+        self._desindexar(doc)
+        del self._docs[_chave_id(doc["_id"])]
+        del self._sequencia[_chave_id(doc["_id"])]
+
+    # Busca
+
+    def _candidatos(self, filtro: dict) -> tuple:
+        """Campo indexado que mais restringe o filtro e os ids dele, ou
+        (None, None)."""
+        melhor = (None, None)
+        for chave, condicao in filtro.items():
+            if chave == "$and":
+                ids = [self._candidatos(sub) for sub in condicao]
+                ids = [i for i in ids if i[1] is not None]
+            elif chave == "_id" or chave in self._hash:
+                valores = _valores_igualdade(condicao)
+                if valores is None:
+                    continue
+                if chave == "_id":
+                    ids = [(chave, {_chave_id(v) for v in valores} & self._docs.keys())]
+                else:
+                    indice = self._hash[chave]
+                    encontrados = set(self._sem_chave[chave])
+                    for valor in valores:
+                        encontrados |= indice.get(_chave_hash(valor), set())
+                    ids = [(chave, encontrados)]
+            else:
+                continue
+            for campo, encontrados in ids:
+                if melhor[1] is None or len(encontrados) < len(melhor[1]):
+                    melhor = (campo, encontrados)
+        return melhor
+
+    def _indice_do_campo(self, campo: str) -> str:
+        nomes = [n for n, chave in self._chaves.items() if campo in chave]
+        return next((n for n in nomes if next(iter(self._chaves[n])) == campo), nomes[0])
+
+    def _explicar(self, filtro, ordenacao, pular, limite) -> dict:
+        """Resposta no formato do explain do servidor: IXSCAN quando um índice
+        restringe os candidatos (só igualdades e $in), senão COLLSCAN."""
+        filtro = filtro or {}
+        campo, ids = self._candidatos(filtro)
+        if campo is None:
+            plano = {"stage": "COLLSCAN", "filter": filtro, "direction": "forward"}
+            chaves = 0
+            examinados = len(self._docs)
+        else:
+            nome = self._indice_do_campo(campo)
+            plano = {
+                "stage": "FETCH",
+                "inputStage": {"stage": "IXSCAN", "indexName": nome, "keyPattern": self._chaves[nome]},
+            }
+            chaves = examinados = len(ids)
+        if "$text" in filtro:
+            nome = next(n for n, i in self._indices.items() if "_fts" in i["key"])
+            plano = {"stage": "TEXT_MATCH", "inputStage": {"stage": "IXSCAN", "indexName": nome}}
+        if ordenacao:
+            plano = {"stage": "SORT", "sortPattern": dict(ordenacao), "inputStage": plano}
+        if pular:
+            plano = {"stage": "SKIP", "skipAmount": pular, "inputStage": plano}
+        if limite:
+            plano = {"stage": "LIMIT", "limitAmount": limite, "inputStage": plano}
+        docs, _ = self._selecionar(filtro, ordenacao, pular, limite)
+        return {
+            "queryPlanner": {
+                "namespace": f"{self.banco.name}.{self.name}",
+                "parsedQuery": filtro,
+                "winningPlan": plano,
+                "rejectedPlans": [],
+            },
+            "executionStats": {
+                "nReturned": len(docs),
+                "totalKeysExamined": chaves,
+                "totalDocsExamined": examinados,
+            },
+            "ok": 1.0,
+        }
+
+    def _busca_texto(self, texto: dict) -> Dict[object, float]:
+        if not self._pesos_texto:
+            raise OperationFailure("text index required for $text query", 27)
+        termos, negados, frases = termos_busca(texto.get("$search", ""))
+        candidatos = set()
+        for termo in termos:
+            candidatos |= self._texto.get(termo, set())
+        scores = {}
+        for id in candidatos:
+            doc = self._docs[id]
+            score = 0.0
+            textos = []
+            for campo, peso in self._pesos_texto.items():
+                for valor in _expandir(_valores(doc, campo.split("."))):
+                    if not isinstance(valor, str):
+                        continue
+                    textos.append(normalizar(valor))
+                    tokens = palavras(valor)
+                    ocorrencias = sum(1 for t in tokens if t in termos)
+                    if ocorrencias:
+                        score += peso * (1 + ocorrencias) / (1 + len(tokens))
+            conjunto = set(palavras(" ".join(textos)))
+            if conjunto & negados:
+                continue
+            if any(not any(f in t for t in textos) for f in frases):
+                continue
+            scores[id] = score
+        return scores
+
+    def _buscar(self, filtro: Optional[dict]):
+        """Documentos (sem cópia) que satisfazem o filtro, na ordem natural,
+        e os scores da busca textual, se houver."""
+        filtro = filtro or {}
+        scores = None
+        campo, ids = self._candidatos(filtro)
+        if "$text" in filtro:
+            scores = self._busca_texto(filtro["$text"])
+            ids = set(scores) if ids is None else ids & set(scores)
+        restante = filtro
+        if campo == "_id" and _valores_igualdade(filtro.get("_id")) is not None:
+            # Os candidatos por _id já são exatamente os documentos pedidos;
+            # refazer o $in em cada um custaria O(documentos × valores)
+            restante = {c: v for c, v in filtro.items() if c != "_id"}
+        if ids is None:
+            docs: Iterable[dict] = self._docs.values()
+        else:
+            docs = (self._docs[i] for i in sorted(ids, key=self._sequencia.__getitem__))
+        return [d for d in docs if corresponde(d, restante)], scores
+
+    def _selecionar(self, filtro, ordenacao=None, pular=0, limite=0):
+        docs, scores = self._buscar(filtro)
+        if ordenacao:
+            fim = pular + limite if limite else None
+            if fim is not None and len(ordenacao) == 1 and not isinstance(ordenacao[0][1], dict):
+                campo, direcao = ordenacao[0]
+                decrescente = direcao in (-1, "desc", "descending")
+                escolher = heapq.nlargest if decrescente else heapq.nsmallest
+                docs = escolher(fim, docs, key=lambda d: _chave_campo(d, campo, decrescente))
+            else:
+                docs = ordenar(list(docs), ordenacao, scores)
+        docs = docs[pular : pular + limite if limite else None]
+        return docs, scores
+
+    def find(
+        self,
+        filter: Optional[dict] = None,
+        projection: Optional[dict] = None,
+        *,
+        sort=None,
+        skip: int = 0,
+        limit: int = 0,
+        session=None,
+        **opcoes,
+    ) -> CursorMemoria:
+        if isinstance(projection, (list, tuple)):
+            projection = {campo: 1 for campo in projection}
+
+        def executar(ordenacao, pular, limite):
+            docs, scores = self._selecionar(filter, ordenacao, pular, limite)
+            return [
+                projetar(d, projection, (scores or {}).get(_chave_id(d["_id"]))) for d in docs
+            ]
+
+        def planejar(ordenacao, pular, limite):
+            return self._explicar(filter, ordenacao, pular, limite)
+
+        cursor = CursorMemoria(executar, "find", planejar).skip(skip).limit(limit)
+        if sort:
+            cursor.sort(sort)
+        return cursor
+
+    async def find_one(self, filter=None, projection=None, *args, session=None, **opcoes):
+        if filter is not None and not isinstance(filter, dict):
+            filter = {"_id": filter}
+        documentos = await self.find(filter, projection, **opcoes).limit(1).to_list(1)
+        return documentos[0] if documentos else None
+
+    async def count_documents(self, filter: dict, session=None, skip=0, limit=0, **opcoes) -> int:
+        with _Ida("count"):
+            total = len(self._docs) if not filter else len(self._buscar(filter)[0])
+            total = max(0, total - skip)
+            return min(total, limit) if limit else total
+
+    async def estimated_document_count(self, **opcoes) -> int:
+        with _Ida("count"):
+            return len(self._docs)
+
+    async def distinct(self, key: str, filter: Optional[dict] = None, session=None, **opcoes):
+        with _Ida("distinct"):
+            docs, _ = self._buscar(filter)
+            distintos = []
+            for doc in docs:
+                for valor in _expandir(_valores(doc, key.split("."))):
+                    if isinstance(valor, list):
+                        continue
+                    if not any(_igual(valor, d) for d in distintos):
+                        distintos.append(valor)
+            return distintos
+
+    # Escrita
+
+    def _inserir(self, documento: dict):
+        if "_id" not in documento:
+            documento["_id"] = ObjectId()
+        self._guardar(_copiar(documento))
+
+    async def insert_one(self, document: dict, session=None, **opcoes) -> InsertOneResult:
+        with _Ida("insert"):
+            self._inserir(document)
+            return InsertOneResult(document["_id"], True)
+
+    async def insert_many(
+        self, documents: Iterable[dict], ordered: bool = True, session=None, **opcoes
+    ) -> InsertManyResult:
+        with _Ida("insert"):
+            documentos = list(documents)
+            erros = []
+            for indice, documento in enumerate(documentos):
+                try:
+                    self._inserir(documento)
+                except DuplicateKeyError as e:
+                    erros.append(
+                        {"index": indice, "code": 11000, "errmsg": str(e), "op": documento}
+                    )
+                    if ordered:
+                        break
+            if erros:
+                raise BulkWriteError(
+                    {
+                        "writeErrors": erros,
+                        "writeConcernErrors": [],
+                        "nInserted": len(documentos) - len(erros),
+                        "nUpserted": 0,
+                        "nMatched": 0,
+                        "nModified": 0,
+                        "nRemoved": 0,
+                        "upserted": [],
+                    }
+                )
+            return InsertManyResult([d["_id"] for d in documentos], True)
+
+    def _atualizar(self, filtro: dict, atualizacao, varios: bool, upsert: bool, ordenacao=None):
+        """Aplica a atualização e retorna (encontrados, modificados, id do
+        upsert, [(antes, depois)])."""
+        substituicao = _eh_substituicao(atualizacao)
+        if substituicao and varios:
+            raise OperationFailure("multi update is not supported for replacement-style update", 2)
+        docs, _ = self._selecionar(filtro, ordenacao, 0, 0 if varios else 1)
+        alteracoes = []
+        modificados = 0
+        for antigo in docs:
+            if substituicao:
+                novo = {"_id": antigo["_id"], **_copiar(atualizacao)}
+            else:
+                novo = _copiar(antigo)
+                aplicar_atualizacao(novo, atualizacao)
+            if novo != antigo:
+                self._substituir(antigo, novo)
+                modificados += 1
+            alteracoes.append((antigo, novo))
+        if docs or not upsert:
+            return len(docs), modificados, None, alteracoes
+        novo = _documento_upsert(filtro)
+        if substituicao:
+            novo = {**({"_id": novo["_id"]} if "_id" in novo else {}), **_copiar(atualizacao)}
+        else:
+            aplicar_atualizacao(novo, atualizacao, inserindo=True)
+        novo.setdefault("_id", ObjectId())
+        self._guardar(novo)
+        return 0, 0, novo["_id"], [(None, novo)]
+
+    @staticmethod
+    def _resultado_atualizacao(encontrados, modificados, upsert_id) -> UpdateResult:
+        bruto = {"n": encontrados + (upsert_id is not None), "nModified": modificados}
+        if upsert_id is not None:
+            bruto["upserted"] = upsert_id
+        return UpdateResult(bruto, True)
+
+    async def update_one(self, filter, update, upsert=False, session=None, **opcoes):
+        with _Ida("update"):
+            return self._resultado_atualizacao(
+                *self._atualizar(filter, update, False, upsert, opcoes.get("sort"))[:3]
+            )
+
+    async def update_many(self, filter, update, upsert=False, session=None, **opcoes):
+        with _Ida("update"):
+            return self._resultado_atualizacao(*self._atualizar(filter, update, True, upsert)[:3])
+
+    async def replace_one(self, filter, replacement, upsert=False, session=None, **opcoes):
+        if not _eh_substituicao(replacement):
+            raise ValueError("replacement can not include $ operators")
+        with _Ida("update"):
+            return self._resultado_atualizacao(
+                *self._atualizar(filter, replacement, False, upsert)[:3]
+            )
+
+    async def find_one_and_update(
+        self,
+        filter,
+        update,
+        projection=None,
+        sort=None,
+        upsert=False,
+        return_document=ReturnDocument.BEFORE,
+        session=None,
+        **opcoes,
+    ):
+        with _Ida("findAndModify") as ida:
+            ordenacao = _normalizar_ordenacao(sort) if sort else None
+            _, _, _, alteracoes = self._atualizar(filter, update, False, upsert, ordenacao)
+            if not alteracoes:
+                return None
+            antes, depois = alteracoes[0]
+            doc = depois if return_document == ReturnDocument.AFTER else antes
+            ida.documentos = int(doc is not None)
+            return projetar(doc, projection) if doc is not None else None
+
+    async def find_one_and_replace(self, filter, replacement, *args, **opcoes):
+        if not _eh_substituicao(replacement):
+            raise ValueError("replacement can not include $ operators")
+        return await self.find_one_and_update(filter, replacement, *args, **opcoes)
+
+    async def find_one_and_delete(self, filter, projection=None, sort=None, session=None, **opcoes):
+        with _Ida("findAndModify") as ida:
+            ordenacao = _normalizar_ordenacao(sort) if sort else None
+            docs, _ = self._selecionar(filter, ordenacao, 0, 1)
+            if not docs:
+                return None
+            self._descartar(docs[0])
+            ida.documentos = 1
+            return projetar(docs[0], projection)
+
+    def _excluir(self, filtro: dict, varios: bool) -> int:
+        docs, _ = self._selecionar(filtro, None, 0, 0 if varios else 1)
+        for doc in docs:
+            self._descartar(doc)
+        return len(docs)
+
+    async def delete_one(self, filter, session=None, **opcoes) -> DeleteResult:
+        with _Ida("delete"):
+            return DeleteResult({"n": self._excluir(filter, False)}, True)
+
+    async def delete_many(self, filter, session=None, **opcoes) -> DeleteResult:
+        with _Ida("delete"):
+            return DeleteResult({"n": self._excluir(filter, True)}, True)
+
+    def _operacao_lote(self, operacao, totais: dict, indice: int):
+        # As operações do pymongo guardam os argumentos em atributos internos
+        if isinstance(operacao, InsertOne):
+            self._inserir(operacao._doc)
+            totais["nInserted"] += 1
+        elif isinstance(operacao, (UpdateOne, UpdateMany, ReplaceOne)):
+            encontrados, modificados, upsert_id, _ = self._atualizar(
+                operacao._filter,
+                operacao._doc,
+                isinstance(operacao, UpdateMany),
+                bool(operacao._upsert),
+            )
+            totais["nMatched"] += encontrados
+            totais["nModified"] += modificados
+            if upsert_id is not None:
+                totais["nUpserted"] += 1
+                totais["upserted"].append({"index": indice, "_id": upsert_id})
+        elif isinstance(operacao, (DeleteOne, DeleteMany)):
+            totais["nRemoved"] += self._excluir(operacao._filter, isinstance(operacao, DeleteMany))
+        else:
+            raise TypeError(f"{operacao!r} não é uma operação de escrita válida")
+
+    async def bulk_write(self, requests, ordered: bool = True, session=None, **opcoes):
+        with _Ida("bulkWrite"):
+            totais = {
+                "writeErrors": [],
+                "writeConcernErrors": [],
+                "nInserted": 0,
+                "nUpserted": 0,
+                "nMatched": 0,
+                "nModified": 0,
+                "nRemoved": 0,
+                "upserted": [],
+            }
+            for indice, operacao in enumerate(requests):
+                try:
+                    self._operacao_lote(operacao, totais, indice)
+                except (WriteError, DuplicateKeyError) as e:
+                    totais["writeErrors"].append(
+                        {"index": indice, "code": e.code, "errmsg": str(e)}
+                    )
+                    if ordered:
+                        break
+            if totais["writeErrors"]:
+                raise BulkWriteError(totais)
+            return BulkWriteResult(totais, True)
+
+    # Agregação
+
+    def _geo_near(self, especificacao: dict) -> list:
+        campos = [
+            campo
+            for chave in self._chaves.values()
+            for campo, direcao in chave.items()
+            if direcao == "2dsphere"
+        ]
+        if not campos:
+            raise OperationFailure(
+                "$geoNear requires a 2d or 2dsphere index, but none were found", 291
+            )
+        campo = especificacao.get("key")
+        if campo is None:
+            if len(set(campos)) > 1:
+                raise OperationFailure(
+                    "There is more than one 2dsphere index; unsure which to use for $geoNear", 2
+                )
+            campo = campos[0]
+        elif campo not in campos:
+            raise OperationFailure(f"no geo indices for geoNear on key {campo}", 2)
+        centro = _ponto(especificacao["near"])
+        if centro is None:
+            raise OperationFailure("$geoNear requires a 'near' point", 2)
+        minimo = especificacao.get("minDistance", 0)
+        maximo = especificacao.get("maxDistance", math.inf)
+        multiplicador = especificacao.get("distanceMultiplier", 1)
+        docs, _ = self._buscar(especificacao.get("query") or {})
+        encontrados = []
+        for doc in docs:
+            ponto = _ponto(_obter(doc, campo.split("."), None))
+            if ponto is None:
+                continue
+            distancia = distancia_m(centro, ponto)
+            if minimo <= distancia <= maximo:
+                encontrados.append((distancia, self._sequencia[_chave_id(doc["_id"])], doc))
+        encontrados.sort(key=lambda item: item[:2])
+        resultado = []
+        for distancia, _, doc in encontrados:
+            doc = _copiar(doc)
+            _definir(doc, especificacao["distanceField"].split("."), distancia * multiplicador)
+            resultado.append(doc)
+        return resultado
+
+    def aggregate(self, pipeline: list, session=None, **opcoes) -> CursorMemoria:
+        def executar(ordenacao, pular, limite):
+            etapas = list(pipeline)
+            scores = None
+            if etapas and "$geoNear" in etapas[0]:
+                docs = self._geo_near(etapas.pop(0)["$geoNear"])
+                return executar_pipeline(self.banco, docs, etapas)
+            # Um $match inicial usa os índices da coleção (e o $text)
+            if etapas and "$match" in etapas[0]:
+                docs, scores = self._buscar(etapas.pop(0)["$match"])
+            else:
+                docs = list(self._docs.values())
+            docs = [_copiar(d) for d in docs]
+            if scores:
+                for doc in docs:
+                    doc["$textScore"] = scores.get(_chave_id(doc["_id"]), 0.0)
+            return executar_pipeline(self.banco, docs, etapas)
+
+        return CursorMemoria(executar, "aggregate")
+
+    # Administração
+
+    def list_indexes(self, session=None, **opcoes) -> CursorMemoria:
+        return CursorMemoria(
+            lambda *_: [_copiar(i) for i in self._indices.values()], "listIndexes"
+        )
+
+    async def index_information(self) -> dict:
+        return {
+            nome: {"key": list(i["key"].items()), **{k: v for k, v in i.items() if k != "key"}}
+            for nome, i in self._indices.items()
+        }
+
+    def _criar_indice(self, documento: dict) -> str:
+        chave = dict(documento["key"])
+        nome = documento.get("name") or "_".join(f"{c}_{d}" for c, d in chave.items())
+        if nome in self._indices:
+            if self._chaves[nome] != chave:
+                raise OperationFailure(
+                    f"An existing index has the same name as the requested index: {nome}", 86
+                )
+            return nome
+        info = {k: v for k, v in documento.items() if k not in ("key", "name")}
+        if "text" in chave.values():
+            if self._pesos_texto:
+                raise OperationFailure("only one text index per collection allowed", 85)
+            self._pesos_texto = {
+                c: info.get("weights", {}).get(c, 1) for c, d in chave.items() if d == "text"
+            }
+            # O servidor descreve índices de texto com as chaves _fts/_ftsx
+            self._indices[nome] = {
+                "v": 2,
+                "key": {"_fts": "text", "_ftsx": 1},
+                "name": nome,
+                "weights": dict(self._pesos_texto),
+                **{k: v for k, v in info.items() if k != "weights"},
+            }
+            self._chaves[nome] = chave
+            for doc in self._docs.values():
+                for token in self._tokens_doc(doc):
+                    self._texto[token].add(_chave_id(doc["_id"]))
+            return nome
+        for campo, direcao in chave.items():
+            if direcao == "2dsphere":
+                continue
+            if campo not in self._hash:
+                self._hash[campo] = {}
+                self._sem_chave[campo] = set()
+                for doc in self._docs.values():
+                    chaves, sem_chave = self._chaves_indice(doc, campo)
+                    for c in chaves:
+                        self._hash[campo].setdefault(c, set()).add(_chave_id(doc["_id"]))
+                    if sem_chave:
+                        self._sem_chave[campo].add(_chave_id(doc["_id"]))
+        if info.get("unique") and len(chave) == 1:
+            campo = next(iter(chave))
+            if any(len(ids) > 1 for c, ids in self._hash[campo].items()):
+                raise DuplicateKeyError(f"E11000 duplicate key error index: {nome}", 11000)
+            self._unicos.add(campo)
+        self._indices[nome] = {"v": 2, "key": chave, "name": nome, **info}
+        self._chaves[nome] = chave
+        return nome
+
+    async def create_indexes(self, indexes: list, session=None, **opcoes) -> List[str]:
+        with _Ida("createIndexes"):
+            return [self._criar_indice(i.document) for i in indexes]
+
+    async def create_index(self, keys, session=None, **opcoes) -> str:
+        with _Ida("createIndexes"):
+            return self._criar_indice({"key": dict(_normalizar_ordenacao(keys)), **opcoes})
+
+    def _reconstruir_indices(self):
+        documentos = [
+            {**i, "key": self._chaves[n]} for n, i in self._indices.items() if n != "_id_"
+        ]
+        docs = list(self._docs.values())
+        self._limpar()
+        for documento in documentos:
+            self._criar_indice(documento)
+        for doc in docs:
+            self._guardar(doc)
+
+    async def drop_index(self, index_or_name, session=None, **opcoes):
+        with _Ida("dropIndexes"):
+            nome = index_or_name
+            if not isinstance(nome, str):
+                chave = dict(_normalizar_ordenacao(nome))
+                nome = next((n for n, i in self._indices.items() if i["key"] == chave), None)
+            if nome == "_id_":
+                raise OperationFailure("cannot drop _id index", 72)
+            if nome not in self._indices:
+                raise OperationFailure(f"index not found with name [{nome}]", 27)
+            del self._indices[nome]
+            self._reconstruir_indices()
+
+    async def drop_indexes(self, session=None, **opcoes):
+        with _Ida("dropIndexes"):
+            self._indices = {"_id_": self._indices["_id_"]}
+            self._reconstruir_indices()
+
+    async def drop(self, session=None, **opcoes):
+        with _Ida("drop"):
+            self._limpar()
+
+
+# Pipeline de agregação
+
+
+def _projetar_agregacao(doc: dict, especificacao: dict) -> dict:
+    comuns = {c: v for c, v in especificacao.items() if c != "_id"}
+    exclusao = comuns and all(v in (0, False) for v in comuns.values())
+    if exclusao:
+        return projetar(doc, especificacao)
+    resultado = {}
+    if especificacao.get("_id", 1) not in (0, False):
+        if "_id" in especificacao and especificacao["_id"] not in (1, True):
+            resultado["_id"] = avaliar(especificacao["_id"], doc)
+        elif "_id" in doc:
+            resultado["_id"] = doc["_id"]
+    for campo, valor in comuns.items():
+        if valor in (1, True):
+            _incluir(doc, resultado, campo.split("."))
+        elif valor in (0, False):
+            raise OperationFailure("Invalid $project :: cannot mix inclusion and exclusion", 31254)
+        else:
+            calculado = avaliar(valor, doc)
+            if calculado is not _AUSENTE:
+                _definir(resultado, campo.split("."), calculado)
+    return resultado
+
+
+def _lookup(banco: "BancoMemoria", docs: list, especificacao: dict) -> list:
+    estrangeira = banco[especificacao["from"]]
+    sub_pipeline = especificacao.get("pipeline", [])
+    destino = especificacao["as"].split(".")
+    if "localField" not in especificacao:
+        resultado = executar_pipeline(
+            banco, [_copiar(d) for d in estrangeira._docs.values()], sub_pipeline
+        )
+        for doc in docs:
+            _definir(doc, destino, _copiar(resultado))
+        return docs
+
+    local = especificacao["localField"].split(".")
+    campo = especificacao["foreignField"]
+    usa_indice = campo == "_id" or campo in estrangeira._hash
+    por_valor = None
+    if not usa_indice:
+        por_valor = defaultdict(list)
+        for estrangeiro in estrangeira._docs.values():
+            valores = _expandir(_valores(estrangeiro, campo.split("."))) or [None]
+            for valor in valores:
+                if _hashavel(valor):
+                    por_valor[_chave_hash(valor)].append(estrangeiro)
+
+    for doc in docs:
+        valores = _expandir(_valores(doc, local)) or [None]
+        valores = [v for v in valores if _hashavel(v)]
+        if usa_indice:
+            encontrados, _ = estrangeira._buscar({campo: {"$in": valores}})
+        else:
+            vistos, encontrados = set(), []
+            for valor in valores:
+                for estrangeiro in por_valor.get(_chave_hash(valor), ()):
+                    if id(estrangeiro) not in vistos:
+                        vistos.add(id(estrangeiro))
+                        encontrados.append(estrangeiro)
+        encontrados = [_copiar(e) for e in encontrados]
+        if sub_pipeline:
+            encontrados = executar_pipeline(banco, encontrados, sub_pipeline)
+        _definir(doc, destino, encontrados)
+    return docs
+
+
+def _unwind(docs: list, especificacao) -> list:
+    if isinstance(especificacao, str):
+        especificacao = {"path": especificacao}
+    partes = especificacao["path"].lstrip("$").split(".")
+    manter = especificacao.get("preserveNullAndEmptyArrays", False)
+    indice_campo = especificacao.get("includeArrayIndex")
+    resultado = []
+    for doc in docs:
+        valor = _obter(doc, partes)
+        if isinstance(valor, list) and valor:
+            for indice, item in enumerate(valor):
+                novo = _copiar(doc)
+                _definir(novo, partes, _copiar(item))
+                if indice_campo:
+                    novo[indice_campo] = indice
+                resultado.append(novo)
+        elif isinstance(valor, list) or valor is _AUSENTE or valor is None:
+            if manter:
+                novo = _copiar(doc)
+                if indice_campo:
+                    novo[indice_campo] = None
+                resultado.append(novo)
+        else:
+            if indice_campo:
+                doc[indice_campo] = None
+            resultado.append(doc)
+    return resultado
+
+
+def _group(docs: list, especificacao: dict) -> list:
+    grupos: Dict[object, dict] = {}
+    valores: Dict[object, dict] = {}
+    acumuladores = {c: v for c, v in especificacao.items() if c != "_id"}
+    for doc in docs:
+        chave = avaliar(especificacao["_id"], doc)
+        if chave is _AUSENTE:
+            chave = None
+        identificador = repr(_chave_ordem(chave)) if not _hashavel(chave) else _chave_hash(chave)
+        if identificador not in grupos:
+            grupos[identificador] = {"_id": chave}
+            valores[identificador] = {c: [] for c in acumuladores}
+        for campo, acumulador in acumuladores.items():
+            operador, expressao = next(iter(acumulador.items()))
+            valores[identificador][campo].append(
+                None if operador == "$count" else avaliar(expressao, doc)
+            )
+    for identificador, grupo in grupos.items():
+        for campo, acumulador in acumuladores.items():
+            operador = next(iter(acumulador))
+            itens = valores[identificador][campo]
+            if operador == "$count":
+                grupo[campo] = len(itens)
+            elif operador in ("$sum", "$avg", "$min", "$max"):
+                # No $group, arrays não são somados como no $project
+                itens = [i for i in itens if not isinstance(i, list)]
+                grupo[campo] = _acumular(operador, itens)
+                if operador == "$sum" and grupo[campo] is None:
+                    grupo[campo] = 0
+            elif operador in ("$first", "$last"):
+                item = itens[0] if operador == "$first" else itens[-1]
+                grupo[campo] = None if item is _AUSENTE else item
+            elif operador == "$push":
+                grupo[campo] = [i for i in itens if i is not _AUSENTE]
+            elif operador == "$addToSet":
+                grupo[campo] = []
+                _adicionar(grupo[campo], [i for i in itens if i is not _AUSENTE], True)
+            else:
+                raise OperationFailure(f"unknown group operator '{operador}'", 15952)
+    return list(grupos.values())
+
+
+def _merge(banco: "BancoMemoria", docs: list, especificacao):
+    """Grava os documentos na coleção de destino, casando pelos campos de `on`."""
+    if isinstance(especificacao, str):
+        especificacao = {"into": especificacao}
+    destino = especificacao["into"]
+    if isinstance(destino, dict):
+        destino = destino["coll"]
+    campos = especificacao.get("on", "_id")
+    campos = [campos] if isinstance(campos, str) else list(campos)
+    quando_existe = especificacao.get("whenMatched", "merge")
+    quando_nao_existe = especificacao.get("whenNotMatched", "insert")
+    if not isinstance(quando_existe, str):
+        raise OperationFailure("$merge with a pipeline in whenMatched is not supported", 2)
+    colecao = banco[destino]
+    for doc in docs:
+        filtro = {c: _obter(doc, c.split("."), None) for c in campos}
+        existentes, _ = colecao._buscar(filtro)
+        if len(existentes) > 1:
+            raise OperationFailure("$merge 'on' fields must identify a single document", 51132)
+        if existentes:
+            atual = existentes[0]
+            if quando_existe == "keepExisting":
+                continue
+            if quando_existe == "fail":
+                raise DuplicateKeyError("$merge found a matching document", 11000)
+            if quando_existe == "replace":
+                novo = {**_copiar(doc), "_id": atual["_id"]}
+            else:
+                novo = {**_copiar(atual), **_copiar(doc), "_id": atual["_id"]}
+            colecao._substituir(atual, novo)
+        elif quando_nao_existe == "insert":
+            colecao._inserir(_copiar(doc))
+        elif quando_nao_existe == "fail":
+            raise OperationFailure("$merge could not find a matching document", 13113)
+
+
+def executar_pipeline(banco: "BancoMemoria", docs: list, pipeline: list) -> list:
+    """Executa as etapas sobre documentos já copiados."""
+    for posicao, etapa in enumerate(pipeline):
+        (nome, especificacao), = etapa.items()
+        if nome == "$geoNear":
+            raise OperationFailure("$geoNear is only valid as the first stage in a pipeline", 40603)
+        if nome == "$match":
+            docs = [d for d in docs if corresponde(d, especificacao)]
+        elif nome == "$project":
+            docs = [_projetar_agregacao(d, especificacao) for d in docs]
+        elif nome in ("$addFields", "$set"):
+            for doc in docs:
+                for campo, expressao in especificacao.items():
+                    valor = avaliar(expressao, doc)
+                    if valor is not _AUSENTE:
+                        _definir(doc, campo.split("."), valor)
+        elif nome == "$unset":
+            campos = [especificacao] if isinstance(especificacao, str) else especificacao
+            for doc in docs:
+                for campo in campos:
+                    _remover(doc, campo.split("."))
+        elif nome == "$lookup":
+            docs = _lookup(banco, docs, especificacao)
+        elif nome == "$unwind":
+            docs = _unwind(docs, especificacao)
+        elif nome == "$group":
+            docs = _group(docs, especificacao)
+        elif nome == "$sort":
+            ordenacao = list(especificacao.items())
+            scores = {_chave_id(d["_id"]): d.get("$textScore", 0.0) for d in docs if "_id" in d}
+            docs = ordenar(docs, ordenacao, scores)
+        elif nome == "$skip":
+            docs = docs[especificacao:]
+        elif nome == "$limit":
+            docs = docs[:especificacao]
+        elif nome == "$count":
+            docs = [{especificacao: len(docs)}] if docs else []
+        elif nome in ("$replaceRoot", "$replaceWith"):
+            raiz = especificacao["newRoot"] if nome == "$replaceRoot" else especificacao
+            docs = [avaliar(raiz, d) for d in docs]
+        elif nome == "$merge":
+            if posicao != len(pipeline) - 1:
+                raise OperationFailure("$merge can only be the final stage in the pipeline", 40601)
+            _merge(banco, docs, especificacao)
+            docs = []
+        elif nome == "$facet":
+            docs = [
+                {
+                    campo: executar_pipeline(banco, [_copiar(d) for d in docs], sub)
+                    for campo, sub in especificacao.items()
+                }
+            ]
+        else:
+            raise OperationFailure(f"Unrecognized pipeline stage name: '{nome}'", 40324)
+    for doc in docs:
+        doc.pop("$textScore", None)
+    return docs
+
+
+# Cliente e banco
+
+
+class BancoMemoria:
+    def __init__(self, nome: str):
+        self.name = nome
+        self._colecoes: Dict[str, ColecaoMemoria] = {}
+
+    def __getitem__(self, nome: str) -> ColecaoMemoria:
+        colecao = self._colecoes.get(nome)
+        if colecao is None:
+            colecao = self._colecoes[nome] = ColecaoMemoria(self, nome)
+        return colecao
+
+    def __getattr__(self, nome: str) -> ColecaoMemoria:
+        if nome.startswith("_"):
+            raise AttributeError(nome)
+        return self[nome]
+
+    def get_collection(self, nome: str, **opcoes) -> ColecaoMemoria:
+        return self[nome]
+
+    async def list_collection_names(self, **opcoes) -> List[str]:
+        return list(self._colecoes)
+
+    async def drop_collection(self, nome, **opcoes):
+        self._colecoes.pop(getattr(nome, "name", nome), None)
+
+    async def command(self, comando, *args, **opcoes) -> dict:
+        nome = comando if isinstance(comando, str) else next(iter(comando))
+        with _Ida(nome):
+            if nome in ("ping", "buildInfo", "buildinfo"):
+                return {"ok": 1.0}
+            if nome in ("hello", "isMaster", "ismaster"):
+                # Sem setName: a aplicação não tenta abrir transações
+                return {"isWritablePrimary": True, "ismaster": True, "ok": 1.0}
+            raise OperationFailure(f"no such command: '{nome}'", 59)
+
+
+class ClienteMemoria:
+    """Substitui o AsyncIOMotorClient quando BACKEND=memoria."""
+
+    def __init__(self, **opcoes):
+        self._bancos: Dict[str, BancoMemoria] = {}
+
+    def __getitem__(self, nome: str) -> BancoMemoria:
+        banco = self._bancos.get(nome)
+        if banco is None:
+            banco = self._bancos[nome] = BancoMemoria(nome)
+        return banco
+
+    @property
+    def admin(self) -> BancoMemoria:
+        return self["admin"]
+
+    def get_database(self, nome: str, **opcoes) -> BancoMemoria:
+        return self[nome]
+
+    async def list_database_names(self) -> List[str]:
+        return list(self._bancos)
+
+    async def drop_database(self, nome):
+        self._bancos.pop(getattr(nome, "name", nome), None)
+
+    def close(self):
+        pass
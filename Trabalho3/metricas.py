@@ -0,0 +1,214 @@
+"""Métricas da aplicação no formato texto do Prometheus.
+
+Um middleware mede cada requisição e um CommandListener do pymongo mede cada
+comando enviado ao MongoDB. O Motor executa os comandos em threads com uma
+cópia do contexto da requisição, então o ouvinte consegue atribuir cada
+comando à rota que o causou e contar as idas ao banco por requisição.
+"""
+
+import threading
+import time
+from collections import defaultdict
+from contextvars import ContextVar
+from typing import Dict, Optional, Tuple
+
+from fastapi import Request
+from pymongo import monitoring
+
+# Limites (em segundos) dos buckets de latência
+BUCKETS_LATENCIA = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+# Limites dos buckets de idas ao banco por requisição
+BUCKETS_IDAS = (0, 1, 2, 5, 10, 25, 50, 100, 250, 1000)
+
+
+class Histograma:
+    def __init__(self, buckets: Tuple[float, ...]):
+        self.buckets = buckets
+        self.contagens = [0] * len(buckets)
+        self.soma = 0.0
+        self.total = 0
+
+    def observar(self, valor: float):
+        self.soma += valor
+        self.total += 1
+        for i, limite in enumerate(self.buckets):
+            if valor <= limite:
+                self.contagens[i] += 1
+
+    def linhas(self, nome: str, rotulos: str) -> list:
+        separador = "," if rotulos else ""
+        linhas = [
+            f'{nome}_bucket{{{rotulos}{separador}le="{limite}"}} {contagem}'
+            for limite, contagem in zip(self.buckets, self.contagens)
+        ]
+        linhas.append(f'{nome}_bucket{{{rotulos}{separador}le="+Inf"}} {self.total}')
+        linhas.append(f"{nome}_sum{{{rotulos}}} {self.soma}")
+        linhas.append(f"{nome}_count{{{rotulos}}} {self.total}")
+        return linhas
+
+
+class EstatisticasRequisicao:
+    """Comandos do MongoDB feitos durante uma requisição."""
+
+    def __init__(self):
+        self.comandos = 0
+        self.documentos = 0
+        self.duracao = 0.0
+
+
+requisicao_atual: ContextVar[Optional[EstatisticasRequisicao]] = ContextVar(
+    "requisicao_atual", default=None
+)
+
+
+class Metricas:
+    def __init__(self):
+        # Os comandos do MongoDB são registrados a partir das threads do Motor
+        self.trava = threading.Lock()
+        self.em_andamento = 0
+        self.latencia: Dict[tuple, Histograma] = {}
+        self.status: Dict[tuple, int] = defaultdict(int)
+        self.idas_por_requisicao: Dict[tuple, Histograma] = {}
+        self.comandos_por_rota: Dict[tuple, int] = defaultdict(int)
+        self.duracao_comandos: Dict[str, Histograma] = {}
+        self.documentos_comandos: Dict[str, int] = defaultdict(int)
+        self.falhas_comandos: Dict[str, int] = defaultdict(int)
+        # Contadores avulsos de outros módulos, ex. acertos de cache
+        self.contadores: Dict[tuple, int] = defaultdict(int)
+
+    def registrar_requisicao(
+        self, metodo: str, rota: str, status: int, duracao: float, estatisticas
+    ):
+        chave = (metodo, rota)
+        with self.trava:
+            if chave not in self.latencia:
+                self.latencia[chave] = Histograma(BUCKETS_LATENCIA)
+                self.idas_por_requisicao[chave] = Histograma(BUCKETS_IDAS)
+            self.latencia[chave].observar(duracao)
+            self.idas_por_requisicao[chave].observar(estatisticas.comandos)
+            self.status[(metodo, rota, status)] += 1
+            self.comandos_por_rota[chave] += estatisticas.comandos
+
+    def registrar_comando(self, comando: str, duracao: float, documentos: int, falhou: bool):
+        with self.trava:
+            if comando not in self.duracao_comandos:
+                self.duracao_comandos[comando] = Histograma(BUCKETS_LATENCIA)
+            self.duracao_comandos[comando].observar(duracao)
+            self.documentos_comandos[comando] += documentos
+            if falhou:
+                self.falhas_comandos[comando] += 1
+
+    def incrementar(self, nome: str, quantidade: int = 1, **rotulos):
+        with self.trava:
+            self.contadores[(nome, tuple(sorted(rotulos.items())))] += quantidade
+
+    def exportar(self) -> str:
+        with self.trava:
+            linhas = [
+                "# TYPE http_requests_in_flight gauge",
+                f"http_requests_in_flight {self.em_andamento}",
+                "# TYPE http_request_duration_seconds histogram",
+            ]
+            for (metodo, rota), hist in self.latencia.items():
+                linhas += hist.linhas(
+                    "http_request_duration_seconds", f'method="{metodo}",route="{rota}"'
+                )
+            linhas.append("# TYPE http_requests_total counter")
+            for (metodo, rota, status), total in self.status.items():
+                linhas.append(
+                    f'http_requests_total{{method="{metodo}",route="{rota}",status="{status}"}} {total}'
+                )
+            linhas.append("# TYPE mongodb_commands_per_request histogram")
+            for (metodo, rota), hist in self.idas_por_requisicao.items():
+                linhas += hist.linhas(
+                    "mongodb_commands_per_request", f'method="{metodo}",route="{rota}"'
+                )
+            linhas.append("# TYPE mongodb_commands_by_route_total counter")
+            for (metodo, rota), total in self.comandos_por_rota.items():
+                linhas.append(
+                    f'mongodb_commands_by_route_total{{method="{metodo}",route="{rota}"}} {total}'
+                )
+            linhas.append("# TYPE mongodb_command_duration_seconds histogram")
+            for comando, hist in self.duracao_comandos.items():
+                linhas += hist.linhas("mongodb_command_duration_seconds", f'command="{comando}"')
+            linhas.append("# TYPE mongodb_documents_returned_total counter")
+            for comando, total in self.documentos_comandos.items():
+                linhas.append(f'mongodb_documents_returned_total{{command="{comando}"}} {total}')
+            linhas.append("# TYPE mongodb_command_failures_total counter")
+            for comando, total in self.falhas_comandos.items():
+                linhas.append(f'mongodb_command_failures_total{{command="{comando}"}} {total}')
+            for (nome, rotulos), total in self.contadores.items():
+                texto = ",".join(f'{chave}="{valor}"' for chave, valor in rotulos)
+                linhas.append(f"{nome}{{{texto}}} {total}")
+        return "\n".join(linhas) + "\n"
+
+
+metricas = Metricas()
+
+
+def _documentos_retornados(resposta: dict) -> int:
+    cursor = resposta.get("cursor")
+    if cursor:
+        return len(cursor.get("firstBatch", cursor.get("nextBatch", [])))
+    if "value" in resposta:  # findAndModify
+        return 1 if resposta["value"] is not None else 0
+    return 0
+
+
+def registrar_ida(comando: str, duracao: float, documentos: int, falhou: bool = False):
+    """Registra uma ida ao banco e a soma à requisição em andamento, se houver."""
+    metricas.registrar_comando(comando, duracao, documentos, falhou)
+    estatisticas = requisicao_atual.get()
+    if estatisticas is not None:
+        with metricas.trava:
+            estatisticas.comandos += 1
+            estatisticas.documentos += documentos
+            estatisticas.duracao += duracao
+
+
+class OuvinteComandos(monitoring.CommandListener):
+    """Registra duração e documentos de cada comando enviado ao MongoDB."""
+
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        registrar_ida(
+            event.command_name,
+            event.duration_micros / 1_000_000,
+            _documentos_retornados(event.reply),
+        )
+
+    def failed(self, event):
+        registrar_ida(event.command_name, event.duration_micros / 1_000_000, 0, True)
+
+
+ouvinte_comandos = OuvinteComandos()
+
+
+async def middleware_metricas(request: Request, call_next):
+    estatisticas = EstatisticasRequisicao()
+    token = requisicao_atual.set(estatisticas)
+    with metricas.trava:
+        metricas.em_andamento += 1
+    inicio = time.perf_counter()
+    status = 500
+    try:
+        resposta = await call_next(request)
+        status = resposta.status_code
+        return resposta
+    finally:
+        duracao = time.perf_counter() - inicio
+        with metricas.trava:
+            metricas.em_andamento -= 1
+        # Usa o molde da rota (ex. /pessoas/{pessoa_id}) para não criar uma
+        # série por id; rotas inexistentes ficam agrupadas
+        rota = request.scope.get("route")
+        metricas.registrar_requisicao(
+            request.method,
+            rota.path if rota is not None else "desconhecida",
+            status,
+            duracao,
+            estatisticas,
+        )
+        requisicao_atual.reset(token)
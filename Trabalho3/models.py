@@ -1,40 +1,68 @@
 from pydantic import BaseModel, Field, EmailStr, GetJsonSchemaHandler
-from typing import List, Optional
+from typing import Any, Callable, Dict, List, Literal, NamedTuple, Optional
 from pydantic_core import core_schema
 from bson import ObjectId
+from pymongo import ASCENDING, GEOSPHERE, TEXT, IndexModel
 from datetime import datetime
 
 
+# Conversores gerados por modelo na primeira vez em que são usados
+_CONVERSORES: Dict[type, Callable[[dict], dict]] = {}
+
+
+def _gerar_conversor(cls) -> Callable[[dict], dict]:
+    """Gera a função que leva um documento do banco para o formato do modelo.
+
+    Os campos terminados em _id/_ids guardam ObjectId no banco e são
+    convertidos para str; campos ausentes recebem o valor padrão do modelo e
+    chaves que não são campos do modelo são descartadas.
+    """
+    escalares, listas, padroes = [], [], {}
+    for nome, campo in cls.model_fields.items():
+        if nome == "id":
+            continue
+        if nome.endswith("_ids"):
+            listas.append(nome)
+        elif nome.endswith("_id"):
+            escalares.append(nome)
+        if not campo.is_required():
+            padroes[nome] = campo
+    campos = [n for n in cls.model_fields if n != "id"]
+
+    def converter(doc: dict) -> dict:
+        convertido = {"id": str(doc["_id"])}
+        for nome in campos:
+            if nome in doc:
+                convertido[nome] = doc[nome]
+            elif nome in padroes:
+                convertido[nome] = padroes[nome].get_default(call_default_factory=True)
+        for nome in escalares:
+            if convertido.get(nome) is not None:
+                convertido[nome] = str(convertido[nome])
+        for nome in listas:
+            if convertido.get(nome):
+                convertido[nome] = [str(v) for v in convertido[nome]]
+        return convertido
+
+    return converter
+
+
 class MongoModel(BaseModel):
     id: str
 
     @classmethod
-    def from_mongo(cls, doc: dict):  # Converte ObjectId de _id em str
-        doc = doc.copy()
-        doc["id"] = str(doc["_id"])
-        doc.pop("_id")
-
-        # Alguns modelos contém atributos que vem do formato ObjectId
-        # Então é preciso converte-los para str também
-        if "construcoes_ids" in doc:
-            doc["construcoes_ids"] = [str(c) for c in doc["construcoes_ids"]]
-
-        if "terrenos_ids" in doc:
-            doc["terrenos_ids"] = [str(t) for t in doc["terrenos_ids"]]
-
-        if "pessoas_ids" in doc:
-            doc["pessoas_ids"] = [str(p) for p in doc["pessoas_ids"]]
-
-        if "terreno_id" in doc:
-            doc["terreno_id"] = str(doc["terreno_id"])
-
-        if "contrucao_id" in doc:
-            doc["contrucao_id"] = str(doc["contrucao_id"])
+    def documento_resposta(cls, doc: dict) -> dict:
+        """Converte um documento do banco direto para o dicionário de resposta,
+        sem construir nem validar o modelo. Só deve ser usado com dados que
+        vieram do banco, que já foram validados na escrita."""
+        conversor = _CONVERSORES.get(cls)
+        if conversor is None:
+            conversor = _CONVERSORES[cls] = _gerar_conversor(cls)
+        return conversor(doc)
 
-        if "obras_ids" in doc:
-            doc["obras_ids"] = [str(o) for o in doc["obras_ids"]]
-
-        return cls(**doc)
+    @classmethod
+    def from_mongo(cls, doc: dict):  # Converte ObjectId de _id em str
+        return cls(**cls.documento_resposta(doc))
 
 
 class Endereco(BaseModel):
@@ -47,6 +75,26 @@ class Endereco(BaseModel):
     latitude: str
 
 
+class Localizacao(BaseModel):
+    type: str = "Point"
+    coordinates: List[float]  # [longitude, latitude]
+
+
+def ponto_geojson(endereco) -> Optional[dict]:
+    """Ponto GeoJSON do endereço, usado pelo índice 2dsphere. Retorna None
+    quando a longitude ou a latitude não são números válidos."""
+    if isinstance(endereco, BaseModel):
+        endereco = endereco.model_dump()
+    try:
+        longitude = float(str(endereco["longitude"]).replace(",", "."))
+        latitude = float(str(endereco["latitude"]).replace(",", "."))
+    except (KeyError, TypeError, ValueError):
+        return None
+    if not (-180 <= longitude <= 180 and -90 <= latitude <= 90):
+        return None
+    return {"type": "Point", "coordinates": [longitude, latitude]}
+
+
 class PessoaBase(BaseModel):
     nome: str
     email: EmailStr
@@ -65,6 +113,29 @@ class PessoaPatch(BaseModel):
 
 class Pessoa(PessoaBase, MongoModel):
     terrenos_ids: List[str] = []
+    custo_total_obras: float = 0.0
+    quantidade_obras: int = 0
+
+
+class VinculoPessoaTerreno(BaseModel):
+    pessoa_id: str
+    terreno_id: str
+
+
+# Aceita uma lista de pares e/ou uma pessoa com vários terrenos
+class VinculosPessoaTerreno(BaseModel):
+    pares: List[VinculoPessoaTerreno] = []
+    pessoa_id: Optional[str] = None
+    terrenos_ids: List[str] = []
+
+    def todos_os_pares(self) -> List[VinculoPessoaTerreno]:
+        pares = list(self.pares)
+        if self.pessoa_id is not None:
+            pares.extend(
+                VinculoPessoaTerreno(pessoa_id=self.pessoa_id, terreno_id=t)
+                for t in self.terrenos_ids
+            )
+        return pares
 
 
 class TerrenoBase(BaseModel):
@@ -88,6 +159,10 @@ class TerrenoPatch(BaseModel):
 class Terreno(TerrenoBase, MongoModel):
     pessoas_ids: List[str] = []
     construcoes_ids: List[str] = []
+    # Derivada de endereco na escrita
+    localizacao: Optional[Localizacao] = None
+    custo_total_obras: float = 0.0
+    quantidade_obras: int = 0
 
 
 class ConstrucaoBase(BaseModel):
@@ -109,6 +184,8 @@ class ConstrucaoPatch(BaseModel):
 
 class Construcao(ConstrucaoBase, MongoModel):
     obras_ids: Optional[List[str]] = []
+    custo_total_obras: float = 0.0
+    quantidade_obras: int = 0
 
 
 class ObraBase(BaseModel):
@@ -131,3 +208,146 @@ class ObraPatch(BaseModel):
 
 class Obra(ObraBase, MongoModel):
     pass
+
+
+# Condição de uma consulta estruturada sobre um campo do modelo, que pode ser
+# aninhado (ex. endereco.cidade); in/nin recebem uma lista e exists um bool
+class Predicado(BaseModel):
+    campo: str
+    op: Literal["eq", "ne", "in", "nin", "gt", "gte", "lt", "lte", "exists"] = "eq"
+    valor: Any = None
+
+
+class Consulta(BaseModel):
+    filtros: List[Predicado] = []
+    # Campos de ordenação; "-" na frente ordena de forma decrescente
+    ordenacao: List[str] = []
+    pagina: int = 1
+    limite: int = 50
+
+
+class Filho(NamedTuple):
+    tipo: str
+    campo_ids: str  # campo do pai com a lista de ids dos filhos
+    campo_pai: str  # campo do filho com o id do pai
+
+
+class Referencia(NamedTuple):
+    tipo: str
+    campo_ids: str  # campo do outro tipo com a lista de ids deste
+
+
+# Relacionamentos entre os tipos. Ao excluir um documento, seus filhos são
+# excluídos junto e o id dele é retirado das listas das referências.
+RELACOES: Dict[str, Dict[str, list]] = {
+    "pessoa": {
+        "filhos": [],
+        "referencias": [Referencia("terreno", "pessoas_ids")],
+    },
+    "terreno": {
+        "filhos": [Filho("construcao", "construcoes_ids", "terreno_id")],
+        "referencias": [Referencia("pessoa", "terrenos_ids")],
+    },
+    "construcao": {
+        "filhos": [Filho("obra", "obras_ids", "contrucao_id")],
+        "referencias": [Referencia("terreno", "construcoes_ids")],
+    },
+    "obra": {
+        "filhos": [],
+        "referencias": [Referencia("construcao", "obras_ids")],
+    },
+}
+
+
+def _indice(*campos: str, **opcoes) -> IndexModel:
+    """Índice ascendente nomeado pelos campos, construído em segundo plano."""
+    return IndexModel(
+        [(campo, ASCENDING) for campo in campos],
+        name="_".join(campos),
+        background=True,
+        **opcoes,
+    )
+
+
+# Campos de texto de cada tipo cobertos pelo índice de busca textual
+CAMPOS_TEXTO: Dict[str, List[str]] = {
+    "pessoa": ["nome", "profissao"],
+    "terreno": ["descricao", "endereco.cidade"],
+    "construcao": ["nome", "descricao", "tipo"],
+    "obra": ["nome", "descricao"],
+}
+
+
+# Campos de texto de cada tipo aceitos na busca por prefixo
+CAMPOS_PREFIXO: Dict[str, List[str]] = {
+    "pessoa": ["nome", "email", "profissao"],
+    "terreno": ["descricao", "endereco.cidade"],
+    "construcao": ["nome", "descricao", "tipo"],
+    "obra": ["nome", "descricao"],
+}
+
+
+def campo_normalizado(campo: str) -> str:
+    """Cópia do campo em minúsculas e sem acentos, usada na busca por prefixo."""
+    return "prefixo_" + campo.replace(".", "_")
+
+
+def campo_chaves(campo: str) -> str:
+    """Chaves das palavras do campo (texto.chaves_campo), usadas para
+    restringir a busca textual a ele."""
+    return "chaves_" + campo.replace(".", "_")
+
+
+def _indice_texto(tipo: str) -> IndexModel:
+    return IndexModel(
+        [(campo, TEXT) for campo in CAMPOS_TEXTO[tipo]],
+        name="busca_texto",
+        default_language="portuguese",
+        background=True,
+    )
+
+
+def _indices_prefixo(tipo: str) -> List[IndexModel]:
+    return [_indice(campo_normalizado(campo)) for campo in CAMPOS_PREFIXO[tipo]]
+
+
+# Índices de cada tipo, criados na inicialização da aplicação e conferidos
+# por `python admin.py indices`. Os campos de relacionamento são usados nos
+# $pull das exclusões em cascata; atualizado_em, na atualização incremental
+# das análises; as cópias normalizadas dos campos de CAMPOS_PREFIXO, na busca
+# por prefixo; os demais, nos filtros e ordenações.
+INDICES: Dict[str, List[IndexModel]] = {
+    "pessoa": [
+        _indice("terrenos_ids"),
+        _indice("nome"),
+        _indice("email"),
+        _indice("profissao"),
+        *_indices_prefixo("pessoa"),
+        _indice_texto("pessoa"),
+    ],
+    "terreno": [
+        _indice("pessoas_ids"),
+        _indice("construcoes_ids"),
+        _indice("disponivel", "preco"),
+        _indice("endereco.cidade"),
+        _indice("atualizado_em"),
+        *_indices_prefixo("terreno"),
+        _indice_texto("terreno"),
+        IndexModel([("localizacao", GEOSPHERE)], name="localizacao_2dsphere"),
+    ],
+    "construcao": [
+        _indice("terreno_id"),
+        _indice("obras_ids"),
+        _indice("tipo"),
+        _indice("atualizado_em"),
+        *_indices_prefixo("construcao"),
+        _indice_texto("construcao"),
+    ],
+    "obra": [
+        _indice("contrucao_id"),
+        _indice("inicio"),
+        _indice("atualizado_em"),
+        *_indices_prefixo("obra"),
+        _indice_texto("obra"),
+    ],
+}
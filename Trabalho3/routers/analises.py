@@ -0,0 +1,150 @@
+from datetime import datetime
+from typing import Literal, Optional
+
+from fastapi import APIRouter, HTTPException
+
+from analises import ANALISES, atualizar_analises, situacao_analises
+from db import ColecaoPreguicosa
+from logs import logging
+from routers.utils import RespostaOrjson, coalescer
+
+router = APIRouter(prefix="/analises", tags=["Análises"])
+logger = logging.getLogger(__name__)
+
+
+def _resumo(nome: str) -> ColecaoPreguicosa:
+    return ColecaoPreguicosa(ANALISES[nome].colecao)
+
+
+def _sem_controle(doc: dict) -> dict:
+    doc.pop("_id", None)
+    doc.pop("atualizado_em", None)
+    return doc
+
+
+def _mes(valor: str, campo: str) -> datetime:
+    try:
+        return datetime.strptime(valor, "%Y-%m")
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"{campo} deve estar no formato AAAA-MM.")
+
+
+# Situação de cada análise: grupos no resumo e última atualização
+@router.get("/")
+async def listar_analises():
+    logger.info("ENDPOINT situação das análises chamado")
+    try:
+        return RespostaOrjson(await situacao_analises())
+    except Exception as e:
+        logger.error("Erro ao consultar as análises: %s", e)
+        raise HTTPException(status_code=500, detail="Erro ao consultar as análises.")
+
+
+# Atualiza as análises sob demanda; sem `completo`, só os grupos alterados
+@router.post("/atualizar")
+@coalescer("/analises/atualizar")
+async def atualizar(nome: Optional[str] = None, completo: bool = False):
+    logger.info("ENDPOINT atualizar análises chamado - análise: %s, completo: %s", nome, completo)
+    if nome is not None and nome not in ANALISES:
+        raise HTTPException(status_code=404, detail=f"Análise {nome} não existe.")
+    try:
+        return await atualizar_analises(completo, [nome] if nome else None)
+    except Exception as e:
+        logger.error("Erro ao atualizar as análises: %s", e)
+        raise HTTPException(status_code=500, detail="Erro ao atualizar as análises.")
+
+
+# Terrenos, área, preço por m² e gasto com obras por cidade ou por estado
+@router.get("/locais")
+async def analise_locais(
+    estado: Optional[str] = None,
+    agrupar: Literal["cidade", "estado"] = "cidade",
+    ordenar: Literal["custo_obras", "valor_terrenos", "preco_m2", "terrenos"] = "custo_obras",
+):
+    """Os resumos refletem a última atualização das análises; com o
+    agendador ligado (ANALISES_INTERVALO, padrão 300 s), atrasam no máximo um
+    intervalo."""
+    logger.info("ENDPOINT análise por local chamado - estado: %s, agrupar: %s", estado, agrupar)
+    filtro = {} if estado is None else {"estado": estado}
+    try:
+        if agrupar == "cidade":
+            cursor = _resumo("locais").find(filtro)
+        else:
+            # O resumo é por cidade; somar as cidades de cada estado é barato
+            cursor = _resumo("locais").aggregate(
+                [
+                    {"$match": filtro},
+                    {
+                        "$group": {
+                            "_id": "$estado",
+                            **{
+                                campo: {"$sum": f"${campo}"}
+                                for campo in (
+                                    "terrenos",
+                                    "disponiveis",
+                                    "area_total",
+                                    "valor_terrenos",
+                                    "custo_obras",
+                                    "quantidade_obras",
+                                )
+                            },
+                        }
+                    },
+                    {
+                        "$set": {
+                            "estado": "$_id",
+                            "preco_m2": {
+                                "$cond": [
+                                    {"$gt": ["$area_total", 0]},
+                                    {"$divide": ["$valor_terrenos", "$area_total"]},
+                                    None,
+                                ]
+                            },
+                        }
+                    },
+                ]
+            )
+        docs = [_sem_controle(d) async for d in cursor]
+        docs.sort(key=lambda d: d.get(ordenar) or 0, reverse=True)
+        return RespostaOrjson(docs)
+    except Exception as e:
+        logger.error("Erro na análise por local: %s", e)
+        raise HTTPException(status_code=500, detail="Erro na análise por local.")
+
+
+# Gasto das obras por mês (AAAA-MM), com o custo dividido entre os meses da obra
+@router.get("/obras-por-mes")
+async def analise_obras_por_mes(de: Optional[str] = None, ate: Optional[str] = None):
+    """Resumo da última atualização das análises, como em /analises/locais."""
+    logger.info("ENDPOINT análise de obras por mês chamado - de: %s, até: %s", de, ate)
+    intervalo = {}
+    if de is not None:
+        intervalo["$gte"] = _mes(de, "de")
+    if ate is not None:
+        intervalo["$lte"] = _mes(ate, "ate")
+    try:
+        cursor = _resumo("obras_por_mes").find({"mes": intervalo} if intervalo else {})
+        docs = []
+        async for doc in cursor.sort("mes", 1):
+            doc = _sem_controle(doc)
+            doc["mes"] = doc["mes"].strftime("%Y-%m")
+            docs.append(doc)
+        return RespostaOrjson(docs)
+    except Exception as e:
+        logger.error("Erro na análise de obras por mês: %s", e)
+        raise HTTPException(status_code=500, detail="Erro na análise de obras por mês.")
+
+
+# Quantidade, custo total e custo médio das construções por tipo
+@router.get("/construcoes-por-tipo")
+async def analise_construcoes_por_tipo():
+    """Resumo da última atualização das análises, como em /analises/locais."""
+    logger.info("ENDPOINT análise de construções por tipo chamado")
+    try:
+        cursor = _resumo("construcoes_por_tipo").find().sort("custo_total", -1)
+        return RespostaOrjson([_sem_controle(d) async for d in cursor])
+    except Exception as e:
+        logger.error("Erro na análise de construções por tipo: %s", e)
+        raise HTTPException(
+            status_code=500, detail="Erro na análise de construções por tipo."
+        )
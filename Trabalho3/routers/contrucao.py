@@ -1,44 +1,87 @@
 from fastapi import APIRouter, HTTPException
-from models import Construcao, ConstrucaoBase, ConstrucaoPatch
-from typing import List
-from db import construcao_collection, terrenos_collection
+from models import Construcao, ConstrucaoBase, ConstrucaoPatch, Consulta
+from typing import Any, Dict, List, Optional, Literal
+from db import terrenos_collection
 from bson import ObjectId
+from pymongo import ReturnDocument, UpdateOne
+from collections import defaultdict
 from routers.utils import (
+    consulta_estruturada,
+    coalescer,
     listar,
     criar,
-    atualizar,
-    deletar,
+    atualizar_documento,
+    existe,
     patch,
     validar_id,
     quantidade_total_ocorrencias,
     paginacao,
     busca_parcial,
+    validar_lote,
+    buscar_por_ids,
+    inserir_em_lote,
+    resultado_lote,
+    cache,
+    TAMANHO_LOTE_INSERCAO,
+    tipo_do_campo,
+    resposta_stream,
+    propagar_gastos_terrenos,
 )
+from cascata import excluir_em_cascata
+from exportacao import LINHAS_POR_GRUPO, resposta_exportacao
 from logs import logging
 
 router = APIRouter(prefix="/contrucoes", tags=["Construções"])
+logger = logging.getLogger(__name__)
+
+
+async def mover_de_terreno(anterior: dict, terreno_atual: ObjectId):
+    """Move a construção e os gastos das obras dela para outro terreno, se o
+    terreno_id mudou."""
+    if anterior.get("terreno_id") is None:
+        return
+    terreno_anterior = ObjectId(anterior["terreno_id"])
+    if terreno_anterior == terreno_atual:
+        return
+    custo = anterior.get("custo_total_obras", 0)
+    quantidade = anterior.get("quantidade_obras", 0)
+    await propagar_gastos_terrenos(
+        {terreno_anterior: (-custo, -quantidade), terreno_atual: (custo, quantidade)}
+    )
+    await terrenos_collection.update_one(
+        {"_id": terreno_anterior},
+        {"$pull": {"construcoes_ids": {"$in": [anterior["_id"], str(anterior["_id"])]}}},
+    )
+    await terrenos_collection.update_one(
+        {"_id": terreno_atual}, {"$addToSet": {"construcoes_ids": anterior["_id"]}}
+    )
+    await cache.invalidar("terreno", terreno_anterior, terreno_atual)
 
 
 # Listar todas as construções
 @router.get("/", response_model=List[Construcao])
-async def listar_contrucoes():
-    logging.info("ENDPOINT listar construções chamado")
+async def listar_contrucoes(formato: Optional[Literal["ndjson", "json"]] = None):
+    logger.info("ENDPOINT listar construções chamado")
+    if formato is not None:
+        # Transmite direto do cursor, sem montar a lista inteira em memória
+        return resposta_stream("construcao", formato)
     try:
         return await listar("construcao")
     except Exception as e:
-        logging.error(f"Erro ao listar construções: {e}")
+        logger.error("Erro ao listar construções: %s", e)
         raise HTTPException(status_code=500, detail="Erro ao listar construções.")
 
 
 # Quantidade total de construções
 @router.get("/quantidade_construcoes")
+@coalescer("/contrucoes/quantidade_construcoes")
 async def quantidade_total_de_construcoes():
-    logging.info("ENDPOINT listar quantidade de construções chamado")
+    logger.info("ENDPOINT listar quantidade de construções chamado")
     try:
         total = await quantidade_total_ocorrencias("construcao")
         return {"quantidade": total}
     except Exception as e:
-        logging.error(f"Erro ao acessar o total de construções: {e}")
+        logger.error("Erro ao acessar o total de construções: %s", e)
         raise HTTPException(
             status_code=500, detail="Erro ao acessar o total de construções."
         )
@@ -46,58 +89,167 @@ async def quantidade_total_de_construcoes():
 
 # Paginação
 @router.get("/paginacao")
-async def paginacao_construcao(pagina: int = 1, limite: int = 10):
-    logging.info(f"ENDPOINT de paginação chamado - pagina: {pagina}, limite: {limite}")
+async def paginacao_construcao(
+    pagina: int = 1,
+    limite: int = 10,
+    after: Optional[str] = None,
+    contar: Optional[bool] = None,
+):
+    logger.info("ENDPOINT de paginação chamado - pagina: %s, limite: %s", pagina, limite)
     try:
-        return await paginacao("construcao", pagina, limite)
+        return await paginacao("construcao", pagina, limite, after, contar)
+    except HTTPException:
+        raise
     except Exception as e:
-        logging.error(f"Erro na paginação de construções: {e}")
+        logger.error("Erro na paginação de construções: %s", e)
         raise HTTPException(status_code=500, detail="Erro na paginação de construções.")
 
 
 # Filtro por atributo específico
 @router.get("/filter/")
-async def filtro(atributo: str, busca: str):
-    logging.info(f"ENDPOINT de filtro chamado para atributo {atributo} e busca {busca}")
-    if atributo not in Construcao.model_fields:
-        logging.warning(f"Atributo de filtro inválido: {atributo}")
+async def filtro(
+    atributo: str,
+    busca: str,
+    modo: Literal["regex", "texto", "prefixo"] = "regex",
+    pagina: int = 1,
+    limite: Optional[int] = None,
+):
+    logger.info("ENDPOINT de filtro chamado para atributo %s e busca %s", atributo, busca)
+    if tipo_do_campo(Construcao, atributo) is None:
+        logger.warning("Atributo de filtro inválido: %s", atributo)
         raise HTTPException(status_code=400, detail="Atributo de filtro inválido.")
     try:
-        return await busca_parcial("construcao", atributo, busca)
+        return await busca_parcial("construcao", atributo, busca, modo, pagina, limite)
+    except HTTPException:
+        raise
     except Exception as e:
-        logging.error(f"Erro ao filtrar construções: {e}")
+        logger.error("Erro ao filtrar construções: %s", e)
         raise HTTPException(status_code=500, detail="Erro ao filtrar construções.")
 
 
+# Consulta com vários filtros tipados, ordenação e projeção (?fields=a,b);
+# com explain=true devolve o plano escolhido no lugar dos documentos
+@router.post("/consulta")
+async def consulta_construcoes(
+    consulta: Consulta, fields: Optional[str] = None, explain: bool = False
+):
+    logger.info("ENDPOINT consulta estruturada de construções chamado")
+    try:
+        return await consulta_estruturada("construcao", consulta, fields, explain)
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error("Erro na consulta de construções: %s", e)
+        raise HTTPException(status_code=500, detail="Erro na consulta de construções.")
+
+
+# Exporta os documentos em NDJSON, CSV ou Parquet direto do cursor, com os
+# mesmos filtros de /consulta (ordenação e paginação são ignoradas)
+@router.post("/exportar")
+async def exportar_construcoes(
+    consulta: Optional[Consulta] = None,
+    formato: Literal["ndjson", "csv", "parquet"] = "ndjson",
+    fields: Optional[str] = None,
+    gzip: bool = False,
+    linhas_por_grupo: int = LINHAS_POR_GRUPO,
+):
+    logger.info("ENDPOINT exportar construções chamado - formato: %s", formato)
+    try:
+        return resposta_exportacao("construcao", formato, consulta, fields, gzip, linhas_por_grupo)
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error("Erro ao exportar construções: %s", e)
+        raise HTTPException(status_code=500, detail="Erro ao exportar construções.")
+
+
 @router.post("/")
 async def criar_construcao(construcao: ConstrucaoBase):
-    logging.info(f"ENDPOINT criar construção chamado {construcao}")
+    logger.info("ENDPOINT criar construção chamado %s", construcao)
     validar_id(construcao.terreno_id)
     try:
-        id = ObjectId(await criar("construcao", construcao))
-        await construcao_collection.update_one(
-            {"_id": id}, {"$set": {"terreno_id": ObjectId(construcao.terreno_id)}}
+        id = ObjectId(
+            await criar("construcao", construcao, terreno_id=ObjectId(construcao.terreno_id))
         )
         await terrenos_collection.update_one(
             {"_id": ObjectId(construcao.terreno_id)},
             {"$addToSet": {"construcoes_ids": id}},
         )
+        await cache.invalidar("terreno", construcao.terreno_id)
         return str(id)
     except Exception as e:
-        logging.error(f"Erro ao criar construção: {e}")
+        logger.error("Erro ao criar construção: %s", e)
         raise HTTPException(status_code=500, detail="Erro ao criar construção.")
 
 
+# Cria várias construções e atualiza a lista de construções de cada
+# terreno com um único bulk_write agrupado por terreno
+@router.post("/bulk")
+async def criar_construcoes_em_lote(
+    construcoes: List[Dict[str, Any]], tamanho_lote: int = TAMANHO_LOTE_INSERCAO
+):
+    logger.info("ENDPOINT criar construções em lote chamado com %s itens", len(construcoes))
+    try:
+        validos, erros = validar_lote(ConstrucaoBase, construcoes)
+        terrenos = await buscar_por_ids(
+            "terreno", {c.terreno_id for c in validos.values()}, {"_id": 1}
+        )
+        documentos = {}
+        for indice, construcao in validos.items():
+            if not ObjectId.is_valid(construcao.terreno_id) or (
+                ObjectId(construcao.terreno_id) not in terrenos
+            ):
+                erros[indice] = f"Terreno {construcao.terreno_id} não encontrado"
+                continue
+            documento = construcao.model_dump()
+            documento["terreno_id"] = ObjectId(construcao.terreno_id)
+            documentos[indice] = documento
+
+        ids, erros_insercao = await inserir_em_lote("construcao", documentos, tamanho_lote)
+
+        por_terreno = defaultdict(list)
+        for indice, id in ids.items():
+            por_terreno[documentos[indice]["terreno_id"]].append(id)
+        if por_terreno:
+            await terrenos_collection.bulk_write(
+                [
+                    UpdateOne({"_id": t}, {"$addToSet": {"construcoes_ids": {"$each": c}}})
+                    for t, c in por_terreno.items()
+                ],
+                ordered=False,
+            )
+            await cache.invalidar("terreno", *por_terreno)
+        return resultado_lote(len(construcoes), ids, {**erros, **erros_insercao})
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error("Erro ao criar construções em lote: %s", e)
+        raise HTTPException(status_code=500, detail="Erro ao criar construções em lote.")
+
+
 @router.put("/{construcao_id}")
 async def atualizar_construcao(construcao_id: str, construcao: ConstrucaoBase):
-    logging.info(
-        f"ENDPOINT atualizar construção chamado com o id {construcao_id} e corpo {construcao}"
+    logger.info(
+        "ENDPOINT atualizar construção chamado com o id %s e corpo %s", construcao_id, construcao
     )
+    validar_id(construcao.terreno_id)
     try:
-        resultado = await atualizar("construcao", construcao_id, construcao)
+        if not await existe("terreno", construcao.terreno_id):
+            logger.info("Terreno de id %s não encontrado", construcao.terreno_id)
+            raise HTTPException(status_code=404, detail="Terreno não encontrado")
+        campos = {**construcao.model_dump(), "terreno_id": ObjectId(construcao.terreno_id)}
+        # Lê o documento anterior na mesma ida ao banco que grava o novo, para
+        # mover os gastos se o terreno mudou
+        anterior = await atualizar_documento(
+            "construcao", construcao_id, campos, ReturnDocument.BEFORE
+        )
+        await mover_de_terreno(anterior, campos["terreno_id"])
+        resultado = Construcao.from_mongo({**anterior, **campos})
         return {"message": "Construção atualizada com sucesso.", "data": resultado}
+    except HTTPException:
+        raise
     except Exception as e:
-        logging.error(f"Erro ao atualizar construção: {e}")
+        logger.error("Erro ao atualizar construção: %s", e)
         raise HTTPException(status_code=500, detail="Erro ao atualizar construção.")
 
 
@@ -106,24 +258,24 @@ async def modificar_construcao(construcao_id: str, construcao: ConstrucaoPatch):
     try:
         resultado = await patch("construcao", construcao_id, construcao)
         return {"message": "Construção modificada com sucesso.", "data": resultado}
+    except HTTPException:
+        raise
     except Exception as e:
-        logging.error(f"Erro ao modificar construção: {e}")
+        logger.error("Erro ao modificar construção: %s", e)
         raise HTTPException(status_code=500, detail="Erro ao modificar construção.")
 
 
 @router.delete("/{construcao_id}")
 async def deletar_construcao(construcao_id: str):
-    logging.info(
-        f"ENDPOINT de deletar construção chamado para construção de id {construcao_id}"
+    logger.info(
+        "ENDPOINT de deletar construção chamado para construção de id %s", construcao_id
     )
+    validar_id(construcao_id)
     try:
-        await deletar("construcao", construcao_id)  # Deleta a construção
-        # Retira da lista de construções do seu respectivo terreno
-        await terrenos_collection.update_one(
-            {"construcoes_ids": ObjectId(construcao_id)},
-            {"$pull": {"construcoes_ids": ObjectId(construcao_id)}},
-        )
-        return {"msg": f"Construção {construcao_id} deletada"}
+        excluidos = await excluir_em_cascata("construcao", construcao_id)
+        return {"msg": f"Construção {construcao_id} deletada", "excluidos": excluidos}
+    except HTTPException:
+        raise
     except Exception as e:
-        logging.error(f"Erro ao deletar construção: {e}")
+        logger.error("Erro ao deletar construção: %s", e)
         raise HTTPException(status_code=500, detail="Erro ao deletar construção.")
@@ -0,0 +1,44 @@
+from typing import Literal, Optional
+
+from fastapi import APIRouter, HTTPException, Request
+
+from importacao import (
+    CONCORRENCIA_IMPORTACAO,
+    EM_ANDAMENTO,
+    TAMANHO_LOTE_IMPORTACAO,
+    Importacao,
+)
+from logs import logging
+from routers.utils import RespostaOrjson
+
+router = APIRouter(prefix="/importar", tags=["Importação"])
+logger = logging.getLogger(__name__)
+
+
+# Importa um arquivo NDJSON ou CSV enviado no corpo, lido em fluxo e gravado
+# em lotes; devolve o resumo com os erros de cada linha
+@router.post("/")
+async def importar(
+    request: Request,
+    formato: Literal["ndjson", "csv"] = "ndjson",
+    entidade: Optional[Literal["pessoa", "terreno", "construcao", "obra"]] = None,
+    gzip: bool = False,
+    tamanho_lote: int = TAMANHO_LOTE_IMPORTACAO,
+    concorrencia: int = CONCORRENCIA_IMPORTACAO,
+):
+    logger.info("ENDPOINT importar chamado - formato: %s, entidade: %s", formato, entidade)
+    try:
+        importacao = Importacao(formato, entidade, tamanho_lote, concorrencia)
+        return RespostaOrjson(await importacao.executar(request.stream(), gzip))
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error("Erro ao importar: %s", e)
+        raise HTTPException(status_code=500, detail="Erro ao importar.")
+
+
+# Progresso das importações em andamento neste processo
+@router.get("/")
+async def importacoes_em_andamento():
+    logger.info("ENDPOINT importações em andamento chamado")
+    return RespostaOrjson([i.situacao() for i in EM_ANDAMENTO.values()])
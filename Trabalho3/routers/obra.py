@@ -1,127 +1,283 @@
 from fastapi import APIRouter, HTTPException
-from models import Obra, ObraBase, ObraPatch
-from typing import List, Dict, Type, TypedDict
-from db import terrenos_collection, pessoas_collection, construcao_collection
+from models import Obra, ObraBase, ObraPatch, Consulta
+from typing import Any, List, Dict, Optional, Literal
+from db import construcao_collection
 from bson import ObjectId
-from motor.motor_asyncio import AsyncIOMotorCollection
+from pymongo import ReturnDocument, UpdateOne
+from collections import defaultdict
 
 from routers.utils import (
+    consulta_estruturada,
+    coalescer,
     listar,
     criar,
-    atualizar,
-    deletar,
-    patch,
     validar_id,
     quantidade_total_ocorrencias,
     paginacao,
     busca_parcial,
+    validar_lote,
+    buscar_por_ids,
+    inserir_em_lote,
+    resultado_lote,
+    existe,
+    cache,
+    atualizar_documento,
+    TAMANHO_LOTE_INSERCAO,
+    tipo_do_campo,
+    resposta_stream,
+    propagar_gastos,
 )
+from cascata import excluir_em_cascata
+from exportacao import LINHAS_POR_GRUPO, resposta_exportacao
 from logs import logging
 
 router = APIRouter(prefix="/obras", tags=["Obras"])
+logger = logging.getLogger(__name__)
+
+
+async def ajustar_gastos(anterior: dict, atual: Obra):
+    """Atualiza os contadores de gasto depois que uma obra foi alterada,
+    movendo-a de construção se o contrucao_id mudou."""
+    construcao_anterior = ObjectId(anterior["contrucao_id"])
+    construcao_atual = ObjectId(atual.contrucao_id)
+    deltas = defaultdict(lambda: (0, 0))
+    deltas[construcao_anterior] = (-anterior["custo"], -1)
+    custo, quantidade = deltas[construcao_atual]
+    deltas[construcao_atual] = (custo + atual.custo, quantidade + 1)
+    await propagar_gastos(deltas)
+    if construcao_anterior != construcao_atual:
+        await construcao_collection.update_one(
+            {"_id": construcao_anterior}, {"$pull": {"obras_ids": ObjectId(atual.id)}}
+        )
+        await construcao_collection.update_one(
+            {"_id": construcao_atual}, {"$addToSet": {"obras_ids": ObjectId(atual.id)}}
+        )
+        await cache.invalidar("construcao", construcao_anterior, construcao_atual)
+
+
+async def validar_construcao(contrucao_id: Optional[str]):
+    """Confere se a construção informada para a obra existe."""
+    if contrucao_id is None:
+        return
+    validar_id(contrucao_id)
+    if not await existe("construcao", contrucao_id):
+        logger.info("Construção de id %s não encontrada", contrucao_id)
+        raise HTTPException(detail="Construção não existe", status_code=404)
 
 
 # Listar todas as obras
 @router.get("/", response_model=List[Obra])
-async def listar_obras():
-    logging.info("ENDPOINT listar obras chamado")
+async def listar_obras(formato: Optional[Literal["ndjson", "json"]] = None):
+    logger.info("ENDPOINT listar obras chamado")
+    if formato is not None:
+        # Transmite direto do cursor, sem montar a lista inteira em memória
+        return resposta_stream("obra", formato)
     try:
         return await listar("obra")
     except Exception as e:
-        logging.error(f"Erro ao listar obras: {e}")
+        logger.error("Erro ao listar obras: %s", e)
         raise HTTPException(status_code=500, detail="Erro ao listar obras.")
 
 
 # Quantidade total de obras
 @router.get("/quantidade_obras")
+@coalescer("/obras/quantidade_obras")
 async def quantidade_total_de_obras():
-    logging.info("ENDPOINT listar quantidade de obras chamado")
+    logger.info("ENDPOINT listar quantidade de obras chamado")
     try:
         total = await quantidade_total_ocorrencias("obra")
         return {"quantidade": total}
     except Exception as e:
-        logging.error(f"Erro ao acessar o total de obras: {e}")
+        logger.error("Erro ao acessar o total de obras: %s", e)
         raise HTTPException(status_code=500, detail="Erro ao acessar o total de obras.")
 
 
 # Paginação
 @router.get("/paginacao")
-async def paginacao_obra(pagina: int = 1, limite: int = 10):
-    logging.info(f"ENDPOINT de paginação chamado - pagina: {pagina}, limite: {limite}")
+async def paginacao_obra(
+    pagina: int = 1,
+    limite: int = 10,
+    after: Optional[str] = None,
+    contar: Optional[bool] = None,
+):
+    logger.info("ENDPOINT de paginação chamado - pagina: %s, limite: %s", pagina, limite)
     try:
-        return await paginacao("obra", pagina, limite)
+        return await paginacao("obra", pagina, limite, after, contar)
+    except HTTPException:
+        raise
     except Exception as e:
-        logging.error(f"Erro na paginação de obras: {e}")
+        logger.error("Erro na paginação de obras: %s", e)
         raise HTTPException(status_code=500, detail="Erro na paginação de obras.")
 
 
 # Filtro por atributo específico
 @router.get("/filter/")
-async def filtro(atributo: str, busca: str):
-    logging.info(f"ENDPOINT de filtro chamado para atributo {atributo} e busca {busca}")
-    if atributo not in Obra.model_fields:
-        logging.warning(f"Atributo de filtro inválido: {atributo}")
+async def filtro(
+    atributo: str,
+    busca: str,
+    modo: Literal["regex", "texto", "prefixo"] = "regex",
+    pagina: int = 1,
+    limite: Optional[int] = None,
+):
+    logger.info("ENDPOINT de filtro chamado para atributo %s e busca %s", atributo, busca)
+    if tipo_do_campo(Obra, atributo) is None:
+        logger.warning("Atributo de filtro inválido: %s", atributo)
         raise HTTPException(status_code=400, detail="Atributo de filtro inválido.")
     try:
-        return await busca_parcial("obra", atributo, busca)
+        return await busca_parcial("obra", atributo, busca, modo, pagina, limite)
+    except HTTPException:
+        raise
     except Exception as e:
-        logging.error(f"Erro ao filtrar obras: {e}")
+        logger.error("Erro ao filtrar obras: %s", e)
         raise HTTPException(status_code=500, detail="Erro ao filtrar obras.")
 
 
+# Consulta com vários filtros tipados, ordenação e projeção (?fields=a,b);
+# com explain=true devolve o plano escolhido no lugar dos documentos
+@router.post("/consulta")
+async def consulta_obras(
+    consulta: Consulta, fields: Optional[str] = None, explain: bool = False
+):
+    logger.info("ENDPOINT consulta estruturada de obras chamado")
+    try:
+        return await consulta_estruturada("obra", consulta, fields, explain)
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error("Erro na consulta de obras: %s", e)
+        raise HTTPException(status_code=500, detail="Erro na consulta de obras.")
+
+
+# Exporta os documentos em NDJSON, CSV ou Parquet direto do cursor, com os
+# mesmos filtros de /consulta (ordenação e paginação são ignoradas)
+@router.post("/exportar")
+async def exportar_obras(
+    consulta: Optional[Consulta] = None,
+    formato: Literal["ndjson", "csv", "parquet"] = "ndjson",
+    fields: Optional[str] = None,
+    gzip: bool = False,
+    linhas_por_grupo: int = LINHAS_POR_GRUPO,
+):
+    logger.info("ENDPOINT exportar obras chamado - formato: %s", formato)
+    try:
+        return resposta_exportacao("obra", formato, consulta, fields, gzip, linhas_por_grupo)
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error("Erro ao exportar obras: %s", e)
+        raise HTTPException(status_code=500, detail="Erro ao exportar obras.")
+
+
 @router.post("/")
 async def criar_obra(obra: ObraBase):
-    logging.info(f"ENDPOINT criar obra chamado {obra}")
+    logger.info("ENDPOINT criar obra chamado %s", obra)
     try:
-        validar_id(obra.contrucao_id)
-        construcao = await construcao_collection.find_one(
-            {"_id": ObjectId(obra.contrucao_id)}
-        )
-        if not construcao:
-            logging.info(f"Construção de id {obra.contrucao_id} não encontrada")
-            raise HTTPException(detail="Construção não existe", status_code=404)
+        await validar_construcao(obra.contrucao_id)
         id = await criar("obra", obra)
         await construcao_collection.update_one(
             {"_id": ObjectId(obra.contrucao_id)},
             {"$addToSet": {"obras_ids": ObjectId(id)}},
         )
+        await propagar_gastos({ObjectId(obra.contrucao_id): (obra.custo, 1)})
         return {"msg": "Done"}
+    except HTTPException:
+        raise
     except Exception as e:
-        logging.error(f"Erro ao criar obra: {e}")
+        logger.error("Erro ao criar obra: %s", e)
         raise HTTPException(status_code=500, detail="Erro ao criar obra.")
 
 
+# Cria várias obras, atualiza a lista de obras de cada construção com um
+# único bulk_write agrupado por construção e propaga os gastos em lote
+@router.post("/bulk")
+async def criar_obras_em_lote(
+    obras: List[Dict[str, Any]], tamanho_lote: int = TAMANHO_LOTE_INSERCAO
+):
+    logger.info("ENDPOINT criar obras em lote chamado com %s itens", len(obras))
+    try:
+        validos, erros = validar_lote(ObraBase, obras)
+        construcoes = await buscar_por_ids(
+            "construcao", {o.contrucao_id for o in validos.values()}, {"_id": 1}
+        )
+        documentos = {}
+        for indice, obra in validos.items():
+            if not ObjectId.is_valid(obra.contrucao_id) or (
+                ObjectId(obra.contrucao_id) not in construcoes
+            ):
+                erros[indice] = f"Construção {obra.contrucao_id} não encontrada"
+                continue
+            documentos[indice] = obra.model_dump()
+
+        ids, erros_insercao = await inserir_em_lote("obra", documentos, tamanho_lote)
+
+        por_construcao = defaultdict(list)
+        deltas = defaultdict(lambda: (0, 0))
+        for indice, id in ids.items():
+            construcao_id = ObjectId(documentos[indice]["contrucao_id"])
+            por_construcao[construcao_id].append(id)
+            custo, quantidade = deltas[construcao_id]
+            deltas[construcao_id] = (custo + documentos[indice]["custo"], quantidade + 1)
+        if por_construcao:
+            await construcao_collection.bulk_write(
+                [
+                    UpdateOne({"_id": c}, {"$addToSet": {"obras_ids": {"$each": o}}})
+                    for c, o in por_construcao.items()
+                ],
+                ordered=False,
+            )
+        await propagar_gastos(deltas)
+        return resultado_lote(len(obras), ids, {**erros, **erros_insercao})
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error("Erro ao criar obras em lote: %s", e)
+        raise HTTPException(status_code=500, detail="Erro ao criar obras em lote.")
+
+
 @router.put("/")
 async def atualizar_obra(obra_id: str, obra: ObraBase):
-    logging.info(f"ENDPOINT atualizar obra chamado com o id {obra_id} e corpo {obra}")
+    logger.info("ENDPOINT atualizar obra chamado com o id %s e corpo %s", obra_id, obra)
     try:
-        resultado = await atualizar("obra", obra_id, obra)
+        await validar_construcao(obra.contrucao_id)
+        campos = obra.model_dump()
+        # Lê o documento anterior na mesma ida ao banco que grava o novo,
+        # para calcular a diferença de custo
+        anterior = await atualizar_documento("obra", obra_id, campos, ReturnDocument.BEFORE)
+        resultado = Obra.from_mongo({**anterior, **campos})
+        await ajustar_gastos(anterior, resultado)
         return {"message": "Obra atualizada com sucesso.", "data": resultado}
+    except HTTPException:
+        raise
     except Exception as e:
-        logging.error(f"Erro ao atualizar obra: {e}")
+        logger.error("Erro ao atualizar obra: %s", e)
         raise HTTPException(status_code=500, detail="Erro ao atualizar obra.")
 
 
 @router.patch("/")
 async def modificar_obra(obra_id: str, obra: ObraPatch):
     try:
-        resultado = await patch("obra", obra_id, obra)
+        await validar_construcao(obra.contrucao_id)
+        campos = obra.model_dump(exclude_none=True)
+        anterior = await atualizar_documento("obra", obra_id, campos, ReturnDocument.BEFORE)
+        resultado = Obra.from_mongo({**anterior, **campos})
+        await ajustar_gastos(anterior, resultado)
         return {"message": "Obra modificada com sucesso.", "data": resultado}
+    except HTTPException:
+        raise
     except Exception as e:
-        logging.error(f"Erro ao modificar obra: {e}")
+        logger.error("Erro ao modificar obra: %s", e)
         raise HTTPException(status_code=500, detail="Erro ao modificar obra.")
 
 
 @router.delete("/")
 async def deletar_obra(obra_id: str):
-    logging.info(f"ENDPOINT de deletar obra chamado para obra de id {obra_id}")
+    logger.info("ENDPOINT de deletar obra chamado para obra de id %s", obra_id)
+    validar_id(obra_id)
     try:
-        await deletar("obra", obra_id)
-        await construcao_collection.update_one(
-            {"obras_ids": ObjectId(obra_id)},
-            {"$pull": {"obras_ids": ObjectId(obra_id)}},
-        )
+        await excluir_em_cascata("obra", obra_id)
         return {"msg": f"Obra {obra_id} deletada"}
+    except HTTPException:
+        raise
     except Exception as e:
-        logging.error(f"Erro ao deletar obra: {e}")
+        logger.error("Erro ao deletar obra: %s", e)
         raise HTTPException(status_code=500, detail="Erro ao deletar obra.")
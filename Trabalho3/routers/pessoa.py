@@ -1,89 +1,87 @@
+import asyncio
 from fastapi import APIRouter, HTTPException
-from models import Pessoa, PessoaBase, PessoaPatch, Terreno, Construcao, Obra
-from typing import List
-from db import pessoas_collection, terrenos_collection, construcao_collection,obras_collection
+from models import Pessoa, PessoaBase, PessoaPatch, Terreno, VinculosPessoaTerreno, Consulta
+from typing import Any, Dict, List, Optional, Literal
+from db import pessoas_collection, terrenos_collection
 from bson import ObjectId
+from pymongo import UpdateOne
+from collections import defaultdict
 from routers.utils import (
+    consulta_estruturada,
+    coalescer,
     listar,
     criar,
     atualizar,
-    deletar,
     patch,
     validar_id,
     quantidade_total_ocorrencias,
     paginacao,
     busca_parcial,
+    criar_em_lote,
+    buscar_por_ids,
+    buscar_por_id,
+    buscar_relacionados,
+    existe,
+    cache,
+    TAMANHO_LOTE_INSERCAO,
+    tipo_do_campo,
+    resposta_stream,
+    gasto_obras,
 )
+from cascata import excluir_em_cascata
+from exportacao import LINHAS_POR_GRUPO, resposta_exportacao
 from logs import logging
 
 router = APIRouter(prefix="/pessoas", tags=["Pessoas"])
+logger = logging.getLogger(__name__)
 
 
-#Total gasto por pessoa em obras
+# Total gasto por pessoa em obras
 @router.get("/total_gasto_obras/{cliente_id}")
-async def total_gasto_obras(client_id : str):
-    logging.info("ENDPOINT total gasto por pessoa")
-    validar_id(client_id)
+@coalescer("/pessoas/total_gasto_obras/{cliente_id}")
+async def total_gasto_obras(cliente_id: str, detalhar: bool = False):
+    logger.info("ENDPOINT total gasto por pessoa")
+    validar_id(cliente_id)
     try:
-        # Checar se a pessoa existe
-        pessoa = await pessoas_collection.find_one(
-            {"_id" : ObjectId(client_id)}
-        )
-        if not pessoa:
-            raise HTTPException(status_code=404, detail=f"Pessoa não encontrada!")
-        pessoa = Pessoa.from_mongo(pessoa)
-        logging.info(f"A pessoa existe! {pessoa}")
-        count = 0
-        #Cada terreno referente a pessoa
-        for t in pessoa.terrenos_ids:
-            logging.info(f"t : {t}")
-            #Busca o terreno
-            terreno = await terrenos_collection.find_one(
-                {"_id" : ObjectId(t)}
-            )
-            terreno = Terreno.from_mongo(terreno)
-            logging.info(f"terreno {terreno}")
-            logging.info(f"Pessoa tem terreno: {terreno} ")
-            for c in terreno.construcoes_ids:
-                construcao = await construcao_collection.find_one(
-                    {"_id":ObjectId(c)}
-                )
-                construcao = Construcao.from_mongo(construcao)
-                for o in construcao.obras_ids:
-                    obra = await obras_collection.find_one(
-                        {"_id":ObjectId(o)}
-                    )
-                    if obra:
-                        obra = Obra.from_mongo(obra)
-                        count+= float(obra.custo)           
-        return {"total gasto" : count}      
-    except Exception as e:
-        logging.info(f"Erro : {e}")
+        gastos = await gasto_obras("pessoa", cliente_id, detalhar)
+        if gastos is None:
+            raise HTTPException(status_code=404, detail="Pessoa não encontrada!")
+        resposta = {"total gasto": gastos["gasto_total"]}
+        if detalhar:
+            resposta["terrenos"] = gastos["terrenos"]
+        return resposta
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.info("Erro : %s", e)
         raise HTTPException(status_code=500, detail=f"Erro : {e}")
 
 
-
 # Listar todos os usuários do banco
 @router.get("/", response_model=List[Pessoa])
-async def listar_pessoas():
-    logging.info("ENDPOINT listar pessoas chamado")
+async def listar_pessoas(formato: Optional[Literal["ndjson", "json"]] = None):
+    logger.info("ENDPOINT listar pessoas chamado")
+    if formato is not None:
+        # Transmite direto do cursor, sem montar a lista inteira em memória
+        return resposta_stream("pessoa", formato)
     try:
         pessoas = await listar("pessoa")
         return pessoas
     except Exception as e:
-        logging.error(f"Erro ao listar pessoas: {e}")
+        logger.error("Erro ao listar pessoas: %s", e)
         raise HTTPException(status_code=500, detail="Erro ao listar pessoas.")
 
 
 # Quantidade total de usuários
 @router.get("/quantidade_usuarios")
+@coalescer("/pessoas/quantidade_usuarios")
 async def quantidade_total_de_usuarios():
-    logging.info("ENDPOINT listar quantidade de usuários chamado")
+    logger.info("ENDPOINT listar quantidade de usuários chamado")
     try:
         total = await quantidade_total_ocorrencias("pessoa")
         return {"quantidade": total}
     except Exception as e:
-        logging.error(f"Erro ao acessar o total de ocorrencias de usuário. Erro: {e}")
+        logger.error("Erro ao acessar o total de ocorrencias de usuário. Erro: %s", e)
         raise HTTPException(
             status_code=500, detail="Erro ao acessar o total de ocorrencias de usuário."
         )
@@ -91,50 +89,97 @@ async def quantidade_total_de_usuarios():
 
 # Paginação
 @router.get("/paginacao")
-async def paginacao_usuario(pagina: int = 1, limite: int = 10):
-    logging.info(f"ENDPOINT de paginacao chamado - pagina: {pagina}, limite: {limite}")
+async def paginacao_usuario(
+    pagina: int = 1,
+    limite: int = 10,
+    after: Optional[str] = None,
+    contar: Optional[bool] = None,
+):
+    logger.info("ENDPOINT de paginacao chamado - pagina: %s, limite: %s", pagina, limite)
     try:
-        return await paginacao("pessoa", pagina, limite)
+        return await paginacao("pessoa", pagina, limite, after, contar)
+    except HTTPException:
+        raise
     except Exception as e:
-        logging.error(f"Erro na paginação de pessoas: {e}")
+        logger.error("Erro na paginação de pessoas: %s", e)
         raise HTTPException(status_code=500, detail="Erro na paginação de pessoas.")
 
 
 # Filtro por atributo específico
 @router.get("/filter/")
-async def filtro(atributo: str, busca: str):
-    logging.info(f"ENDPOINT de filtro chamado para atributo {atributo} e busca {busca}")
-    if atributo not in Pessoa.model_fields:
-        logging.warning(f"Atributo de filtro inválido: {atributo}")
+async def filtro(
+    atributo: str,
+    busca: str,
+    modo: Literal["regex", "texto", "prefixo"] = "regex",
+    pagina: int = 1,
+    limite: Optional[int] = None,
+):
+    logger.info("ENDPOINT de filtro chamado para atributo %s e busca %s", atributo, busca)
+    if tipo_do_campo(Pessoa, atributo) is None:
+        logger.warning("Atributo de filtro inválido: %s", atributo)
         raise HTTPException(status_code=400, detail="Atributo de filtro inválido.")
     try:
-        return await busca_parcial("pessoa", atributo, busca)
+        return await busca_parcial("pessoa", atributo, busca, modo, pagina, limite)
+    except HTTPException:
+        raise
     except Exception as e:
-        logging.error(f"Erro ao filtrar pessoas: {e}")
+        logger.error("Erro ao filtrar pessoas: %s", e)
         raise HTTPException(status_code=500, detail="Erro ao filtrar pessoas.")
 
 
+# Consulta com vários filtros tipados, ordenação e projeção (?fields=a,b);
+# com explain=true devolve o plano escolhido no lugar dos documentos
+@router.post("/consulta")
+async def consulta_pessoas(
+    consulta: Consulta, fields: Optional[str] = None, explain: bool = False
+):
+    logger.info("ENDPOINT consulta estruturada de pessoas chamado")
+    try:
+        return await consulta_estruturada("pessoa", consulta, fields, explain)
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error("Erro na consulta de pessoas: %s", e)
+        raise HTTPException(status_code=500, detail="Erro na consulta de pessoas.")
+
+
+# Exporta os documentos em NDJSON, CSV ou Parquet direto do cursor, com os
+# mesmos filtros de /consulta (ordenação e paginação são ignoradas)
+@router.post("/exportar")
+async def exportar_pessoas(
+    consulta: Optional[Consulta] = None,
+    formato: Literal["ndjson", "csv", "parquet"] = "ndjson",
+    fields: Optional[str] = None,
+    gzip: bool = False,
+    linhas_por_grupo: int = LINHAS_POR_GRUPO,
+):
+    logger.info("ENDPOINT exportar pessoas chamado - formato: %s", formato)
+    try:
+        return resposta_exportacao("pessoa", formato, consulta, fields, gzip, linhas_por_grupo)
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error("Erro ao exportar pessoas: %s", e)
+        raise HTTPException(status_code=500, detail="Erro ao exportar pessoas.")
+
+
 # Todos os terrenos associados a uma id
 @router.get("/terrenos/{pessoa_id}", response_model=List[Terreno])
 async def terreno_associados_id(pessoa_id: str):
     """Lista todos os terrenos associados a uma pessoa pelo ID."""
-    logging.info("ENDPOINT listar todos os terrenos associados a uma id")
+    logger.info("ENDPOINT listar todos os terrenos associados a uma id")
     validar_id(pessoa_id)
     try:
-        pessoa = await pessoas_collection.find_one({"_id": ObjectId(pessoa_id)})
+        pessoa = await buscar_por_id("pessoa", pessoa_id)
         if not pessoa:
-            logging.info(f"Pessoa de id : {pessoa_id} não encontrada.")
+            logger.info("Pessoa de id : %s não encontrada.", pessoa_id)
             raise HTTPException(
                 status_code=404, detail=f"Pessoa de id : {pessoa_id} não encontrada."
             )
-        terrenos = []
-        for terreno_id in Pessoa.from_mongo(pessoa).terrenos_ids:
-            terreno = await terrenos_collection.find_one({"_id": ObjectId(terreno_id)})
-            if terreno:
-                terrenos.append(Terreno.from_mongo(terreno))
-        return terrenos
-    except Exception as e:
-        logging.error(f"Erro: {e}")
+        terrenos = await buscar_relacionados("terreno", pessoa.get("terrenos_ids", []))
+        return [Terreno.from_mongo(terreno) for terreno in terrenos]
+    except Exception as e:
+        logger.error("Erro: %s", e)
         raise HTTPException(
             status_code=500, detail="Erro ao buscar terrenos associados."
         )
@@ -144,64 +189,219 @@ async def terreno_associados_id(pessoa_id: str):
 @router.post("/", status_code=201)
 async def criar_pessoa(pessoa: PessoaBase):
     """Adiciona uma nova pessoa ao banco de dados."""
-    logging.info(f"ENDPOINT criar pessoa chamado {pessoa}")
+    logger.info("ENDPOINT criar pessoa chamado %s", pessoa)
     try:
         nova_pessoa = await criar("pessoa", pessoa)
         return {"message": "Pessoa criada com sucesso.", "data": nova_pessoa}
     except Exception as e:
-        logging.error(f"Erro ao criar pessoa: {e}")
+        logger.error("Erro ao criar pessoa: %s", e)
         raise HTTPException(status_code=500, detail="Erro ao criar pessoa.")
 
 
+# Adicionar várias pessoas de uma vez
+@router.post("/bulk")
+async def criar_pessoas_em_lote(
+    pessoas: List[Dict[str, Any]], tamanho_lote: int = TAMANHO_LOTE_INSERCAO
+):
+    logger.info("ENDPOINT criar pessoas em lote chamado com %s itens", len(pessoas))
+    try:
+        return await criar_em_lote("pessoa", PessoaBase, pessoas, tamanho_lote)
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error("Erro ao criar pessoas em lote: %s", e)
+        raise HTTPException(status_code=500, detail="Erro ao criar pessoas em lote.")
+
+
 # Adicionar um terreno a uma pessoa
 @router.post("/{pessoa_id}/adicionar-terreno/{terreno_id}")
 async def adicionar_terreno_a_pessoa(pessoa_id: str, terreno_id: str):
-    logging.info(
-        f"ENDPOINT linkar terreno a pessoas chamado - pessoa_id: {pessoa_id}, terreno_id: {terreno_id}"
+    logger.info(
+        "ENDPOINT linkar terreno a pessoas chamado - pessoa_id: %s, terreno_id: %s",
+        pessoa_id,
+        terreno_id,
     )
     validar_id(pessoa_id)
     validar_id(terreno_id)
     try:
-        terreno = await terrenos_collection.find_one({"_id": ObjectId(terreno_id)})
-        pessoa = await pessoas_collection.find_one({"_id": ObjectId(pessoa_id)})
+        # Os dois são lidos direto do banco, e não do cache: os gastos do
+        # terreno entram no $inc da pessoa, e uma pessoa excluída por outro
+        # worker ainda pode estar no cache deste
+        terreno, pessoa_existe = await asyncio.gather(
+            terrenos_collection.find_one(
+                {"_id": ObjectId(terreno_id)}, {"custo_total_obras": 1, "quantidade_obras": 1}
+            ),
+            existe("pessoa", pessoa_id),
+        )
         if terreno is None:
-            logging.info(f"Terreno de id {terreno_id} não encontrado")
+            logger.info("Terreno de id %s não encontrado", terreno_id)
             raise HTTPException(status_code=404, detail="Terreno não encontrado")
-        if pessoa is None:
-            logging.info(f"Pessoa de id {pessoa_id} não encontrada")
+        if not pessoa_existe:
+            logger.info("Pessoa de id %s não encontrada", pessoa_id)
             raise HTTPException(status_code=404, detail="Pessoa não encontrada")
         await terrenos_collection.update_one(
             {"_id": ObjectId(terreno_id)},
             {"$addToSet": {"pessoas_ids": ObjectId(pessoa_id)}},
         )
+        # O filtro $ne garante que os gastos do terreno só sejam somados à
+        # pessoa quando o vínculo for novo
         await pessoas_collection.update_one(
-            {"_id": ObjectId(pessoa_id)},
-            {"$addToSet": {"terrenos_ids": ObjectId(terreno_id)}},
+            {"_id": ObjectId(pessoa_id), "terrenos_ids": {"$ne": ObjectId(terreno_id)}},
+            {
+                "$addToSet": {"terrenos_ids": ObjectId(terreno_id)},
+                "$inc": {
+                    "custo_total_obras": terreno.get("custo_total_obras", 0),
+                    "quantidade_obras": terreno.get("quantidade_obras", 0),
+                },
+            },
         )
-        logging.info(
-            f"Terreno de id {terreno_id} adicionado na lista de terrenos da pessoa de id {pessoa_id}"
+        await cache.invalidar("terreno", terreno_id)
+        await cache.invalidar("pessoa", pessoa_id)
+        logger.info(
+            "Terreno de id %s adicionado na lista de terrenos da pessoa de id %s",
+            terreno_id,
+            pessoa_id,
         )
         return {"message": "Terreno adicionado à pessoa com sucesso."}
     except HTTPException:
         raise
     except Exception as e:
-        logging.error(f"Erro ao adicionar terreno à pessoa: {e}")
+        logger.error("Erro ao adicionar terreno à pessoa: %s", e)
         raise HTTPException(
             status_code=500, detail="Erro ao adicionar terreno à pessoa."
         )
 
 
+async def preparar_vinculos(vinculos: VinculosPessoaTerreno):
+    """Confere a existência de todas as pessoas e terrenos do lote com uma
+    consulta $in por coleção. Retorna os pares válidos sem repetição, os
+    terrenos encontrados e os erros dos pares restantes."""
+    pares = vinculos.todos_os_pares()
+    for par in pares:
+        validar_id(par.pessoa_id)
+        validar_id(par.terreno_id)
+    pessoas = await buscar_por_ids("pessoa", {p.pessoa_id for p in pares}, {"_id": 1})
+    terrenos = await buscar_por_ids(
+        "terreno",
+        {p.terreno_id for p in pares},
+        {"custo_total_obras": 1, "quantidade_obras": 1},
+    )
+    validos, erros = {}, []
+    for par in pares:
+        pessoa_id, terreno_id = ObjectId(par.pessoa_id), ObjectId(par.terreno_id)
+        if pessoa_id not in pessoas:
+            erros.append({**par.model_dump(), "erro": "Pessoa não encontrada"})
+        elif terreno_id not in terrenos:
+            erros.append({**par.model_dump(), "erro": "Terreno não encontrado"})
+        else:
+            validos[(pessoa_id, terreno_id)] = terrenos[terreno_id]
+    return validos, erros
+
+
+def _inc_terreno(terreno: dict, sinal: int) -> dict:
+    return {
+        "custo_total_obras": sinal * terreno.get("custo_total_obras", 0),
+        "quantidade_obras": sinal * terreno.get("quantidade_obras", 0),
+    }
+
+
+# Vincular vários terrenos a pessoas com um bulk_write por coleção
+@router.post("/vincular-terrenos")
+async def vincular_terrenos(vinculos: VinculosPessoaTerreno):
+    logger.info("ENDPOINT vincular terrenos em lote chamado")
+    try:
+        validos, erros = await preparar_vinculos(vinculos)
+        if not validos:
+            return {"vinculados": 0, "erros": erros}
+        por_terreno = defaultdict(list)
+        for pessoa_id, terreno_id in validos:
+            por_terreno[terreno_id].append(pessoa_id)
+        await terrenos_collection.bulk_write(
+            [
+                UpdateOne({"_id": t}, {"$addToSet": {"pessoas_ids": {"$each": p}}})
+                for t, p in por_terreno.items()
+            ],
+            ordered=False,
+        )
+        # Um update por par, filtrado por $ne, para somar os gastos do
+        # terreno só quando o vínculo for novo
+        resultado = await pessoas_collection.bulk_write(
+            [
+                UpdateOne(
+                    {"_id": pessoa_id, "terrenos_ids": {"$ne": terreno_id}},
+                    {
+                        "$addToSet": {"terrenos_ids": terreno_id},
+                        "$inc": _inc_terreno(terreno, 1),
+                    },
+                )
+                for (pessoa_id, terreno_id), terreno in validos.items()
+            ],
+            ordered=False,
+        )
+        await cache.invalidar("terreno", *por_terreno)
+        await cache.invalidar("pessoa", *{p for p, _ in validos})
+        return {"vinculados": resultado.modified_count, "erros": erros}
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error("Erro ao vincular terrenos em lote: %s", e)
+        raise HTTPException(status_code=500, detail="Erro ao vincular terrenos em lote.")
+
+
+# Desvincular vários terrenos de pessoas com um bulk_write por coleção
+@router.post("/desvincular-terrenos")
+async def desvincular_terrenos(vinculos: VinculosPessoaTerreno):
+    logger.info("ENDPOINT desvincular terrenos em lote chamado")
+    try:
+        validos, erros = await preparar_vinculos(vinculos)
+        if not validos:
+            return {"desvinculados": 0, "erros": erros}
+        por_terreno = defaultdict(list)
+        for pessoa_id, terreno_id in validos:
+            por_terreno[terreno_id].append(pessoa_id)
+        await terrenos_collection.bulk_write(
+            [
+                UpdateOne({"_id": t}, {"$pull": {"pessoas_ids": {"$in": p}}})
+                for t, p in por_terreno.items()
+            ],
+            ordered=False,
+        )
+        resultado = await pessoas_collection.bulk_write(
+            [
+                UpdateOne(
+                    {"_id": pessoa_id, "terrenos_ids": terreno_id},
+                    {
+                        "$pull": {"terrenos_ids": terreno_id},
+                        "$inc": _inc_terreno(terreno, -1),
+                    },
+                )
+                for (pessoa_id, terreno_id), terreno in validos.items()
+            ],
+            ordered=False,
+        )
+        await cache.invalidar("terreno", *por_terreno)
+        await cache.invalidar("pessoa", *{p for p, _ in validos})
+        return {"desvinculados": resultado.modified_count, "erros": erros}
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error("Erro ao desvincular terrenos em lote: %s", e)
+        raise HTTPException(status_code=500, detail="Erro ao desvincular terrenos em lote.")
+
+
 # Atualizar Pessoa
 @router.put("/{pessoa_id}")
 async def atualizar_pessoa(pessoa_id: str, pessoa: PessoaBase):
-    logging.info(
-        f"ENDPOINT atualizar pessoa chamado com o id {pessoa_id} e corpo {pessoa}"
+    logger.info(
+        "ENDPOINT atualizar pessoa chamado com o id %s e corpo %s", pessoa_id, pessoa
     )
     try:
         resultado = await atualizar("pessoa", pessoa_id, pessoa)
         return {"message": "Pessoa atualizada com sucesso.", "data": resultado}
+    except HTTPException:
+        raise
     except Exception as e:
-        logging.error(f"Erro ao atualizar pessoa: {e}")
+        logger.error("Erro ao atualizar pessoa: %s", e)
         raise HTTPException(status_code=500, detail="Erro ao atualizar pessoa.")
 
 
@@ -210,29 +410,24 @@ async def modificar_pessoa(pessoa_id: str, pessoa: PessoaPatch):
     try:
         resultado = await patch("pessoa", pessoa_id, pessoa)
         return {"message": "Pessoa modificada com sucesso.", "data": resultado}
+    except HTTPException:
+        raise
     except Exception as e:
-        logging.error(f"Erro ao modificar pessoa: {e}")
+        logger.error("Erro ao modificar pessoa: %s", e)
         raise HTTPException(status_code=500, detail="Erro ao modificar pessoa.")
 
 
 # Deletar pessoa
 @router.delete("/{pessoa_id}")
 async def deletar_pessoa(pessoa_id: str):
-    logging.info(f"ENDPOINT de deletar pessoa chamado para pessoa de id {pessoa_id}")
+    logger.info("ENDPOINT de deletar pessoa chamado para pessoa de id %s", pessoa_id)
     validar_id(pessoa_id)
     try:
-        pessoa = await pessoas_collection.find_one({"_id": ObjectId(pessoa_id)})
-        if not pessoa:
-            logging.info(f"Pessoa de id {pessoa_id} não encontrada")
-            raise HTTPException(status_code=404, detail="Pessoa não encontrada.")
-        await terrenos_collection.update_many(
-            {"pessoas_ids": ObjectId(pessoa_id)},
-            {"$pull": {"pessoas_ids": ObjectId(pessoa_id)}},
-        )
-        await deletar("pessoa", pessoa_id)
+        # Retira a pessoa da lista de donos dos terrenos dela
+        await excluir_em_cascata("pessoa", pessoa_id)
         return {"message": "Pessoa deletada com sucesso."}
     except HTTPException:
         raise
     except Exception as e:
-        logging.error(f"Erro ao deletar pessoa: {e}")
+        logger.error("Erro ao deletar pessoa: %s", e)
         raise HTTPException(status_code=500, detail="Erro ao deletar pessoa.")
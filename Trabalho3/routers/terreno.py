@@ -1,50 +1,58 @@
 from fastapi import APIRouter, HTTPException
-from models import Terreno, TerrenoBase, TerrenoPatch, Construcao, Obra
-from typing import List, Dict, Type, TypedDict
-from db import (
-    terrenos_collection,
-    pessoas_collection,
-    construcao_collection,
-    obras_collection,
-)
-from bson import ObjectId
-from motor.motor_asyncio import AsyncIOMotorCollection
+from models import Terreno, TerrenoBase, TerrenoPatch, Consulta
+from typing import Any, List, Dict, Optional, Literal
 
 from routers.utils import (
+    consulta_estruturada,
+    coalescer,
     listar,
     criar,
     atualizar,
-    deletar,
     patch,
     quantidade_total_ocorrencias,
     paginacao,
     busca_parcial,
+    criar_em_lote,
+    TAMANHO_LOTE_INSERCAO,
+    tipo_do_campo,
+    resposta_stream,
     validar_id,
+    gasto_obras,
+    busca_proximidade,
+    validar_coordenadas,
+    LIMITE_GEO,
 )
+from cascata import excluir_em_cascata
+from exportacao import LINHAS_POR_GRUPO, resposta_exportacao
 from logs import logging
 
 router = APIRouter(prefix="/terrenos", tags=["Terrenos"])
+logger = logging.getLogger(__name__)
 
 
 @router.get("/", response_model=List[Terreno])
-async def listar_terrenos():
-    logging.info("ENDPOINT listar terrenos chamado")
+async def listar_terrenos(formato: Optional[Literal["ndjson", "json"]] = None):
+    logger.info("ENDPOINT listar terrenos chamado")
+    if formato is not None:
+        # Transmite direto do cursor, sem montar a lista inteira em memória
+        return resposta_stream("terreno", formato)
     try:
         return await listar("terreno")
     except Exception as e:
-        logging.error(f"Erro ao listar terrenos: {e}")
+        logger.error("Erro ao listar terrenos: %s", e)
         raise HTTPException(status_code=500, detail="Erro ao listar terrenos.")
 
 
 # Quantidade total de terrenos
 @router.get("/quantidade_terrenos")
+@coalescer("/terrenos/quantidade_terrenos")
 async def quantidade_total_de_terrenos():
-    logging.info("ENDPOINT listar quantidade de terrenos chamado")
+    logger.info("ENDPOINT listar quantidade de terrenos chamado")
     try:
         total = await quantidade_total_ocorrencias("terreno")
         return {"quantidade": total}
     except Exception as e:
-        logging.error(f"Erro ao acessar o total de terrenos: {e}")
+        logger.error("Erro ao acessar o total de terrenos: %s", e)
         raise HTTPException(
             status_code=500, detail="Erro ao acessar o total de terrenos."
         )
@@ -52,87 +60,247 @@ async def quantidade_total_de_terrenos():
 
 # Quantidade gasto total em obras por terreno
 @router.get("/terreno/gastos_obras/{terreno_id}")
-async def gasto_obras_por_terreno(terreno_id: str):
-    logging.info("ENDPOINT gasto total em obras por terreno")
+@coalescer("/terrenos/terreno/gastos_obras/{terreno_id}")
+async def gasto_obras_por_terreno(terreno_id: str, detalhar: bool = False):
+    logger.info("ENDPOINT gasto total em obras por terreno")
     validar_id(terreno_id)
     try:
-        terreno = await terrenos_collection.find_one({"_id": ObjectId(terreno_id)})
-        if not terreno:
-            logging.info(f"Terreno de id {terreno_id} não encontrado.")
+        gastos = await gasto_obras("terreno", terreno_id, detalhar)
+        if gastos is None:
+            logger.info("Terreno de id %s não encontrado.", terreno_id)
             raise HTTPException(
                 status_code=404, detail=f"Terreno de id {terreno_id} não encontrado."
             )
-
-        terreno = Terreno.from_mongo(terreno)
-        logging.info(f"Terreno encontrado: {terreno}")
-
-        total_cost = 0
-        for construcao_id in terreno.construcoes_ids:
-            logging.info(f"Construção: {construcao_id}")
-            construcao_doc = await construcao_collection.find_one({"_id": ObjectId(construcao_id)})
-            if not construcao_doc:
-                logging.warning(f"Construção de id {construcao_id} não encontrada.")
-                continue
-            construcao = Construcao.from_mongo(construcao_doc)
-            for obra_id in construcao.obras_ids:
-                obra_doc = await obras_collection.find_one({"_id": ObjectId(obra_id)})
-                if not obra_doc:
-                    logging.warning(f"Obra de id {obra_id} não encontrada.")
-                    continue
-                obra = Obra.from_mongo(obra_doc)
-                total_cost += obra.custo
-        return {"gasto_total": total_cost}
-
+        resposta = {"gasto_total": gastos["gasto_total"]}
+        if detalhar:
+            resposta["construcoes"] = gastos["construcoes"]
+        return resposta
+    except HTTPException:
+        raise
     except Exception as e:
-        logging.error(f"Erro ao calcular gasto total em obras por terreno: {e}")
+        logger.error("Erro ao calcular gasto total em obras por terreno: %s", e)
         raise HTTPException(status_code=500, detail="Erro ao calcular gasto total em obras por terreno.")
 
 
 # Paginação
 @router.get("/paginacao")
-async def paginacao_terreno(pagina: int = 1, limite: int = 10):
-    logging.info(f"ENDPOINT de paginação chamado - pagina: {pagina}, limite: {limite}")
+async def paginacao_terreno(
+    pagina: int = 1,
+    limite: int = 10,
+    after: Optional[str] = None,
+    contar: Optional[bool] = None,
+):
+    logger.info("ENDPOINT de paginação chamado - pagina: %s, limite: %s", pagina, limite)
     try:
-        return await paginacao("terreno", pagina, limite)
+        return await paginacao("terreno", pagina, limite, after, contar)
+    except HTTPException:
+        raise
     except Exception as e:
-        logging.error(f"Erro na paginação de terrenos: {e}")
+        logger.error("Erro na paginação de terrenos: %s", e)
         raise HTTPException(status_code=500, detail="Erro na paginação de terrenos.")
 
 
 # Filtro por atributo específico
 @router.get("/filter/")
-async def filtro(atributo: str, busca: str):
-    logging.info(f"ENDPOINT de filtro chamado para atributo {atributo} e busca {busca}")
-    if atributo not in Terreno.model_fields:
-        logging.warning(f"Atributo de filtro inválido: {atributo}")
+async def filtro(
+    atributo: str,
+    busca: str,
+    modo: Literal["regex", "texto", "prefixo"] = "regex",
+    pagina: int = 1,
+    limite: Optional[int] = None,
+):
+    logger.info("ENDPOINT de filtro chamado para atributo %s e busca %s", atributo, busca)
+    if tipo_do_campo(Terreno, atributo) is None:
+        logger.warning("Atributo de filtro inválido: %s", atributo)
         raise HTTPException(status_code=400, detail="Atributo de filtro inválido.")
     try:
-        return await busca_parcial("terreno", atributo, busca)
+        return await busca_parcial("terreno", atributo, busca, modo, pagina, limite)
+    except HTTPException:
+        raise
     except Exception as e:
-        logging.error(f"Erro ao filtrar terrenos: {e}")
+        logger.error("Erro ao filtrar terrenos: %s", e)
         raise HTTPException(status_code=500, detail="Erro ao filtrar terrenos.")
 
 
+# Consulta com vários filtros tipados, ordenação e projeção (?fields=a,b);
+# com explain=true devolve o plano escolhido no lugar dos documentos
+@router.post("/consulta")
+async def consulta_terrenos(
+    consulta: Consulta, fields: Optional[str] = None, explain: bool = False
+):
+    logger.info("ENDPOINT consulta estruturada de terrenos chamado")
+    try:
+        return await consulta_estruturada("terreno", consulta, fields, explain)
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error("Erro na consulta de terrenos: %s", e)
+        raise HTTPException(status_code=500, detail="Erro na consulta de terrenos.")
+
+
+# Exporta os documentos em NDJSON, CSV ou Parquet direto do cursor, com os
+# mesmos filtros de /consulta (ordenação e paginação são ignoradas)
+@router.post("/exportar")
+async def exportar_terrenos(
+    consulta: Optional[Consulta] = None,
+    formato: Literal["ndjson", "csv", "parquet"] = "ndjson",
+    fields: Optional[str] = None,
+    gzip: bool = False,
+    linhas_por_grupo: int = LINHAS_POR_GRUPO,
+):
+    logger.info("ENDPOINT exportar terrenos chamado - formato: %s", formato)
+    try:
+        return resposta_exportacao("terreno", formato, consulta, fields, gzip, linhas_por_grupo)
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error("Erro ao exportar terrenos: %s", e)
+        raise HTTPException(status_code=500, detail="Erro ao exportar terrenos.")
+
+
+def _filtro_terrenos(
+    disponivel: Optional[bool], preco_min: Optional[float], preco_max: Optional[float]
+) -> dict:
+    consulta = {}
+    if disponivel is not None:
+        consulta["disponivel"] = disponivel
+    preco = {}
+    if preco_min is not None:
+        preco["$gte"] = preco_min
+    if preco_max is not None:
+        preco["$lte"] = preco_max
+    if preco:
+        consulta["preco"] = preco
+    return consulta
+
+
+# Terrenos num raio ao redor de um ponto, do mais próximo ao mais distante
+@router.get("/proximos")
+async def terrenos_proximos(
+    longitude: float,
+    latitude: float,
+    raio_km: float = 10,
+    disponivel: Optional[bool] = None,
+    preco_min: Optional[float] = None,
+    preco_max: Optional[float] = None,
+    pagina: int = 1,
+    limite: int = LIMITE_GEO,
+):
+    logger.info(
+        "ENDPOINT terrenos próximos chamado - ponto: (%s, %s), raio: %s km",
+        longitude,
+        latitude,
+        raio_km,
+    )
+    if raio_km <= 0:
+        raise HTTPException(status_code=400, detail="raio_km deve ser maior que 0.")
+    try:
+        return await busca_proximidade(
+            "terreno",
+            longitude,
+            latitude,
+            _filtro_terrenos(disponivel, preco_min, preco_max),
+            raio_km * 1000,
+            pagina,
+            limite,
+        )
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error("Erro ao buscar terrenos próximos: %s", e)
+        raise HTTPException(status_code=500, detail="Erro ao buscar terrenos próximos.")
+
+
+# Terrenos dentro de um retângulo (ex. a área visível do mapa), do centro
+# para as bordas
+@router.get("/area")
+async def terrenos_na_area(
+    min_longitude: float,
+    min_latitude: float,
+    max_longitude: float,
+    max_latitude: float,
+    disponivel: Optional[bool] = None,
+    preco_min: Optional[float] = None,
+    preco_max: Optional[float] = None,
+    pagina: int = 1,
+    limite: int = LIMITE_GEO,
+):
+    logger.info(
+        "ENDPOINT terrenos na área chamado - (%s, %s) a (%s, %s)",
+        min_longitude,
+        min_latitude,
+        max_longitude,
+        max_latitude,
+    )
+    validar_coordenadas(min_longitude, min_latitude)
+    validar_coordenadas(max_longitude, max_latitude)
+    if min_longitude >= max_longitude or min_latitude >= max_latitude:
+        raise HTTPException(
+            status_code=400, detail="Os valores mínimos devem ser menores que os máximos."
+        )
+    consulta = _filtro_terrenos(disponivel, preco_min, preco_max)
+    anel = [
+        [min_longitude, min_latitude],
+        [max_longitude, min_latitude],
+        [max_longitude, max_latitude],
+        [min_longitude, max_latitude],
+        [min_longitude, min_latitude],
+    ]
+    consulta["localizacao"] = {
+        "$geoWithin": {"$geometry": {"type": "Polygon", "coordinates": [anel]}}
+    }
+    try:
+        return await busca_proximidade(
+            "terreno",
+            (min_longitude + max_longitude) / 2,
+            (min_latitude + max_latitude) / 2,
+            consulta,
+            pagina=pagina,
+            limite=limite,
+        )
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error("Erro ao buscar terrenos na área: %s", e)
+        raise HTTPException(status_code=500, detail="Erro ao buscar terrenos na área.")
+
+
 @router.post("/")
 async def criar_terreno(terreno: TerrenoBase):
-    logging.info(f"ENDPOINT criar terreno chamado {terreno}")
+    logger.info("ENDPOINT criar terreno chamado %s", terreno)
     try:
         return await criar("terreno", terreno)
     except Exception as e:
-        logging.error(f"Erro ao criar terreno: {e}")
+        logger.error("Erro ao criar terreno: %s", e)
         raise HTTPException(status_code=500, detail="Erro ao criar terreno.")
 
 
+@router.post("/bulk")
+async def criar_terrenos_em_lote(
+    terrenos: List[Dict[str, Any]], tamanho_lote: int = TAMANHO_LOTE_INSERCAO
+):
+    logger.info("ENDPOINT criar terrenos em lote chamado com %s itens", len(terrenos))
+    try:
+        return await criar_em_lote("terreno", TerrenoBase, terrenos, tamanho_lote)
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error("Erro ao criar terrenos em lote: %s", e)
+        raise HTTPException(status_code=500, detail="Erro ao criar terrenos em lote.")
+
+
 @router.put("/{terreno_id}")
 async def atualizar_terreno(terreno_id: str, terreno: TerrenoBase):
-    logging.info(
-        f"ENDPOINT atualizar terreno chamado com o id {terreno_id} e corpo {terreno}"
+    logger.info(
+        "ENDPOINT atualizar terreno chamado com o id %s e corpo %s", terreno_id, terreno
     )
     try:
         resultado = await atualizar("terreno", terreno_id, terreno)
         return {"message": "Terreno atualizado com sucesso.", "data": resultado}
+    except HTTPException:
+        raise
     except Exception as e:
-        logging.error(f"Erro ao atualizar terreno: {e}")
+        logger.error("Erro ao atualizar terreno: %s", e)
         raise HTTPException(status_code=500, detail="Erro ao atualizar terreno.")
 
 
@@ -141,23 +309,24 @@ async def modificar_terreno(terreno_id: str, terreno: TerrenoPatch):
     try:
         resultado = await patch("terreno", terreno_id, terreno)
         return {"message": "Terreno modificado com sucesso.", "data": resultado}
+    except HTTPException:
+        raise
     except Exception as e:
-        logging.error(f"Erro ao modificar terreno: {e}")
+        logger.error("Erro ao modificar terreno: %s", e)
         raise HTTPException(status_code=500, detail="Erro ao modificar terreno.")
 
 
 # Ao deletar um terreno, atualiza a lista de terrenos_ids das pessoas que
-# possuiam aquele terreno, além de deletar as contruções atreladas a ele
+# possuiam aquele terreno, além de deletar as contruções e obras atreladas a ele
 @router.delete("/{terreno_id}")
 async def deletar_terreno(terreno_id: str):
-    logging.info(f"ENDPOINT de deletar terreno chamado para terreno de id {terreno_id}")
+    logger.info("ENDPOINT de deletar terreno chamado para terreno de id %s", terreno_id)
+    validar_id(terreno_id)
     try:
-        await construcao_collection.delete_many({"terreno_id": ObjectId(terreno_id)})
-        await pessoas_collection.update_many(
-            {"terrenos_ids": ObjectId(terreno_id)},
-            {"$pull": {"terrenos_ids": ObjectId(terreno_id)}},
-        )
-        return await deletar("terreno", terreno_id)
+        excluidos = await excluir_em_cascata("terreno", terreno_id)
+        return {"msg": "deleted", "excluidos": excluidos}
+    except HTTPException:
+        raise
     except Exception as e:
-        logging.error(f"Erro ao deletar terreno: {e}")
+        logger.error("Erro ao deletar terreno: %s", e)
         raise HTTPException(status_code=500, detail="Erro ao deletar terreno.")
@@ -1,7 +1,25 @@
 from fastapi import APIRouter, HTTPException
-from models import Terreno, TerrenoBase, TerrenoPatch, Pessoa, Construcao, Obra
-from typing import List, Dict, Type, TypedDict
+from fastapi.responses import JSONResponse, StreamingResponse
+from models import (
+    Terreno,
+    TerrenoBase,
+    TerrenoPatch,
+    Pessoa,
+    Construcao,
+    Obra,
+    Consulta,
+    CAMPOS_PREFIXO,
+    CAMPOS_TEXTO,
+    campo_chaves,
+    campo_normalizado,
+    ponto_geojson,
+)
+from typing import List, Dict, Optional, Type, TypedDict, Union, get_args, get_origin
+from types import UnionType
+from datetime import datetime, timezone
+from pydantic import BaseModel, ValidationError
 from db import (
+    ColecaoPreguicosa,
     terrenos_collection,
     pessoas_collection,
     obras_collection,
@@ -10,8 +28,55 @@ from db import (
 from bson import ObjectId
 from bson.errors import InvalidId
 from motor.motor_asyncio import AsyncIOMotorCollection
+from pymongo import ReturnDocument, UpdateMany, UpdateOne
+from pymongo.errors import BulkWriteError
 from logs import logging
+from metricas import metricas
+from texto import chaves_busca, chaves_campo, normalizar
+from collections import OrderedDict, defaultdict
+from weakref import WeakKeyDictionary
+from abc import ABC, abstractmethod
+import asyncio
+import base64
+import functools
+import json
 import math
+import os
+import re
+import time
+
+logger = logging.getLogger(__name__)
+
+
+def _json_padrao(valor):
+    if isinstance(valor, datetime):
+        return valor.isoformat()
+    return str(valor)
+
+
+try:
+    import orjson
+
+    def serializar(conteudo) -> bytes:
+        return orjson.dumps(conteudo, default=_json_padrao)
+
+    desserializar = orjson.loads
+
+except ImportError:  # orjson é opcional; sem ele usa o json da biblioteca padrão
+
+    def serializar(conteudo) -> bytes:
+        return json.dumps(conteudo, default=_json_padrao, ensure_ascii=False).encode()
+
+    desserializar = json.loads
+
+
+class RespostaOrjson(JSONResponse):
+    """Resposta JSON que serializa direto para bytes. Por ser uma Response,
+    o FastAPI não revalida o conteúdo contra o response_model da rota, então
+    só deve receber dicionários já no formato dos modelos."""
+
+    def render(self, content) -> bytes:
+        return serializar(content)
 
 
 class ModelMapEntry(TypedDict):
@@ -26,14 +91,368 @@ map: Dict[str, ModelMapEntry] = {
     "obra": {"type": Obra, "collection": obras_collection},
 }
 
+# Tipos que guardam os contadores materializados de gasto com obras
+TIPOS_COM_GASTOS = ("pessoa", "terreno", "construcao")
+
+
+class BackendCache(ABC):
+    """Armazenamento usado pelo CacheEntidades. As chaves são (tipo, id).
+
+    Um backend compartilhado entre workers (ex. Redis) implementa estes
+    métodos; `remover_referencias` pode simplesmente limpar o tipo inteiro
+    quando não for possível procurar dentro dos valores guardados.
+
+    `geracao` identifica o estado de uma chave e precisa mudar a cada
+    remoção ou limpeza que a alcance. `guardar` só grava se a geração ainda
+    for a lida antes de carregar o documento, para que uma leitura que
+    começou antes de uma escrita não guarde o documento antigo depois da
+    invalidação.
+    """
+
+    @abstractmethod
+    async def obter(self, chave: tuple) -> Optional[dict]: ...
+
+    @abstractmethod
+    async def geracao(self, chave: tuple): ...
+
+    @abstractmethod
+    async def guardar(self, chave: tuple, valor: dict, geracao) -> bool: ...
+
+    @abstractmethod
+    async def remover(self, chaves: List[tuple]): ...
+
+    @abstractmethod
+    async def limpar(self, tipo: Optional[str] = None): ...
+
+    async def remover_referencias(self, tipo: str, campo: str, valor):
+        await self.limpar(tipo)
+
+
+class CacheMemoria(BackendCache):
+    """Cache do próprio processo com descarte LRU e expiração por TTL."""
+
+    def __init__(self, tamanho_maximo: int = 10_000, ttl: float = 60):
+        self.tamanho_maximo = tamanho_maximo
+        self.ttl = ttl
+        self.entradas: "OrderedDict[tuple, tuple]" = OrderedDict()
+        # Geração de cada chave invalidada recentemente e de cada tipo. As
+        # chaves descartadas do LRU passam a valer o piso, que é a maior
+        # geração já descartada, então nunca voltam a um valor antigo
+        self.contador = 0
+        self.geracoes: "OrderedDict[tuple, int]" = OrderedDict()
+        self.geracoes_tipo: Dict[str, int] = {}
+        self.piso = 0
+
+    def _avancar(self) -> int:
+        self.contador += 1
+        return self.contador
+
+    async def obter(self, chave: tuple) -> Optional[dict]:
+        entrada = self.entradas.get(chave)
+        if entrada is None:
+            return None
+        expira_em, valor = entrada
+        if expira_em < time.monotonic():
+            del self.entradas[chave]
+            return None
+        self.entradas.move_to_end(chave)
+        return valor
+
+    async def geracao(self, chave: tuple) -> tuple:
+        return (self.geracoes_tipo.get(chave[0], 0), self.geracoes.get(chave, self.piso))
+
+    async def guardar(self, chave: tuple, valor: dict, geracao) -> bool:
+        if await self.geracao(chave) != geracao:
+            return False
+        self.entradas[chave] = (time.monotonic() + self.ttl, valor)
+        self.entradas.move_to_end(chave)
+        while len(self.entradas) > self.tamanho_maximo:
+            self.entradas.popitem(last=False)
+        return True
+
+    async def remover(self, chaves: List[tuple]):
+        for chave in chaves:
+            self.entradas.pop(chave, None)
+            self.geracoes[chave] = self._avancar()
+            self.geracoes.move_to_end(chave)
+        while len(self.geracoes) > self.tamanho_maximo:
+            _, geracao = self.geracoes.popitem(last=False)
+            self.piso = max(self.piso, geracao)
+
+    async def limpar(self, tipo: Optional[str] = None):
+        if tipo is None:
+            self.entradas.clear()
+            self.geracoes.clear()
+            self.piso = self._avancar()
+            return
+        for chave in [c for c in self.entradas if c[0] == tipo]:
+            del self.entradas[chave]
+        self.geracoes_tipo[tipo] = self._avancar()
+
+    async def remover_referencias(self, tipo: str, campo: str, valor):
+        """Remove os documentos do tipo cujo campo é (ou contém) o valor."""
+        valor = str(valor)
+        remover = []
+        for chave, (_, doc) in self.entradas.items():
+            if chave[0] != tipo:
+                continue
+            atual = doc.get(campo)
+            atuais = atual if isinstance(atual, list) else [atual]
+            if any(str(a) == valor for a in atuais):
+                remover.append(chave)
+        await self.remover(remover)
+        # Uma leitura em andamento de um documento ainda fora do cache também
+        # pode conter o valor antigo
+        self.geracoes_tipo[tipo] = self._avancar()
+
+
+class CacheDesligado(BackendCache):
+    """Backend que não guarda nada: toda leitura vai ao banco (ainda
+    agrupada pelo carregador)."""
+
+    async def obter(self, chave: tuple) -> Optional[dict]:
+        return None
+
+    async def geracao(self, chave: tuple):
+        return None
+
+    async def guardar(self, chave: tuple, valor: dict, geracao) -> bool:
+        return False
+
+    async def remover(self, chaves: List[tuple]):
+        pass
+
+    async def limpar(self, tipo: Optional[str] = None):
+        pass
+
+
+# Backends selecionáveis com CACHE_ENTIDADES. O CacheMemoria é de cada
+# processo e a invalidação só limpa o do worker que fez a escrita: com vários
+# workers, os outros servem o documento antigo até o TTL. Por isso o serve.py
+# desliga o cache quando sobe mais de um worker; para mantê-lo é preciso um
+# backend compartilhado entre os processos.
+BACKENDS_CACHE = {"memoria": CacheMemoria, "desligado": CacheDesligado}
+
+
+def backend_cache() -> BackendCache:
+    nome = os.getenv("CACHE_ENTIDADES", "memoria").lower()
+    if nome not in BACKENDS_CACHE:
+        raise ValueError(f"CACHE_ENTIDADES inválido: {nome}")
+    return BACKENDS_CACHE[nome]()
+
+
+# Quantidade máxima de ids por consulta $in do carregador
+TAMANHO_LOTE_CARREGADOR = 1000
+
+
+class CarregadorIds:
+    """Agrupa as buscas por _id feitas no mesmo ciclo do event loop.
+
+    `carregar` registra o id e devolve um future; no fim do ciclo atual os ids
+    pendentes de cada tipo são buscados com uma única consulta $in, inclusive
+    os pedidos por requisições diferentes. Ids repetidos são buscados uma vez
+    e cada chamador recebe a sua cópia do documento (ou None).
+    """
+
+    def __init__(self, tamanho_lote: int = TAMANHO_LOTE_CARREGADOR):
+        self.tamanho_lote = tamanho_lote
+        # Os futures pertencem a um event loop, então cada loop tem os seus
+        self._pendentes: "WeakKeyDictionary[asyncio.AbstractEventLoop, dict]" = (
+            WeakKeyDictionary()
+        )
+
+    def carregar(self, tipo: str, id) -> asyncio.Future:
+        loop = asyncio.get_running_loop()
+        pendentes = self._pendentes.setdefault(loop, {})
+        if tipo not in pendentes:
+            pendentes[tipo] = {}
+            loop.call_soon(self._despachar, loop, tipo)
+        futuro = loop.create_future()
+        pendentes[tipo].setdefault(str(id), []).append(futuro)
+        return futuro
+
+    def _despachar(self, loop: asyncio.AbstractEventLoop, tipo: str):
+        pedidos = self._pendentes[loop].pop(tipo)
+        ids = list(pedidos)
+        for inicio in range(0, len(ids), self.tamanho_lote):
+            lote = {id: pedidos[id] for id in ids[inicio : inicio + self.tamanho_lote]}
+            loop.create_task(self._buscar(tipo, lote))
+
+    async def _buscar(self, tipo: str, pedidos: Dict[str, list]):
+        metricas.incrementar("carregador_lotes_total", tipo=tipo)
+        metricas.incrementar("carregador_ids_total", len(pedidos), tipo=tipo)
+        try:
+            cursor = map[tipo]["collection"].find(
+                {"_id": {"$in": [ObjectId(id) for id in pedidos]}}
+            )
+            docs = {str(d["_id"]): d async for d in cursor}
+        except Exception as e:
+            logger.error("Erro ao carregar %s em lote: %s", tipo, e)
+            for futuros in pedidos.values():
+                for futuro in futuros:
+                    if not futuro.done():
+                        futuro.set_exception(e)
+            return
+        for id, futuros in pedidos.items():
+            doc = docs.get(id)
+            for futuro in futuros:
+                # O chamador pode ter sido cancelado enquanto esperava
+                if not futuro.done():
+                    futuro.set_result(dict(doc) if doc is not None else None)
+
+
+carregador = CarregadorIds()
+
+
+class CacheEntidades:
+    """Cache de leitura por id na frente das coleções.
+
+    Toda escrita que muda um documento precisa chamar `invalidar` (ou
+    `invalidar_referencias`, quando só se sabe o filtro usado) depois de
+    concluída, para que a próxima leitura vá ao banco.
+    """
+
+    def __init__(self, backend: BackendCache):
+        self.backend = backend
+        self.acertos = 0
+        self.falhas = 0
+
+    async def buscar(self, tipo: str, id) -> Optional[dict]:
+        chave = (tipo, str(id))
+        doc = await self.backend.obter(chave)
+        if doc is not None:
+            self.acertos += 1
+            metricas.incrementar("cache_entidades_total", tipo=tipo, resultado="acerto")
+            return dict(doc)
+        self.falhas += 1
+        metricas.incrementar("cache_entidades_total", tipo=tipo, resultado="falha")
+        geracao = await self.backend.geracao(chave)
+        doc = await carregador.carregar(tipo, id)
+        if doc is not None:
+            await self.backend.guardar(chave, doc, geracao)
+            return dict(doc)
+        return None
+
+    async def invalidar(self, tipo: str, *ids):
+        await self.backend.remover([(tipo, str(id)) for id in ids])
+
+    async def invalidar_referencias(self, tipo: str, campo: str, valor):
+        await self.backend.remover_referencias(tipo, campo, valor)
+
+    def estatisticas(self) -> dict:
+        return {"acertos": self.acertos, "falhas": self.falhas}
+
+
+cache = CacheEntidades(backend_cache())
+
+
+async def buscar_por_id(tipo: str, id) -> Optional[dict]:
+    """Busca um documento pelo _id passando pelo cache de entidades."""
+    return await cache.buscar(tipo, id)
+
+
+async def existe(tipo: str, id) -> bool:
+    """Confere no banco, sem passar pelo cache, se o documento existe.
+
+    Usado nas escritas que dependem da existência de outro documento: o
+    cache pode guardar um documento que outro worker já excluiu, e a escrita
+    criaria uma referência órfã."""
+    return await map[tipo]["collection"].find_one({"_id": ObjectId(id)}, {"_id": 1}) is not None
+
+
+async def buscar_relacionados(tipo: str, ids) -> List[dict]:
+    """Busca os documentos referenciados por uma lista de ids, na ordem da
+    lista e sem os que não existem. As buscas saem juntas, então os ids que
+    faltam no cache são resolvidos pelo carregador com uma consulta $in."""
+    docs = await asyncio.gather(*(buscar_por_id(tipo, id) for id in ids))
+    return [doc for doc in docs if doc is not None]
+
+
+# Janelas de stale-while-revalidate por rota, em segundos, que sobrepõem as
+# declaradas nos endpoints. Os endpoints não declaram janela, então por padrão
+# só compartilham cálculos simultâneos e nunca servem um resultado anterior a
+# uma escrita; a janela é uma escolha de cada implantação, que aceita contagens
+# atrasadas em até a janela. Ex.: "/pessoas/quantidade_usuarios=5,/obras/quantidade_obras=2"
+JANELAS_COALESCENCIA: Dict[str, float] = {
+    rota.strip(): float(janela)
+    for rota, _, janela in (
+        item.partition("=") for item in os.getenv("COALESCER_JANELAS", "").split(",")
+    )
+    if rota.strip()
+}
+
+
+class _EstadoCoalescencia:
+    def __init__(self):
+        self.em_andamento: Dict[tuple, asyncio.Task] = {}
+        self.resultados: Dict[tuple, tuple] = {}  # chave -> (instante, resultado)
+
+
+_coalescencia: "WeakKeyDictionary[asyncio.AbstractEventLoop, _EstadoCoalescencia]" = (
+    WeakKeyDictionary()
+)
+
+
+def coalescer(rota: str, janela: float = 0.0):
+    """Faz requisições idênticas simultâneas compartilharem um só cálculo.
+
+    A chave é a rota mais os parâmetros do endpoint. Quem chega enquanto o
+    cálculo está em andamento espera o mesmo resultado (ou a mesma exceção).
+    Com `janela` > 0, o último resultado é servido por até `janela` segundos;
+    passada metade da janela, cada acerto sem recálculo em andamento dispara
+    um em segundo plano (stale-while-revalidate). O cálculo roda numa tarefa própria, então não é
+    perdido se o cliente que o iniciou desconectar.
+    """
+    janela = JANELAS_COALESCENCIA.get(rota, janela)
+
+    def decorador(endpoint):
+        @functools.wraps(endpoint)
+        async def coalescido(**parametros):
+            estado = _coalescencia.setdefault(asyncio.get_running_loop(), _EstadoCoalescencia())
+            chave = (rota, tuple(sorted(parametros.items())))
+
+            def iniciar() -> asyncio.Task:
+                tarefa = asyncio.create_task(endpoint(**parametros))
+                estado.em_andamento[chave] = tarefa
+
+                def concluir(tarefa: asyncio.Task):
+                    estado.em_andamento.pop(chave, None)
+                    if janela and not tarefa.cancelled() and tarefa.exception() is None:
+                        estado.resultados[chave] = (time.monotonic(), tarefa.result())
+
+                tarefa.add_done_callback(concluir)
+                return tarefa
+
+            guardado = estado.resultados.get(chave)
+            if guardado is not None:
+                idade = time.monotonic() - guardado[0]
+                if idade < janela:
+                    if idade >= janela / 2 and chave not in estado.em_andamento:
+                        iniciar()
+                    metricas.incrementar("coalescencia_total", rota=rota, resultado="obsoleto")
+                    return guardado[1]
+                del estado.resultados[chave]
+
+            tarefa = estado.em_andamento.get(chave)
+            if tarefa is None:
+                tarefa = iniciar()
+                metricas.incrementar("coalescencia_total", rota=rota, resultado="calculado")
+            else:
+                metricas.incrementar("coalescencia_total", rota=rota, resultado="coalescido")
+            return await asyncio.shield(tarefa)
+
+        return coalescido
+
+    return decorador
+
 
 def validar_id(id: str):
     """Valida se o id fornecido é um ObjectId válido."""
-    logging.info(f"Validação de id : {id}")
+    logger.info("Validação de id : %s", id)
     try:
         obj_id = ObjectId(id)
     except (InvalidId, Exception) as e:
-        logging.warning(f"Erro ao validar id : {e}")
+        logger.warning("Erro ao validar id : %s", e)
         raise HTTPException(status_code=400, detail=f"ID {id} inválido")
 
 
@@ -42,108 +461,1017 @@ async def quantidade_total_ocorrencias(tipo: str):
     try:
         return await map[tipo]["collection"].count_documents({})
     except Exception as e:
-        logging.error(f"Erro ao contar documentos do tipo {tipo}: {e}")
+        logger.error("Erro ao contar documentos do tipo %s: %s", tipo, e)
         raise HTTPException(
             status_code=500, detail=f"Erro ao contar documentos do tipo {tipo}."
         )
 
 
-async def busca_parcial(tipo: str, campo: str, valor: str):
-    """Busca parcial por campo e valor, com tratamento para campos string e numéricos."""
-    logging.info(
-        f"Busca parcial no tipo {tipo}, atributo buscado {campo}, valor passado {valor}"
+def _desembrulhar(anotacao):
+    """Tira Optional[...] e List[...] de uma anotação de tipo."""
+    while get_origin(anotacao) in (Union, UnionType, list):
+        anotacao = next(a for a in get_args(anotacao) if a is not type(None))
+    return anotacao
+
+
+def tipo_do_campo(modelo: Type[BaseModel], caminho: str):
+    """Retorna o tipo anotado de um campo do modelo, aceitando campos
+    aninhados como endereco.cidade, ou None se o campo não existir."""
+    anotacao = modelo
+    for parte in caminho.split("."):
+        if not (isinstance(anotacao, type) and issubclass(anotacao, BaseModel)):
+            return None
+        if parte not in anotacao.model_fields:
+            return None
+        anotacao = _desembrulhar(anotacao.model_fields[parte].annotation)
+    return anotacao
+
+
+def converter_valor(tipo_campo, campo: str, valor: str):
+    """Converte o valor recebido como texto para o tipo anotado do campo."""
+    try:
+        if tipo_campo is bool:
+            normalizado = valor.strip().lower()
+            if normalizado in ("true", "1", "sim", "s"):
+                return True
+            if normalizado in ("false", "0", "nao", "não", "n"):
+                return False
+            raise ValueError(valor)
+        if tipo_campo is int:
+            return int(valor)
+        if tipo_campo is float:
+            return float(valor)
+        if tipo_campo is datetime:
+            return datetime.fromisoformat(valor)
+    except ValueError:
+        logger.warning("Valor %s inválido para o campo %s", valor, campo)
+        raise HTTPException(
+            status_code=400, detail=f"Valor {valor} inválido para o campo {campo}."
+        )
+    return valor
+
+
+def campo_textual(tipo_campo) -> bool:
+    return tipo_campo not in (bool, int, float, datetime)
+
+
+# Quantidade de resultados por página nas buscas textual e por prefixo
+LIMITE_BUSCA = 50
+
+
+def _texto_do_campo(doc: dict, campo: str) -> str:
+    valores = [doc]
+    for parte in campo.split("."):
+        valores = [v.get(parte) for v in valores if isinstance(v, dict)]
+        valores = [i for v in valores for i in (v if isinstance(v, list) else [v])]
+    return " ".join(v for v in valores if isinstance(v, str))
+
+
+async def busca_parcial(
+    tipo: str,
+    campo: str,
+    valor: str,
+    modo: str = "regex",
+    pagina: int = 1,
+    limite: Optional[int] = None,
+):
+    """Busca por campo e valor.
+
+    Campos numéricos, booleanos e de data são convertidos pelo tipo anotado no
+    modelo e buscados por igualdade. Campos de texto dependem do modo:
+      - "regex": trecho em qualquer posição, sem diferenciar maiúsculas
+        (não usa índice);
+      - "texto": índice de texto do tipo, com relevância em `score`,
+        restrito aos documentos com algum termo da busca no campo;
+      - "prefixo": início do valor, sem diferenciar maiúsculas nem acentos,
+        usando o índice da cópia normalizada do campo.
+    Os modos "texto" e "prefixo" são sempre paginados.
+    """
+    logger.info(
+        "Busca parcial no tipo %s, atributo buscado %s, valor passado %s", tipo, campo, valor
     )
     try:
+        modelo = map[tipo]["type"]
+        if campo == "id":
+            logger.info("Campo procurado é um ID")
+            validar_id(valor)
+            data = await buscar_por_id(tipo, valor)
+            if not data:
+                logger.info("Nenhum registro encontrado para id %s", valor)
+                return None
+            return modelo.from_mongo(data)
+
         # Saber se o campo existe no modelo
-        if campo not in map[tipo]["type"].__fields__ and campo != "id":
-            logging.warning(f"Campo {campo} não existe no modelo {tipo}")
+        tipo_campo = tipo_do_campo(modelo, campo)
+        if tipo_campo is None:
+            logger.warning("Campo %s não existe no modelo %s", campo, tipo)
             raise HTTPException(
                 status_code=400, detail=f"Campo {campo} não existe no modelo {tipo}."
             )
+        if pagina < 1 or (limite is not None and limite < 1):
+            raise HTTPException(
+                status_code=400, detail="Valores precisam ser inteiros maiores que 0"
+            )
 
-        if campo == "id":
-            logging.info("Campo procurado é um ID")
-            validar_id(valor)
-            data = await map[tipo]["collection"].find_one({"_id": ObjectId(valor)})
-            if not data:
-                logging.info(f"Nenhum registro encontrado para id {valor}")
-                return None
-            return map[tipo]["type"].from_mongo(data)
+        projecao = None
+        ordenacao = None
+        if not campo_textual(tipo_campo):
+            filtro = {campo: converter_valor(tipo_campo, campo, valor)}
+        elif modo == "texto":
+            if campo not in CAMPOS_TEXTO[tipo]:
+                raise HTTPException(
+                    status_code=400,
+                    detail=f"Campo {campo} não faz parte da busca textual de {tipo}.",
+                )
+            # O índice de texto cobre todos os campos de CAMPOS_TEXTO; a
+            # restrição ao campo vai no mesmo filtro, pelas chaves gravadas
+            # (texto.chaves_campo), que não dependem do stemmer do servidor
+            filtro = {"$text": {"$search": valor}}
+            chaves = chaves_busca(valor)
+            if chaves:
+                filtro[campo_chaves(campo)] = {"$in": sorted(chaves)}
+            projecao = {"score": {"$meta": "textScore"}}
+            ordenacao = [("score", {"$meta": "textScore"})]
+        elif modo == "prefixo":
+            if campo not in CAMPOS_PREFIXO[tipo]:
+                raise HTTPException(
+                    status_code=400,
+                    detail=f"Campo {campo} não faz parte da busca por prefixo de {tipo}.",
+                )
+            normalizado = campo_normalizado(campo)
+            filtro = {normalizado: {"$regex": "^" + re.escape(normalizar(valor))}}
+            ordenacao = [(normalizado, 1)]
+        else:
+            filtro = {campo: {"$regex": valor, "$options": "i"}}
 
-        # Tenta busca regex (string)
-        filtro = {campo: {"$regex": valor, "$options": "i"}}
-        data = await map[tipo]["collection"].find(filtro).to_list()
-        if data:
-            return [map[tipo]["type"].from_mongo(d) for d in data]
+        cursor = map[tipo]["collection"].find(filtro, projecao)
+        if ordenacao:
+            cursor = cursor.sort(ordenacao)
+        if modo in ("texto", "prefixo") and limite is None:
+            limite = LIMITE_BUSCA
+        if limite is not None:
+            cursor = cursor.skip((pagina - 1) * limite).limit(limite)
+        data = await cursor.to_list(length=limite)
 
-        # Se não encontrou, tenta busca numérica
-        try:
-            filtro = {campo: int(valor)}
-            data = await map[tipo]["collection"].find(filtro).to_list()
-            if data:
-                return [map[tipo]["type"].from_mongo(d) for d in data]
-        except Exception:
-            logging.info(f"Valor {valor} não é numérico para campo {campo}")
-        return []
+        if modo not in ("texto", "prefixo"):
+            return [modelo.from_mongo(d) for d in data]
+        resultados = []
+        for d in data:
+            score = d.pop("score", None)
+            resultado = modelo.from_mongo(d).model_dump()
+            if score is not None:
+                resultado["score"] = score
+            resultados.append(resultado)
+        return {"data": resultados, "pagina_atual": pagina, "limite": limite}
     except HTTPException:
         raise
     except Exception as e:
-        logging.error(f"Erro na busca parcial: {e}")
+        logger.error("Erro na busca parcial: %s", e)
         raise HTTPException(status_code=500, detail="Erro na busca parcial.")
 
 
-async def paginacao(tipo: str, pagina: int = 1, limite: int = 10):
+# Tamanho máximo de página das consultas estruturadas
+LIMITE_CONSULTA_MAXIMO = 500
+
+
+def _campo_consulta(modelo: Type[BaseModel], campo: str) -> tuple:
+    """Nome do campo no banco e tipo anotado, validando que o campo existe e
+    é escalar (subcampos de endereco podem ser usados, endereco não)."""
+    if campo == "id":
+        return "_id", str
+    tipo_campo = tipo_do_campo(modelo, campo)
+    if tipo_campo is None:
+        raise HTTPException(status_code=400, detail=f"Campo {campo} não existe no modelo.")
+    if isinstance(tipo_campo, type) and issubclass(tipo_campo, BaseModel):
+        raise HTTPException(
+            status_code=400, detail=f"Campo {campo} é um objeto; use um de seus subcampos."
+        )
+    return campo, tipo_campo
+
+
+def _eh_referencia(campo: str) -> bool:
+    return campo != "_id" and (campo.endswith("_id") or campo.endswith("_ids"))
+
+
+def _valor_predicado(tipo_campo, campo: str, valor):
+    """Valida e converte o valor JSON de um predicado para o tipo do campo."""
+    if campo == "_id" or _eh_referencia(campo):
+        # Referências são guardadas como ObjectId
+        if not isinstance(valor, str):
+            raise HTTPException(status_code=400, detail=f"ID {valor} inválido")
+        validar_id(valor)
+        return ObjectId(valor)
+    if isinstance(valor, str):
+        return converter_valor(tipo_campo, campo, valor)
+    if tipo_campo is bool and isinstance(valor, bool):
+        return valor
+    if tipo_campo is int and isinstance(valor, int) and not isinstance(valor, bool):
+        return valor
+    if tipo_campo is float and isinstance(valor, (int, float)) and not isinstance(valor, bool):
+        return valor
+    raise HTTPException(status_code=400, detail=f"Valor {valor} inválido para o campo {campo}.")
+
+
+def compilar_consulta(tipo: str, consulta: Consulta) -> tuple:
+    """Traduz os predicados e a ordenação para um filtro e uma ordenação do
+    MongoDB, conferindo cada campo e valor contra os tipos do modelo.
+
+    Predicados sobre o mesmo campo são combinados no mesmo documento (ex. gte
+    e lte viram um intervalo), o que permite ao servidor usar um único
+    intervalo do índice. A ordenação termina em _id para que a paginação
+    seja estável.
+    """
+    modelo = map[tipo]["type"]
+    filtro: Dict[str, dict] = {}
+    for predicado in consulta.filtros:
+        campo, tipo_campo = _campo_consulta(modelo, predicado.campo)
+        operador = "$" + predicado.op
+        if predicado.op == "exists":
+            valor = True if predicado.valor is None else predicado.valor
+            if not isinstance(valor, bool):
+                raise HTTPException(
+                    status_code=400, detail=f"exists espera true ou false no campo {predicado.campo}."
+                )
+        elif predicado.op in ("in", "nin"):
+            if not isinstance(predicado.valor, list):
+                raise HTTPException(
+                    status_code=400,
+                    detail=f"{predicado.op} espera uma lista no campo {predicado.campo}.",
+                )
+            valor = [_valor_predicado(tipo_campo, campo, v) for v in predicado.valor]
+        elif predicado.valor is None and predicado.op in ("eq", "ne"):
+            valor = None
+        else:
+            valor = _valor_predicado(tipo_campo, campo, predicado.valor)
+        if _eh_referencia(campo) and predicado.op in ("eq", "ne", "in", "nin") and valor is not None:
+            # Algumas referências foram gravadas como str (ex. contrucao_id das
+            # obras), então a igualdade aceita os dois formatos
+            valores = valor if isinstance(valor, list) else [valor]
+            valor = [v for id in valores for v in (id, str(id))]
+            operador = "$in" if predicado.op in ("eq", "in") else "$nin"
+        condicoes = filtro.setdefault(campo, {})
+        if operador in condicoes:
+            raise HTTPException(
+                status_code=400,
+                detail=f"Operador {operador[1:]} repetido no campo {predicado.campo}.",
+            )
+        condicoes[operador] = valor
+
+    ordenacao = []
+    for item in consulta.ordenacao:
+        direcao = -1 if item.startswith("-") else 1
+        campo, _ = _campo_consulta(modelo, item.lstrip("-+"))
+        if any(c == campo for c, _ in ordenacao):
+            raise HTTPException(status_code=400, detail=f"Campo {item} repetido na ordenação.")
+        ordenacao.append((campo, direcao))
+    if not any(c == "_id" for c, _ in ordenacao):
+        ordenacao.append(("_id", 1))
+    return filtro, ordenacao
+
+
+def projecao_campos(tipo: str, campos: Optional[str]) -> Optional[dict]:
+    """Projeção a partir de uma lista de campos separados por vírgula."""
+    if not campos:
+        return None
+    modelo = map[tipo]["type"]
+    nomes = sorted({c.strip() for c in campos.split(",") if c.strip()})
+    projecao = {}
+    for nome in nomes:
+        if nome != "id" and tipo_do_campo(modelo, nome) is None:
+            raise HTTPException(status_code=400, detail=f"Campo {nome} não existe no modelo.")
+        # O servidor recusa um campo junto de um subcampo dele (endereco e
+        # endereco.cidade); o campo inteiro já inclui o subcampo
+        if nome != "id" and not any(nome.startswith(p + ".") for p in projecao):
+            projecao[nome] = 1
+    return projecao or {"_id": 1}
+
+
+def _resumo_plano(explicacao: dict) -> dict:
+    """Índices e estágios escolhidos pelo planejador, a partir do explain."""
+    planejador = explicacao.get("queryPlanner", {})
+    indices, estagios = [], []
+
+    def percorrer(no):
+        if isinstance(no, dict):
+            if "stage" in no:
+                estagios.append(no["stage"])
+            if "indexName" in no and no["indexName"] not in indices:
+                indices.append(no["indexName"])
+            for chave in ("queryPlan", "inputStage", "inputStages"):
+                if chave in no:
+                    percorrer(no[chave])
+        elif isinstance(no, list):
+            for item in no:
+                percorrer(item)
+
+    percorrer(planejador.get("winningPlan", {}))
+    resumo = {"indices": indices, "estagios": estagios}
+    estatisticas = explicacao.get("executionStats")
+    if estatisticas:
+        resumo["documentos_retornados"] = estatisticas.get("nReturned")
+        resumo["chaves_examinadas"] = estatisticas.get("totalKeysExamined")
+        resumo["documentos_examinados"] = estatisticas.get("totalDocsExamined")
+    return resumo
+
+
+async def consulta_estruturada(
+    tipo: str, consulta: Consulta, campos: Optional[str] = None, explicar: bool = False
+):
+    """Executa uma consulta com vários predicados, ordenação e projeção.
+
+    Com `explicar` a consulta não devolve documentos, e sim o filtro
+    compilado e o plano escolhido pelo servidor (índices e estágios).
+    """
+    if consulta.pagina < 1 or not 1 <= consulta.limite <= LIMITE_CONSULTA_MAXIMO:
+        raise HTTPException(
+            status_code=400,
+            detail=f"pagina deve ser maior que 0 e limite entre 1 e {LIMITE_CONSULTA_MAXIMO}.",
+        )
+    filtro, ordenacao = compilar_consulta(tipo, consulta)
+    projecao = projecao_campos(tipo, campos)
+    cursor = (
+        map[tipo]["collection"]
+        .find(filtro, projecao)
+        .sort(ordenacao)
+        .skip((consulta.pagina - 1) * consulta.limite)
+        .limit(consulta.limite)
+    )
+    if explicar:
+        plano = _resumo_plano(await cursor.explain())
+        return RespostaOrjson({"filtro": filtro, "ordenacao": ordenacao, **plano})
+    data = await cursor.to_list(length=consulta.limite)
+    modelo = map[tipo]["type"]
+    if projecao is None:
+        resultados = [modelo.documento_resposta(d) for d in data]
+    else:
+        # Só os campos pedidos, sem os padrões que o conversor completaria
+        resultados = [
+            {c: v for c, v in modelo.documento_resposta(d).items() if c == "id" or c in d}
+            for d in data
+        ]
+    return RespostaOrjson(
+        {"data": resultados, "pagina_atual": consulta.pagina, "limite": consulta.limite}
+    )
+
+
+def pipeline_gastos(tipo: str, detalhar: bool = False) -> list:
+    """Monta as etapas de agregação que somam o custo das obras abaixo do tipo informado.
+
+    Cada nível faz um $lookup no nível de baixo e soma os totais já calculados
+    por ele, então toda a árvore pessoa -> terrenos -> construções -> obras é
+    resolvida no servidor em uma única ida ao banco.
+    """
+    if tipo == "construcao":
+        return [
+            {
+                "$lookup": {
+                    "from": obras_collection.name,
+                    "localField": "obras_ids",
+                    "foreignField": "_id",
+                    "pipeline": [{"$project": {"custo": 1}}],
+                    "as": "obras",
+                }
+            },
+            {
+                "$project": {
+                    "gasto_total": {"$sum": "$obras.custo"},
+                    "quantidade_obras": {"$size": "$obras"},
+                }
+            },
+        ]
+
+    filhos = {
+        "terreno": ("construcao", construcao_collection, "construcoes_ids", "construcoes"),
+        "pessoa": ("terreno", terrenos_collection, "terrenos_ids", "terrenos"),
+    }
+    if tipo not in filhos:
+        raise ValueError(f"Tipo {tipo} não possui gastos com obras")
+    tipo_filho, colecao, campo_ids, nome = filhos[tipo]
+
+    projecao = {
+        "gasto_total": {"$sum": f"${nome}.gasto_total"},
+        "quantidade_obras": {"$sum": f"${nome}.quantidade_obras"},
+    }
+    if detalhar:
+        projecao[nome] = 1
+    return [
+        {
+            "$lookup": {
+                "from": colecao.name,
+                "localField": campo_ids,
+                "foreignField": "_id",
+                "pipeline": pipeline_gastos(tipo_filho, detalhar),
+                "as": nome,
+            }
+        },
+        {"$project": projecao},
+    ]
+
+
+def _formatar_gastos(doc: dict) -> dict:
+    """Converte o resultado de pipeline_gastos para um formato serializável."""
+    formatado = {
+        "id": str(doc["_id"]),
+        "gasto_total": doc.get("gasto_total", 0),
+        "quantidade_obras": doc.get("quantidade_obras", 0),
+    }
+    for nome in ("terrenos", "construcoes"):
+        if nome in doc:
+            formatado[nome] = [_formatar_gastos(d) for d in doc[nome]]
+    return formatado
+
+
+async def gasto_obras(tipo: str, id: str, detalhar: bool = False):
+    """Soma o custo de todas as obras abaixo do documento informado.
+
+    Sem detalhamento, lê os contadores materializados do próprio documento;
+    documentos antigos, que ainda não têm os contadores, caem na agregação.
+    Retorna None se o documento não existir.
+    """
+    validar_id(id)
+    if not detalhar:
+        doc = await buscar_por_id(tipo, id)
+        if doc is None:
+            return None
+        if "custo_total_obras" in doc:
+            return {
+                "id": id,
+                "gasto_total": doc["custo_total_obras"],
+                "quantidade_obras": doc.get("quantidade_obras", 0),
+            }
+    pipeline = [{"$match": {"_id": ObjectId(id)}}, *pipeline_gastos(tipo, detalhar)]
+    data = await map[tipo]["collection"].aggregate(pipeline).to_list(length=1)
+    if not data:
+        return None
+    return _formatar_gastos(data[0])
+
+
+def agora() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+def _inc_gastos(custo: float, quantidade: int) -> dict:
+    return {
+        "$inc": {"custo_total_obras": custo, "quantidade_obras": quantidade},
+        "$set": {"atualizado_em": agora()},
+    }
+
+
+async def propagar_gastos_terrenos(deltas: Dict[ObjectId, tuple], sessao=None):
+    """Soma (custo, quantidade) aos terrenos informados e às pessoas donas deles."""
+    deltas = {t: d for t, d in deltas.items() if d != (0, 0)}
+    if not deltas:
+        return
+    await terrenos_collection.bulk_write(
+        [UpdateOne({"_id": t}, _inc_gastos(*d)) for t, d in deltas.items()],
+        ordered=False,
+        session=sessao,
+    )
+    await pessoas_collection.bulk_write(
+        [UpdateMany({"terrenos_ids": t}, _inc_gastos(*d)) for t, d in deltas.items()],
+        ordered=False,
+        session=sessao,
+    )
+    await cache.invalidar("terreno", *deltas)
+    for terreno_id in deltas:
+        await cache.invalidar_referencias("pessoa", "terrenos_ids", terreno_id)
+
+
+async def propagar_gastos(deltas: Dict[ObjectId, tuple], sessao=None):
+    """Soma (custo, quantidade) às construções informadas e sobe a diferença
+    para os terrenos e pessoas acima delas com $inc atômicos."""
+    deltas = {c: d for c, d in deltas.items() if d != (0, 0)}
+    if not deltas:
+        return
+    construcoes = await construcao_collection.find(
+        {"_id": {"$in": list(deltas)}}, {"terreno_id": 1}, session=sessao
+    ).to_list()
+    await construcao_collection.bulk_write(
+        [UpdateOne({"_id": c}, _inc_gastos(*d)) for c, d in deltas.items()],
+        ordered=False,
+        session=sessao,
+    )
+    await cache.invalidar("construcao", *deltas)
+    por_terreno = defaultdict(lambda: (0, 0))
+    for construcao in construcoes:
+        if construcao.get("terreno_id") is None:
+            continue
+        terreno_id = ObjectId(construcao["terreno_id"])
+        custo, quantidade = deltas[construcao["_id"]]
+        atual = por_terreno[terreno_id]
+        por_terreno[terreno_id] = (atual[0] + custo, atual[1] + quantidade)
+    await propagar_gastos_terrenos(por_terreno, sessao)
+
+
+async def _comparar_contadores(tipo: str, calculados: list, corrigir: bool) -> int:
+    """Compara um lote de contadores recalculados com os guardados e retorna
+    quantos divergem, corrigindo-os se pedido."""
+    colecao = map[tipo]["collection"]
+    guardados = {
+        d["_id"]: d
+        async for d in colecao.find(
+            {"_id": {"$in": [c["_id"] for c in calculados]}},
+            {"custo_total_obras": 1, "quantidade_obras": 1},
+        )
+    }
+    correcoes = []
+    for calculado in calculados:
+        guardado = guardados.get(calculado["_id"], {})
+        custo = guardado.get("custo_total_obras")
+        quantidade = guardado.get("quantidade_obras")
+        if (
+            custo is not None
+            and abs(custo - calculado["gasto_total"]) <= 1e-6
+            and quantidade == calculado["quantidade_obras"]
+        ):
+            continue
+        logger.warning(
+            "Contador divergente em %s %s: guardado (%s, %s) calculado (%s, %s)",
+            tipo,
+            calculado["_id"],
+            custo,
+            quantidade,
+            calculado["gasto_total"],
+            calculado["quantidade_obras"],
+        )
+        correcoes.append(
+            UpdateOne(
+                {"_id": calculado["_id"]},
+                {
+                    "$set": {
+                        "custo_total_obras": calculado["gasto_total"],
+                        "quantidade_obras": calculado["quantidade_obras"],
+                        "atualizado_em": agora(),
+                    }
+                },
+            )
+        )
+    if corrigir and correcoes:
+        await colecao.bulk_write(correcoes, ordered=False)
+        await cache.invalidar(tipo, *(c["_id"] for c in calculados))
+    return len(correcoes)
+
+
+async def verificar_contadores(corrigir: bool = False, lote: int = 1000) -> dict:
+    """Recalcula os contadores de gasto a partir das obras e compara com os
+    valores guardados. Com corrigir=True, sobrescreve os que divergirem.
+
+    Retorna, por tipo, quantos documentos foram verificados e quantos divergiram.
+    """
+    relatorio = {}
+    for tipo in TIPOS_COM_GASTOS:
+        verificados = divergentes = 0
+        pendentes = []
+        cursor = map[tipo]["collection"].aggregate(pipeline_gastos(tipo), batchSize=lote)
+        async for calculado in cursor:
+            verificados += 1
+            pendentes.append(calculado)
+            if len(pendentes) >= lote:
+                divergentes += await _comparar_contadores(tipo, pendentes, corrigir)
+                pendentes = []
+        if pendentes:
+            divergentes += await _comparar_contadores(tipo, pendentes, corrigir)
+        relatorio[tipo] = {"verificados": verificados, "divergentes": divergentes}
+    return relatorio
+
+
+async def preencher_localizacoes(lote: int = 1000, todos: bool = False) -> dict:
+    """Grava a localização GeoJSON dos terrenos gravados antes de ela existir.
+
+    Com todos=True recalcula a de todos os terrenos. Terrenos com coordenadas
+    inválidas recebem localizacao nula e ficam fora das buscas geográficas.
+    """
+    filtro = {} if todos else {"localizacao": {"$exists": False}}
+    relatorio = {"verificados": 0, "sem_coordenadas": 0}
+    pendentes, ids_pendentes = [], []
+
+    async def enviar():
+        if pendentes:
+            await terrenos_collection.bulk_write(pendentes, ordered=False)
+            await cache.invalidar("terreno", *ids_pendentes)
+            pendentes.clear()
+            ids_pendentes.clear()
+
+    cursor = terrenos_collection.find(filtro, {"endereco": 1}).batch_size(lote)
+    async for terreno in cursor:
+        relatorio["verificados"] += 1
+        ponto = ponto_geojson(terreno.get("endereco") or {})
+        if ponto is None:
+            relatorio["sem_coordenadas"] += 1
+        pendentes.append(UpdateOne({"_id": terreno["_id"]}, {"$set": {"localizacao": ponto}}))
+        ids_pendentes.append(terreno["_id"])
+        if len(pendentes) >= lote:
+            await enviar()
+    await enviar()
+    logger.info("Localizações preenchidas: %s", relatorio)
+    return relatorio
+
+
+async def preencher_campos_busca(lote: int = 1000, todos: bool = False) -> dict:
+    """Grava os campos de busca (campos_busca) dos documentos gravados antes
+    de eles existirem. Com todos=True recalcula os de todos os documentos.
+
+    Retorna, por tipo, quantos documentos foram atualizados."""
+    relatorio = {}
+    for tipo in map:
+        colecao = map[tipo]["collection"]
+        campos = {c.split(".")[0] for c in CAMPOS_PREFIXO[tipo] + CAMPOS_TEXTO[tipo]}
+        filtro = {} if todos else {campo_chaves(CAMPOS_TEXTO[tipo][0]): {"$exists": False}}
+        pendentes, ids_pendentes = [], []
+        relatorio[tipo] = 0
+
+        async def enviar():
+            if pendentes:
+                await colecao.bulk_write(pendentes, ordered=False)
+                await cache.invalidar(tipo, *ids_pendentes)
+                pendentes.clear()
+                ids_pendentes.clear()
+
+        cursor = colecao.find(filtro, {campo: 1 for campo in campos}).batch_size(lote)
+        async for doc in cursor:
+            relatorio[tipo] += 1
+            pendentes.append(UpdateOne({"_id": doc["_id"]}, {"$set": campos_busca(tipo, doc)}))
+            ids_pendentes.append(doc["_id"])
+            if len(pendentes) >= lote:
+                await enviar()
+        await enviar()
+    logger.info("Campos de busca preenchidos: %s", relatorio)
+    return relatorio
+
+
+# Resultados por página nas buscas por localização
+LIMITE_GEO = 50
+LIMITE_GEO_MAXIMO = 500
+
+
+def validar_coordenadas(longitude: float, latitude: float):
+    if not (-180 <= longitude <= 180 and -90 <= latitude <= 90):
+        raise HTTPException(
+            status_code=400,
+            detail="Coordenadas inválidas: longitude entre -180 e 180, latitude entre -90 e 90.",
+        )
+
+
+async def busca_proximidade(
+    tipo: str,
+    longitude: float,
+    latitude: float,
+    consulta: dict,
+    raio_m: Optional[float] = None,
+    pagina: int = 1,
+    limite: int = LIMITE_GEO,
+    campo: str = "localizacao",
+):
+    """Documentos do tipo ordenados pela distância ao ponto, com a distância
+    em metros em `distancia_m`.
+
+    Usa $geoNear sobre o índice 2dsphere do campo; `consulta` é aplicada junto
+    com a busca geográfica (pode conter um $geoWithin) e `raio_m` limita a
+    distância máxima.
+    """
+    validar_coordenadas(longitude, latitude)
+    if pagina < 1 or not 1 <= limite <= LIMITE_GEO_MAXIMO:
+        raise HTTPException(
+            status_code=400,
+            detail=f"pagina deve ser maior que 0 e limite entre 1 e {LIMITE_GEO_MAXIMO}.",
+        )
+    etapa = {
+        "near": {"type": "Point", "coordinates": [longitude, latitude]},
+        "distanceField": "distancia_m",
+        "key": campo,
+        "spherical": True,
+        "query": consulta,
+    }
+    if raio_m is not None:
+        etapa["maxDistance"] = raio_m
+    pipeline = [{"$geoNear": etapa}, {"$skip": (pagina - 1) * limite}, {"$limit": limite}]
+    docs = await map[tipo]["collection"].aggregate(pipeline).to_list(length=limite)
+    modelo = map[tipo]["type"]
+    data = [{**modelo.documento_resposta(d), "distancia_m": d["distancia_m"]} for d in docs]
+    return RespostaOrjson({"data": data, "pagina_atual": pagina, "limite": limite})
+
+
+def codificar_cursor(ultimo_id: ObjectId) -> str:
+    """Gera o token opaco que aponta para o documento seguinte ao informado."""
+    return base64.urlsafe_b64encode(json.dumps({"id": str(ultimo_id)}).encode()).decode()
+
+
+def decodificar_cursor(token: str) -> ObjectId:
+    try:
+        return ObjectId(json.loads(base64.urlsafe_b64decode(token.encode()))["id"])
+    except (ValueError, KeyError, TypeError, InvalidId):
+        logger.warning("Cursor de paginação inválido: %s", token)
+        raise HTTPException(status_code=400, detail="Cursor de paginação inválido.")
+
+
+async def paginacao(
+    tipo: str,
+    pagina: int = 1,
+    limite: int = 10,
+    after: Optional[str] = None,
+    contar: Optional[bool] = None,
+):
+    """Pagina os documentos do tipo em ordem de _id.
+
+    Com `after` (token devolvido em `proximo` pela página anterior) a leitura é
+    uma consulta por intervalo no índice de _id, com o mesmo custo para qualquer
+    página. Sem ele, mantém o modo antigo por número de página com skip.
+    O total de páginas vem de estimated_document_count e, no modo cursor, só é
+    calculado se `contar` for verdadeiro.
+    """
     if pagina < 1 or limite < 1:
-        logging.info(
+        logger.info(
             "Paginação não foi concluida pois os valores de pagina ou limite são menores que 1"
         )
         raise HTTPException(
             status_code=400, detail="Valores precisam ser inteiros maiores que 0"
         )
-    skip = (pagina - 1) * limite
-    cursor = map[tipo]["collection"].find().skip(skip).limit(limite)
-    data = await cursor.to_list(length=limite)
-    to_return = [map[tipo]["type"].from_mongo(d) for d in data]
-    total_paginas = math.ceil((await quantidade_total_ocorrencias(tipo)) / limite)
-    return {"data": to_return, "pagina_atual": pagina, "total_paginas": total_paginas}
+    colecao = map[tipo]["collection"]
+    if after is not None:
+        cursor = colecao.find({"_id": {"$gt": decodificar_cursor(after)}})
+        contar = bool(contar)
+    else:
+        cursor = colecao.find().skip((pagina - 1) * limite)
+        contar = contar is not False
+    data = await cursor.sort("_id", 1).limit(limite).to_list(length=limite)
+    to_return = [map[tipo]["type"].documento_resposta(d) for d in data]
+    resposta = {
+        "data": to_return,
+        "proximo": codificar_cursor(data[-1]["_id"]) if len(data) == limite else None,
+    }
+    if after is None:
+        resposta["pagina_atual"] = pagina
+    if contar:
+        resposta["total_paginas"] = math.ceil(
+            (await colecao.estimated_document_count()) / limite
+        )
+    return RespostaOrjson(resposta)
 
 
 async def listar(tipo: str):
-    logging.info("UTILS listar")
+    logger.info("UTILS listar")
     try:
         data = await map[tipo]["collection"].find().to_list()
-        return [map[tipo]["type"].from_mongo(d) for d in data]
+        modelo = map[tipo]["type"]
+        return RespostaOrjson([modelo.documento_resposta(d) for d in data])
     except Exception as e:
-        logging.info(f"Erro ao listar atributos no utils. Error: {e}")
+        logger.info("Erro ao listar atributos no utils. Error: %s", e)
         raise HTTPException(
             status_code=400, detail=f"Erro ao listar atributos no utils. Error: {e}"
         )
 
 
-async def criar(tipo: str, data):
-    result = await map[tipo]["collection"].insert_one(data.model_dump())
+# Tamanho dos lotes pedidos ao cursor e de documentos por pedaço enviado
+TAMANHO_LOTE_STREAM = 500
+DOCUMENTOS_POR_PEDACO = 100
+
+
+async def listar_stream(tipo: str, formato: str = "ndjson"):
+    """Gera os documentos do tipo já serializados, conforme chegam do cursor.
+
+    `formato` pode ser "ndjson" (um documento por linha) ou "json" (um array
+    JSON enviado em pedaços). Nunca guarda mais que um pedaço em memória.
+    """
+    modelo = map[tipo]["type"]
+    cursor = map[tipo]["collection"].find().batch_size(TAMANHO_LOTE_STREAM)
+    separador = b"\n" if formato == "ndjson" else b","
+    pedaco = []
+    primeiro = True
+    if formato == "json":
+        yield b"["
+    try:
+        async for d in cursor:
+            pedaco.append(serializar(modelo.documento_resposta(d)))
+            if len(pedaco) >= DOCUMENTOS_POR_PEDACO:
+                yield _juntar_pedaco(pedaco, separador, primeiro, formato)
+                pedaco = []
+                primeiro = False
+        if pedaco:
+            yield _juntar_pedaco(pedaco, separador, primeiro, formato)
+    except Exception as e:
+        # O status já foi enviado, então só resta registrar e encerrar
+        logger.error("Erro ao transmitir documentos do tipo %s: %s", tipo, e)
+        raise
+    if formato == "json":
+        yield b"]"
+
+
+def _juntar_pedaco(pedaco: list, separador: bytes, primeiro: bool, formato: str) -> bytes:
+    corpo = separador.join(pedaco)
+    if formato == "ndjson":
+        return corpo + separador
+    return corpo if primeiro else separador + corpo
+
+
+def resposta_stream(tipo: str, formato: str) -> StreamingResponse:
+    media_type = "application/x-ndjson" if formato == "ndjson" else "application/json"
+    return StreamingResponse(listar_stream(tipo, formato), media_type=media_type)
+
+
+def campos_derivados(tipo: str, campos: dict) -> dict:
+    """Campos calculados a partir dos gravados, que precisam ser escritos
+    junto com eles (ex. a localização GeoJSON do endereço do terreno).
+
+    Toda escrita marca `atualizado_em`, usado pela atualização incremental
+    das análises (analises.py)."""
+    derivados = {"atualizado_em": agora()}
+    if tipo == "terreno" and "endereco" in campos:
+        derivados["localizacao"] = ponto_geojson(campos["endereco"])
+    derivados.update(campos_busca(tipo, campos))
+    return derivados
+
+
+def campos_busca(tipo: str, campos: dict) -> dict:
+    """Cópias normalizadas dos campos de CAMPOS_PREFIXO e chaves das palavras
+    dos de CAMPOS_TEXTO presentes em `campos`, usadas por busca_parcial."""
+    derivados = {}
+    for campo in CAMPOS_PREFIXO[tipo]:
+        if campo.split(".")[0] in campos:
+            derivados[campo_normalizado(campo)] = normalizar(_texto_do_campo(campos, campo))
+    for campo in CAMPOS_TEXTO[tipo]:
+        if campo.split(".")[0] in campos:
+            derivados[campo_chaves(campo)] = sorted(chaves_campo(_texto_do_campo(campos, campo)))
+    return derivados
+
+
+async def criar(tipo: str, data, **campos):
+    """Insere o modelo; `campos` sobrescreve valores do documento gravado,
+    ex. para guardar uma referência como ObjectId."""
+    documento = data.model_dump()
+    documento.update(campos)
+    documento.update(campos_derivados(tipo, documento))
+    if tipo in TIPOS_COM_GASTOS:
+        documento.update(custo_total_obras=0, quantidade_obras=0)
+    result = await map[tipo]["collection"].insert_one(documento)
     return str(result.inserted_id)
 
 
-async def atualizar(tipo: str, id: str, data):
-    validar_id(id)
-    result = await map[tipo]["collection"].update_one(
-        {"_id": ObjectId(id)}, {"$set": data.model_dump()}
+# Quantidade de documentos por chamada de insert_many nas criações em lote
+TAMANHO_LOTE_INSERCAO = 1000
+
+
+def validar_lote(modelo: Type[BaseModel], itens: List[dict]):
+    """Valida cada item do lote contra o modelo.
+
+    Retorna os itens válidos e as mensagens de erro, ambos indexados pela
+    posição do item no lote.
+    """
+    validos, erros = {}, {}
+    for indice, item in enumerate(itens):
+        try:
+            validos[indice] = modelo.model_validate(item)
+        except ValidationError as e:
+            erros[indice] = "; ".join(
+                f"{'.'.join(str(l) for l in erro['loc'])}: {erro['msg']}"
+                for erro in e.errors()
+            )
+    return validos, erros
+
+
+async def buscar_por_ids(tipo: str, ids, projecao: Optional[dict] = None) -> Dict[ObjectId, dict]:
+    """Busca vários documentos com uma única consulta $in, ignorando ids inválidos."""
+    object_ids = {ObjectId(i) for i in ids if ObjectId.is_valid(i)}
+    if not object_ids:
+        return {}
+    cursor = map[tipo]["collection"].find({"_id": {"$in": list(object_ids)}}, projecao)
+    return {d["_id"]: d async for d in cursor}
+
+
+async def inserir_em_lote(
+    tipo: str, documentos: Dict[int, dict], tamanho_lote: int = TAMANHO_LOTE_INSERCAO
+):
+    """Insere os documentos com insert_many não ordenado, em pedaços.
+
+    Os _id são gerados antes do envio, então uma falha em um documento não
+    impede os demais nem embaralha os ids devolvidos. Retorna os ids e os
+    erros indexados pela posição original de cada documento.
+    """
+    if tamanho_lote < 1:
+        raise HTTPException(status_code=400, detail="tamanho_lote precisa ser maior que 0")
+    ids, erros = {}, {}
+    indices = list(documentos)
+    for inicio in range(0, len(indices), tamanho_lote):
+        pedaco = indices[inicio : inicio + tamanho_lote]
+        for indice in pedaco:
+            documentos[indice].setdefault("_id", ObjectId())
+            documentos[indice].update(campos_derivados(tipo, documentos[indice]))
+            if tipo in TIPOS_COM_GASTOS:
+                documentos[indice].update(custo_total_obras=0, quantidade_obras=0)
+        try:
+            await map[tipo]["collection"].insert_many(
+                [documentos[i] for i in pedaco], ordered=False
+            )
+        except BulkWriteError as e:
+            for erro in e.details.get("writeErrors", []):
+                erros[pedaco[erro["index"]]] = erro.get("errmsg", "Erro ao inserir")
+        for indice in pedaco:
+            if indice not in erros:
+                ids[indice] = documentos[indice]["_id"]
+    logger.info("Lote de %s: %s inseridos, %s com erro", tipo, len(ids), len(erros))
+    return ids, erros
+
+
+def resultado_lote(total: int, ids: Dict[int, ObjectId], erros: Dict[int, str]) -> dict:
+    resultados = []
+    for indice in range(total):
+        if indice in ids:
+            resultados.append({"indice": indice, "id": str(ids[indice])})
+        else:
+            resultados.append({"indice": indice, "erro": erros.get(indice, "Não inserido")})
+    return {"inseridos": len(ids), "erros": total - len(ids), "resultados": resultados}
+
+
+async def criar_em_lote(
+    tipo: str, modelo: Type[BaseModel], itens: List[dict], tamanho_lote: int = TAMANHO_LOTE_INSERCAO
+):
+    """Cria em lote documentos sem referência a outro tipo (pessoas e terrenos)."""
+    validos, erros = validar_lote(modelo, itens)
+    ids, erros_insercao = await inserir_em_lote(
+        tipo, {i: v.model_dump() for i, v in validos.items()}, tamanho_lote
     )
+    return resultado_lote(len(itens), ids, {**erros, **erros_insercao})
 
-    if result.modified_count != 1:
-        raise HTTPException(
-            detail=str(map[tipo]["type"].__name__) + " not found", status_code=404
+
+def _nao_encontrado(tipo: str) -> HTTPException:
+    return HTTPException(
+        detail=str(map[tipo]["type"].__name__) + " not found", status_code=404
+    )
+
+
+# Campos de cada tipo que decidem o grupo do documento em alguma análise,
+# registrados por analises.py. A atualização incremental das análises só
+# enxerga os documentos escritos depois da última execução; um documento
+# excluído, ou que muda de grupo, também precisa recalcular o grupo em que
+# estava. Por isso os valores antigos desses campos são guardados em
+# analises_saidas antes da exclusão ou da mudança.
+CAMPOS_GRUPO_ANALISES: Dict[str, set] = defaultdict(set)
+saidas_collection = ColecaoPreguicosa("analises_saidas")
+
+
+async def registrar_saidas(tipo: str, filtro: dict, novos: Optional[dict] = None, sessao=None):
+    """Guarda os campos de grupo dos documentos do filtro em analises_saidas.
+
+    Com `novos` (os campos de um $set), só guarda os documentos em que algum
+    campo de grupo muda."""
+    campos = CAMPOS_GRUPO_ANALISES.get(tipo)
+    if not campos or (novos is not None and not campos & novos.keys()):
+        return
+    docs = await map[tipo]["collection"].find(
+        filtro, {campo: 1 for campo in campos}, session=sessao
+    ).to_list(None)
+    if novos is not None:
+        alterados = campos & novos.keys()
+        docs = [d for d in docs if any(d.get(c) != novos[c] for c in alterados)]
+    if docs:
+        em = agora()
+        await saidas_collection.insert_many(
+            [{"tipo": tipo, "documento": d, "em": em} for d in docs], session=sessao
         )
 
-    data_atualizada = await map[tipo]["collection"].find_one({"_id": ObjectId(id)})
 
-    if data_atualizada is None:
-        raise HTTPException(
-            detail=str(map[tipo]["type"].__name__) + " not found", status_code=404
+async def atualizar_documento(
+    tipo: str,
+    id: str,
+    campos: dict,
+    retorno: ReturnDocument = ReturnDocument.AFTER,
+    projecao: Optional[List[str]] = None,
+) -> dict:
+    """Aplica $set com find_one_and_update e devolve o documento bruto, em uma
+    única ida ao banco. Um documento inexistente gera 404; um update que não
+    muda nada devolve o documento normalmente."""
+    validar_id(id)
+    if projecao is not None:
+        projecao = {campo: 1 for campo in projecao}
+    if campos:
+        await registrar_saidas(tipo, {"_id": ObjectId(id)}, campos)
+        documento = await map[tipo]["collection"].find_one_and_update(
+            {"_id": ObjectId(id)},
+            {"$set": {**campos, **campos_derivados(tipo, campos)}},
+            projection=projecao,
+            return_document=retorno,
         )
+    else:
+        documento = await map[tipo]["collection"].find_one({"_id": ObjectId(id)}, projecao)
+    if documento is None:
+        raise _nao_encontrado(tipo)
+    if campos:
+        await cache.invalidar(tipo, id)
+    return documento
+
 
-    return map[tipo]["type"].from_mongo(data_atualizada)
+def _resposta_atualizacao(tipo: str, documento: dict, projecao: Optional[List[str]]):
+    if projecao is None:
+        return map[tipo]["type"].from_mongo(documento)
+    # Com projeção o documento é parcial e não forma um modelo completo
+    resposta = map[tipo]["type"].documento_resposta(documento)
+    return {c: v for c, v in resposta.items() if c == "id" or c in documento}
+
+
+async def atualizar(tipo: str, id: str, data, projecao: Optional[List[str]] = None):
+    documento = await atualizar_documento(
+        tipo, id, data.model_dump(), projecao=projecao
+    )
+    return _resposta_atualizacao(tipo, documento, projecao)
 
 
 async def deletar(tipo: str, id: str):
@@ -151,30 +1479,14 @@ async def deletar(tipo: str, id: str):
     result = await map[tipo]["collection"].delete_one({"_id": ObjectId(id)})
 
     if result.deleted_count != 1:
-        raise HTTPException(
-            detail=str(map[tipo]["type"].__name__) + " not found", status_code=404
-        )
+        raise _nao_encontrado(tipo)
+    await cache.invalidar(tipo, id)
 
     return {"msg": "deleted"}
 
 
-async def patch(tipo: str, id: str, data):
-    validar_id(id)
-    update_data = data.model_dump(exclude_none=True)
-    result = await map[tipo]["collection"].update_one(
-        {"_id": ObjectId(id)}, {"$set": update_data}
+async def patch(tipo: str, id: str, data, projecao: Optional[List[str]] = None):
+    documento = await atualizar_documento(
+        tipo, id, data.model_dump(exclude_none=True), projecao=projecao
     )
-
-    if result.modified_count != 1:
-        raise HTTPException(
-            detail=str(map[tipo]["type"].__name__) + " not found", status_code=404
-        )
-
-    data_atualizada = await map[tipo]["collection"].find_one({"_id": ObjectId(id)})
-
-    if data_atualizada is None:
-        raise HTTPException(
-            detail=str(map[tipo]["type"].__name__) + " not found", status_code=404
-        )
-
-    return map[tipo]["type"].from_mongo(data_atualizada)
+    return _resposta_atualizacao(tipo, documento, projecao)
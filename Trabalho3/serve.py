@@ -0,0 +1,73 @@
+"""Sobe a aplicação com vários processos.
+
+Uso:
+    python serve.py                      # um worker por núcleo disponível
+    python serve.py --workers 4 --port 8000
+
+Cada worker é um processo novo (spawn) que importa main:app por conta
+própria; o cliente do MongoDB é criado no lifespan de cada um, então nenhum
+socket é compartilhado entre processos. Com mais de um worker o cache de
+entidades em memória fica desligado (CACHE_ENTIDADES=desligado), porque a
+invalidação de um worker não chega aos outros.
+
+Para recarregar sem derrubar o serviço, envie SIGHUP ao processo principal:
+os workers são trocados um a um e cada um termina as requisições em andamento
+(até --tempo-drenagem segundos) antes de sair. SIGTERM/SIGINT drenam e param.
+"""
+
+import argparse
+import os
+
+import uvicorn
+
+
+def workers_padrao() -> int:
+    """Núcleos disponíveis para este processo (respeita afinidade de CPU)."""
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default=os.getenv("HOST", "0.0.0.0"))
+    parser.add_argument("--port", type=int, default=int(os.getenv("PORT", "8000")))
+    parser.add_argument(
+        "--workers", type=int, default=int(os.getenv("WORKERS", "0")) or workers_padrao()
+    )
+    parser.add_argument(
+        "--tempo-drenagem",
+        type=int,
+        default=30,
+        help="Segundos para terminar as requisições em andamento ao desligar",
+    )
+    parser.add_argument(
+        "--max-requisicoes",
+        type=int,
+        default=None,
+        help="Reinicia cada worker depois desse número de requisições",
+    )
+    args = parser.parse_args()
+
+    # Vários processos gravando e rotacionando o mesmo arquivo se atropelam,
+    # então cada worker grava no seu. O cache de entidades em memória é de
+    # cada processo e a invalidação só alcança o worker que fez a escrita,
+    # então ele é desligado (ver routers.utils.BACKENDS_CACHE)
+    if args.workers > 1:
+        os.environ.setdefault("LOG_ARQUIVO", "app-{pid}.log")
+        os.environ.setdefault("CACHE_ENTIDADES", "desligado")
+
+    uvicorn.run(
+        "main:app",
+        host=args.host,
+        port=args.port,
+        workers=args.workers,
+        timeout_graceful_shutdown=args.tempo_drenagem,
+        limit_max_requests=args.max_requisicoes,
+        access_log=False,
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,136 @@
+"""Os testes rodam a aplicação sobre o banco em memória (BACKEND=memoria),
+recriado a cada teste, e fazem as requisições em processo pelo httpx."""
+
+import os
+import sys
+from pathlib import Path
+
+os.environ["BACKEND"] = "memoria"
+os.environ.setdefault("LOG_ARQUIVO", os.devnull)
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import httpx
+import pytest
+from bson import ObjectId
+
+import db
+from indices import aplicar_indices
+from main import app
+from routers.utils import CacheMemoria, cache, map
+
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
+
+
+@pytest.fixture
+async def cliente():
+    db.fechar()
+    cache.backend = CacheMemoria()
+    await aplicar_indices()
+    transporte = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transporte, base_url="http://teste") as c:
+        yield c
+    db.fechar()
+
+
+async def documento(tipo: str, id) -> dict:
+    return await map[tipo]["collection"].find_one({"_id": ObjectId(id)})
+
+
+def endereco(cidade: str = "Natal") -> dict:
+    return {
+        "rua": "Rua A",
+        "numero": 1,
+        "cidade": cidade,
+        "estado": "RN",
+        "cep": "59000-000",
+        "longitude": "-35.2",
+        "latitude": "-5.8",
+    }
+
+
+class Fabrica:
+    """Cria entidades pelos endpoints e devolve os ids."""
+
+    def __init__(self, cliente: httpx.AsyncClient):
+        self.cliente = cliente
+        self.sequencia = 0
+
+    def _nome(self, prefixo: str) -> str:
+        self.sequencia += 1
+        return f"{prefixo} {self.sequencia}"
+
+    async def pessoa(self) -> str:
+        r = await self.cliente.post(
+            "/pessoas/",
+            json={
+                "nome": self._nome("Pessoa"),
+                "email": f"p{self.sequencia}@exemplo.com",
+                "idade": 30,
+                "telefone": "84999999999",
+                "profissao": "engenheira",
+            },
+        )
+        assert r.status_code == 201, r.text
+        return r.json()["data"]
+
+    async def terreno(self, pessoa_id: str = None) -> str:
+        r = await self.cliente.post(
+            "/terrenos/",
+            json={
+                "largura": 10,
+                "altua": 20,
+                "disponivel": True,
+                "preco": 1000,
+                "descricao": self._nome("Terreno"),
+                "endereco": endereco(),
+            },
+        )
+        assert r.status_code == 200, r.text
+        terreno_id = r.json()
+        if pessoa_id is not None:
+            r = await self.cliente.post(f"/pessoas/{pessoa_id}/adicionar-terreno/{terreno_id}")
+            assert r.status_code == 200, r.text
+        return terreno_id
+
+    def corpo_construcao(self, terreno_id: str) -> dict:
+        return {
+            "nome": self._nome("Construção"),
+            "descricao": "casa térrea",
+            "custo_total": 500,
+            "tipo": "casa",
+            "area": 80,
+            "terreno_id": terreno_id,
+        }
+
+    async def construcao(self, terreno_id: str) -> str:
+        r = await self.cliente.post("/contrucoes/", json=self.corpo_construcao(terreno_id))
+        assert r.status_code == 200, r.text
+        return r.json()
+
+    def corpo_obra(self, construcao_id: str, custo: float) -> dict:
+        return {
+            "nome": self._nome("Obra"),
+            "descricao": "fundação",
+            "inicio": "2024-01-10T00:00:00",
+            "custo": custo,
+            "contrucao_id": construcao_id,
+        }
+
+    async def obra(self, construcao_id: str, custo: float) -> str:
+        corpo = self.corpo_obra(construcao_id, custo)
+        r = await self.cliente.post("/obras/", json=corpo)
+        assert r.status_code == 200, r.text
+        obra = await map["obra"]["collection"].find_one({"nome": corpo["nome"]})
+        return str(obra["_id"])
+
+
+@pytest.fixture
+def fabrica(cliente) -> Fabrica:
+    return Fabrica(cliente)
+
+
+def gastos(doc: dict) -> tuple:
+    return (doc.get("custo_total_obras", 0), doc.get("quantidade_obras", 0))
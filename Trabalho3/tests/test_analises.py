@@ -0,0 +1,75 @@
+import pytest
+
+from conftest import endereco
+
+pytestmark = pytest.mark.anyio
+
+
+async def atualizar(cliente, completo: bool = False) -> list:
+    r = await cliente.post("/analises/atualizar", params={"completo": completo})
+    assert r.status_code == 200, r.text
+    return r.json()
+
+
+async def terrenos_por_cidade(cliente) -> dict:
+    r = await cliente.get("/analises/locais")
+    assert r.status_code == 200, r.text
+    return {d["cidade"]: d["terrenos"] for d in r.json()}
+
+
+async def test_incremental_recalcula_o_grupo_de_origem(fabrica):
+    cliente = fabrica.cliente
+    natal = [await fabrica.terreno() for _ in range(2)]
+    await atualizar(cliente, completo=True)
+    assert await terrenos_por_cidade(cliente) == {"Natal": 2}
+
+    corpo = {
+        "largura": 10,
+        "altua": 20,
+        "disponivel": True,
+        "preco": 1000,
+        "descricao": "lote",
+        "endereco": endereco("Recife"),
+    }
+    r = await cliente.put(f"/terrenos/{natal[0]}", json=corpo)
+    assert r.status_code == 200, r.text
+    relatorios = await atualizar(cliente)
+    assert {r["modo"] for r in relatorios} == {"incremental"}
+    assert await terrenos_por_cidade(cliente) == {"Natal": 1, "Recife": 1}
+
+    r = await cliente.delete(f"/terrenos/{natal[1]}")
+    assert r.status_code == 200, r.text
+    await atualizar(cliente)
+    assert await terrenos_por_cidade(cliente) == {"Recife": 1}
+
+
+async def test_exclusao_em_cascata_sai_dos_grupos_dos_descendentes(fabrica):
+    cliente = fabrica.cliente
+    terreno = await fabrica.terreno()
+    await fabrica.obra(await fabrica.construcao(terreno), 100)
+    await atualizar(cliente, completo=True)
+    r = await cliente.get("/analises/construcoes-por-tipo")
+    assert [(d["tipo"], d["construcoes"]) for d in r.json()] == [("casa", 1)]
+    r = await cliente.get("/analises/obras-por-mes")
+    assert [(d["mes"], d["gasto"]) for d in r.json()] == [("2024-01", 100)]
+
+    r = await cliente.delete(f"/terrenos/{terreno}")
+    assert r.status_code == 200, r.text
+    await atualizar(cliente)
+    assert (await cliente.get("/analises/construcoes-por-tipo")).json() == []
+    assert (await cliente.get("/analises/obras-por-mes")).json() == []
+
+
+async def test_mudanca_de_mes_da_obra(fabrica):
+    cliente = fabrica.cliente
+    construcao = await fabrica.construcao(await fabrica.terreno())
+    obra = await fabrica.obra(construcao, 60)
+    await atualizar(cliente, completo=True)
+
+    r = await cliente.patch(
+        "/obras/", params={"obra_id": obra}, json={"inicio": "2024-03-05T00:00:00"}
+    )
+    assert r.status_code == 200, r.text
+    await atualizar(cliente)
+    r = await cliente.get("/analises/obras-por-mes")
+    assert [(d["mes"], d["gasto"]) for d in r.json()] == [("2024-03", 60)]
@@ -0,0 +1,121 @@
+import re
+
+import pytest
+
+import memoria
+from conftest import endereco
+from texto import normalizar, termos_busca
+
+pytestmark = pytest.mark.anyio
+
+
+def radical_snowball(palavra: str) -> str:
+    # Como o Snowball, reduz construir, construção e construções a constru,
+    # o que texto.radical não faz
+    return palavra[:7]
+
+
+def palavras_snowball(texto: str):
+    return [radical_snowball(p) for p in re.findall(r"\w+", normalizar(texto))]
+
+
+def termos_snowball(busca: str):
+    termos, negados, frases = termos_busca(busca)
+    return {radical_snowball(t) for t in termos}, negados, frases
+
+
+async def criar_construcao(fabrica, terreno: str, nome: str, descricao: str) -> str:
+    corpo = {**fabrica.corpo_construcao(terreno), "nome": nome, "descricao": descricao}
+    r = await fabrica.cliente.post("/contrucoes/", json=corpo)
+    assert r.status_code == 200, r.text
+    return r.json()
+
+
+async def buscar(cliente, rota: str, **params) -> list:
+    r = await cliente.get(f"{rota}/filter/", params=params)
+    assert r.status_code == 200, r.text
+    return r.json()["data"]
+
+
+async def test_texto_restrito_ao_campo_com_o_radical_do_servidor(fabrica, monkeypatch):
+    monkeypatch.setattr(memoria, "palavras", palavras_snowball)
+    monkeypatch.setattr(memoria, "termos_busca", termos_snowball)
+    terreno = await fabrica.terreno()
+    no_nome = await criar_construcao(fabrica, terreno, "Construção do galpão", "galpão")
+    await criar_construcao(fabrica, terreno, "Reforma", "construir o muro")
+
+    data = await buscar(
+        fabrica.cliente, "/contrucoes", atributo="nome", busca="construir", modo="texto"
+    )
+    assert [c["id"] for c in data] == [no_nome]
+
+
+async def test_texto_paginado(fabrica):
+    terreno = await fabrica.terreno()
+    for i in range(5):
+        await criar_construcao(fabrica, terreno, f"Casa {i}", "térrea")
+    await criar_construcao(fabrica, terreno, "Galpão", "casas geminadas")
+
+    paginas = [
+        await buscar(
+            fabrica.cliente,
+            "/contrucoes",
+            atributo="nome",
+            busca="casas",
+            modo="texto",
+            pagina=pagina,
+            limite=2,
+        )
+        for pagina in (1, 2, 3)
+    ]
+    assert [len(p) for p in paginas] == [2, 2, 1]
+    assert {c["nome"] for p in paginas for c in p} == {f"Casa {i}" for i in range(5)}
+
+
+async def test_prefixo_ignora_maiusculas_e_acentos(fabrica):
+    for cidade in ("Fortaleza", "Foz do Iguaçu", "São Paulo", "Natal"):
+        r = await fabrica.cliente.post(
+            "/terrenos/",
+            json={
+                "largura": 10,
+                "altua": 20,
+                "disponivel": True,
+                "preco": 1000,
+                "descricao": "lote",
+                "endereco": endereco(cidade),
+            },
+        )
+        assert r.status_code == 200, r.text
+
+    async def cidades(busca: str) -> list:
+        data = await buscar(
+            fabrica.cliente, "/terrenos", atributo="endereco.cidade", busca=busca, modo="prefixo"
+        )
+        return [t["endereco"]["cidade"] for t in data]
+
+    assert await cidades("forta") == ["Fortaleza"]
+    assert await cidades("FO") == ["Fortaleza", "Foz do Iguaçu"]
+    assert await cidades("sao p") == ["São Paulo"]
+    assert await cidades("fo.") == []
+
+
+async def test_prefixo_acompanha_atualizacao(fabrica):
+    terreno = await fabrica.terreno()
+    construcao = await criar_construcao(fabrica, terreno, "Galpão", "depósito")
+    r = await fabrica.cliente.patch(f"/contrucoes/{construcao}", json={"nome": "Oficina"})
+    assert r.status_code == 200, r.text
+
+    assert await buscar(
+        fabrica.cliente, "/contrucoes", atributo="nome", busca="galp", modo="prefixo"
+    ) == []
+    data = await buscar(
+        fabrica.cliente, "/contrucoes", atributo="nome", busca="ofi", modo="prefixo"
+    )
+    assert [c["id"] for c in data] == [construcao]
+
+
+async def test_prefixo_em_campo_sem_indice(cliente):
+    r = await cliente.get(
+        "/contrucoes/filter/", params={"atributo": "terreno_id", "busca": "a", "modo": "prefixo"}
+    )
+    assert r.status_code == 400
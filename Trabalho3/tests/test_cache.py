@@ -0,0 +1,86 @@
+import pytest
+from bson import ObjectId
+
+from routers.utils import (
+    CacheDesligado,
+    CacheEntidades,
+    CacheMemoria,
+    backend_cache,
+    buscar_por_id,
+    map,
+)
+
+pytestmark = pytest.mark.anyio
+
+
+async def excluir_em_outro_worker(tipo: str, id: str):
+    """Exclui direto na coleção, sem invalidar o cache deste processo, como
+    acontece quando a exclusão é feita por outro worker."""
+    assert await buscar_por_id(tipo, id) is not None
+    await map[tipo]["collection"].delete_one({"_id": ObjectId(id)})
+    assert await buscar_por_id(tipo, id) is not None
+
+
+async def test_obra_em_construcao_excluida_por_outro_worker(fabrica):
+    construcao = await fabrica.construcao(await fabrica.terreno())
+    await excluir_em_outro_worker("construcao", construcao)
+
+    r = await fabrica.cliente.post("/obras/", json=fabrica.corpo_obra(construcao, 10))
+    assert r.status_code == 404
+    assert await map["obra"]["collection"].count_documents({}) == 0
+
+
+async def test_construcao_movida_para_terreno_excluido_por_outro_worker(fabrica):
+    construcao = await fabrica.construcao(await fabrica.terreno())
+    terreno = await fabrica.terreno()
+    await excluir_em_outro_worker("terreno", terreno)
+
+    r = await fabrica.cliente.put(
+        f"/contrucoes/{construcao}", json=fabrica.corpo_construcao(terreno)
+    )
+    assert r.status_code == 404
+
+
+async def test_vinculo_com_pessoa_excluida_por_outro_worker(fabrica):
+    pessoa = await fabrica.pessoa()
+    terreno = await fabrica.terreno()
+    await excluir_em_outro_worker("pessoa", pessoa)
+
+    r = await fabrica.cliente.post(f"/pessoas/{pessoa}/adicionar-terreno/{terreno}")
+    assert r.status_code == 404
+    assert not (await map["terreno"]["collection"].find_one({})).get("pessoas_ids")
+
+
+async def test_leitura_anterior_a_invalidacao_nao_e_guardada():
+    backend = CacheMemoria()
+    chave = ("pessoa", "1")
+    geracao = await backend.geracao(chave)
+    await backend.remover([chave])
+    assert not await backend.guardar(chave, {"nome": "antigo"}, geracao)
+    assert await backend.obter(chave) is None
+
+    geracao = await backend.geracao(chave)
+    await backend.limpar("pessoa")
+    assert not await backend.guardar(chave, {"nome": "antigo"}, geracao)
+
+    geracao = await backend.geracao(chave)
+    assert await backend.guardar(chave, {"nome": "novo"}, geracao)
+    assert await backend.obter(chave) == {"nome": "novo"}
+
+
+async def test_cache_desligado_sempre_le_o_banco(fabrica):
+    pessoa = await fabrica.pessoa()
+    cache = CacheEntidades(CacheDesligado())
+    assert (await cache.buscar("pessoa", pessoa))["_id"] == ObjectId(pessoa)
+    await map["pessoa"]["collection"].delete_one({"_id": ObjectId(pessoa)})
+    assert await cache.buscar("pessoa", pessoa) is None
+
+
+def test_backend_pela_variavel_de_ambiente(monkeypatch):
+    monkeypatch.delenv("CACHE_ENTIDADES", raising=False)
+    assert isinstance(backend_cache(), CacheMemoria)
+    monkeypatch.setenv("CACHE_ENTIDADES", "desligado")
+    assert isinstance(backend_cache(), CacheDesligado)
+    monkeypatch.setenv("CACHE_ENTIDADES", "redis")
+    with pytest.raises(ValueError):
+        backend_cache()
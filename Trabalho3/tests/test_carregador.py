@@ -0,0 +1,54 @@
+import asyncio
+
+import pytest
+from bson import ObjectId
+
+from conftest import documento, gastos
+from metricas import metricas
+from routers.utils import CarregadorIds, buscar_por_id, map
+
+pytestmark = pytest.mark.anyio
+
+
+def lotes(tipo: str) -> int:
+    return metricas.contadores[("carregador_lotes_total", (("tipo", tipo),))]
+
+
+async def test_buscas_do_mesmo_ciclo_viram_uma_consulta(fabrica):
+    pessoas = [await fabrica.pessoa() for _ in range(3)]
+    ausente = str(ObjectId())
+    antes = lotes("pessoa")
+
+    docs = await asyncio.gather(
+        *(buscar_por_id("pessoa", id) for id in [*pessoas, pessoas[0], ausente])
+    )
+    assert lotes("pessoa") - antes == 1
+    assert [str(d["_id"]) for d in docs[:4]] == [*pessoas, pessoas[0]]
+    assert docs[4] is None
+    # Cada chamador recebe a sua cópia
+    docs[0]["nome"] = "alterado"
+    assert docs[3]["nome"] != "alterado"
+
+
+async def test_lotes_limitados_pelo_tamanho(fabrica):
+    pessoas = [await fabrica.pessoa() for _ in range(5)]
+    carregador = CarregadorIds(tamanho_lote=2)
+    antes = lotes("pessoa")
+
+    docs = await asyncio.gather(*(carregador.carregar("pessoa", id) for id in pessoas))
+    assert lotes("pessoa") - antes == 3
+    assert [str(d["_id"]) for d in docs] == pessoas
+
+
+async def test_vinculo_usa_os_gastos_atuais_do_terreno(fabrica):
+    terreno = await fabrica.terreno()
+    pessoa = await fabrica.pessoa()
+    assert gastos(await buscar_por_id("terreno", terreno)) == (0, 0)
+    # Gastos gravados sem invalidar o cache, que continua com os antigos
+    await map["terreno"]["collection"].update_one(
+        {"_id": ObjectId(terreno)}, {"$set": {"custo_total_obras": 40, "quantidade_obras": 2}}
+    )
+
+    r = await fabrica.cliente.post(f"/pessoas/{pessoa}/adicionar-terreno/{terreno}")
+    assert r.status_code == 200, r.text
+    assert gastos(await documento("pessoa", pessoa)) == (40, 2)
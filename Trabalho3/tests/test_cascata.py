@@ -0,0 +1,50 @@
+import pytest
+
+from conftest import documento, gastos
+from routers.utils import map, verificar_contadores
+
+pytestmark = pytest.mark.anyio
+
+
+async def test_excluir_terreno_exclui_descendentes(fabrica):
+    pessoa = await fabrica.pessoa()
+    terreno = await fabrica.terreno(pessoa)
+    outro = await fabrica.terreno(pessoa)
+    construcao = await fabrica.construcao(terreno)
+    await fabrica.obra(construcao, 30)
+    await fabrica.obra(construcao, 20)
+    await fabrica.obra(await fabrica.construcao(outro), 5)
+
+    r = await fabrica.cliente.delete(f"/terrenos/{terreno}")
+    assert r.status_code == 200, r.text
+
+    assert await documento("terreno", terreno) is None
+    assert await documento("construcao", construcao) is None
+    assert await map["obra"]["collection"].count_documents({}) == 1
+    restante = await documento("pessoa", pessoa)
+    assert [str(t) for t in restante["terrenos_ids"]] == [outro]
+    assert gastos(restante) == (5, 1)
+    relatorio = await verificar_contadores()
+    assert all(r["divergentes"] == 0 for r in relatorio.values())
+
+
+async def test_excluir_obra_desconta_gastos(fabrica):
+    pessoa = await fabrica.pessoa()
+    terreno = await fabrica.terreno(pessoa)
+    construcao = await fabrica.construcao(terreno)
+    obra = await fabrica.obra(construcao, 30)
+    await fabrica.obra(construcao, 20)
+
+    r = await fabrica.cliente.delete("/obras/", params={"obra_id": obra})
+    assert r.status_code == 200, r.text
+
+    doc_construcao = await documento("construcao", construcao)
+    assert obra not in [str(o) for o in doc_construcao["obras_ids"]]
+    assert gastos(doc_construcao) == (20, 1)
+    assert gastos(await documento("terreno", terreno)) == (20, 1)
+    assert gastos(await documento("pessoa", pessoa)) == (20, 1)
+
+
+async def test_excluir_inexistente(cliente):
+    r = await cliente.delete(f"/contrucoes/{'0' * 24}")
+    assert r.status_code == 404
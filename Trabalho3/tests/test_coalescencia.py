@@ -0,0 +1,56 @@
+import asyncio
+
+import pytest
+
+from routers import utils
+from routers.utils import coalescer
+
+pytestmark = pytest.mark.anyio
+
+
+def contador():
+    chamadas = []
+
+    async def endpoint(valor: int):
+        chamadas.append(valor)
+        await asyncio.sleep(0.01)
+        return {"valor": valor, "chamada": len(chamadas)}
+
+    return endpoint, chamadas
+
+
+async def test_chamadas_simultaneas_compartilham_o_calculo():
+    endpoint, chamadas = contador()
+    coalescido = coalescer("/teste/simultaneas")(endpoint)
+
+    resultados = await asyncio.gather(*(coalescido(valor=1) for _ in range(5)))
+    assert chamadas == [1]
+    assert all(r == {"valor": 1, "chamada": 1} for r in resultados)
+
+    await coalescido(valor=2)
+    await coalescido(valor=1)
+    assert chamadas == [1, 2, 1]
+
+
+async def test_janela_so_quando_configurada(monkeypatch):
+    monkeypatch.setitem(utils.JANELAS_COALESCENCIA, "/teste/janela", 60)
+    endpoint, chamadas = contador()
+    coalescido = coalescer("/teste/janela")(endpoint)
+
+    await coalescido(valor=1)
+    assert await coalescido(valor=1) == {"valor": 1, "chamada": 1}
+    assert chamadas == [1]
+
+
+async def test_contagens_refletem_escritas(fabrica):
+    async def quantidade() -> int:
+        r = await fabrica.cliente.get("/pessoas/quantidade_usuarios")
+        assert r.status_code == 200, r.text
+        return r.json()["quantidade"]
+
+    assert await quantidade() == 0
+    pessoa = await fabrica.pessoa()
+    assert await quantidade() == 1
+    r = await fabrica.cliente.delete(f"/pessoas/{pessoa}")
+    assert r.status_code == 200, r.text
+    assert await quantidade() == 0
@@ -0,0 +1,85 @@
+import pytest
+from bson import ObjectId
+from fastapi import HTTPException
+
+from models import Consulta
+from routers.utils import compilar_consulta, map
+
+pytestmark = pytest.mark.anyio
+
+
+def compilar(tipo: str, **consulta):
+    return compilar_consulta(tipo, Consulta.model_validate(consulta))
+
+
+def test_predicados_do_mesmo_campo_sao_combinados():
+    filtro, ordenacao = compilar(
+        "terreno",
+        filtros=[
+            {"campo": "preco", "op": "gte", "valor": 100},
+            {"campo": "preco", "op": "lte", "valor": "500"},
+            {"campo": "disponivel", "valor": True},
+        ],
+        ordenacao=["-preco"],
+    )
+    assert filtro == {"preco": {"$gte": 100, "$lte": 500.0}, "disponivel": {"$eq": True}}
+    assert ordenacao == [("preco", -1), ("_id", 1)]
+
+
+def test_referencias_aceitam_str_e_objectid():
+    id = ObjectId()
+    filtro, _ = compilar("obra", filtros=[{"campo": "contrucao_id", "valor": str(id)}])
+    assert filtro == {"contrucao_id": {"$in": [id, str(id)]}}
+    filtro, _ = compilar(
+        "obra", filtros=[{"campo": "contrucao_id", "op": "nin", "valor": [str(id)]}]
+    )
+    assert filtro == {"contrucao_id": {"$nin": [id, str(id)]}}
+
+
+@pytest.mark.parametrize(
+    "filtros",
+    [
+        [{"campo": "inexistente", "valor": 1}],
+        [{"campo": "preco", "valor": "caro"}],
+        [{"campo": "preco", "op": "in", "valor": 10}],
+        [{"campo": "preco", "op": "gt", "valor": 1}, {"campo": "preco", "op": "gt", "valor": 2}],
+        [{"campo": "pessoas_ids", "valor": "abc"}],
+    ],
+)
+def test_consulta_invalida(filtros):
+    with pytest.raises(HTTPException) as erro:
+        compilar("terreno", filtros=filtros)
+    assert erro.value.status_code == 400
+
+
+async def test_consulta_por_referencia_gravada_como_str(fabrica):
+    construcao = await fabrica.construcao(await fabrica.terreno())
+    outra = await fabrica.construcao(await fabrica.terreno())
+    await fabrica.obra(construcao, 10)
+    await fabrica.obra(construcao, 20)
+    await fabrica.obra(outra, 30)
+    assert isinstance((await map["obra"]["collection"].find_one({}))["contrucao_id"], str)
+
+    r = await fabrica.cliente.post(
+        "/obras/consulta",
+        params={"fields": "custo"},
+        json={
+            "filtros": [{"campo": "contrucao_id", "valor": construcao}],
+            "ordenacao": ["-custo"],
+        },
+    )
+    assert r.status_code == 200, r.text
+    assert [o["custo"] for o in r.json()["data"]] == [20, 10]
+
+
+async def test_consulta_por_referencia_gravada_como_objectid(fabrica):
+    terreno = await fabrica.terreno()
+    await fabrica.construcao(terreno)
+    await fabrica.construcao(await fabrica.terreno())
+    assert isinstance((await map["construcao"]["collection"].find_one({}))["terreno_id"], ObjectId)
+
+    r = await fabrica.cliente.post(
+        "/contrucoes/consulta", json={"filtros": [{"campo": "terreno_id", "valor": terreno}]}
+    )
+    assert r.status_code == 200, r.text
+    assert [c["terreno_id"] for c in r.json()["data"]] == [terreno]
@@ -0,0 +1,80 @@
+import pytest
+
+from conftest import documento, gastos
+from routers.utils import verificar_contadores
+
+pytestmark = pytest.mark.anyio
+
+
+async def sem_divergencias():
+    relatorio = await verificar_contadores()
+    return all(r["divergentes"] == 0 for r in relatorio.values())
+
+
+async def test_criar_obra_propaga_gastos(fabrica):
+    pessoa = await fabrica.pessoa()
+    terreno = await fabrica.terreno(pessoa)
+    construcao = await fabrica.construcao(terreno)
+    await fabrica.obra(construcao, 100)
+    await fabrica.obra(construcao, 50)
+
+    assert gastos(await documento("construcao", construcao)) == (150, 2)
+    assert gastos(await documento("terreno", terreno)) == (150, 2)
+    assert gastos(await documento("pessoa", pessoa)) == (150, 2)
+    assert await sem_divergencias()
+
+
+async def test_vincular_terreno_soma_gastos_existentes(fabrica):
+    terreno = await fabrica.terreno()
+    await fabrica.obra(await fabrica.construcao(terreno), 70)
+    pessoa = await fabrica.pessoa()
+
+    for _ in range(2):
+        r = await fabrica.cliente.post(f"/pessoas/{pessoa}/adicionar-terreno/{terreno}")
+        assert r.status_code == 200
+
+    assert gastos(await documento("pessoa", pessoa)) == (70, 1)
+
+
+async def test_atualizar_obra_move_gastos_de_construcao(fabrica):
+    terreno_a = await fabrica.terreno(await fabrica.pessoa())
+    terreno_b = await fabrica.terreno()
+    construcao_a = await fabrica.construcao(terreno_a)
+    construcao_b = await fabrica.construcao(terreno_b)
+    obra = await fabrica.obra(construcao_a, 100)
+
+    corpo = fabrica.corpo_obra(construcao_b, 40)
+    r = await fabrica.cliente.put("/obras/", params={"obra_id": obra}, json=corpo)
+    assert r.status_code == 200, r.text
+
+    assert gastos(await documento("construcao", construcao_a)) == (0, 0)
+    assert gastos(await documento("construcao", construcao_b)) == (40, 1)
+    assert gastos(await documento("terreno", terreno_b)) == (40, 1)
+    assert await sem_divergencias()
+
+
+async def test_atualizar_construcao_move_gastos_de_terreno(fabrica):
+    pessoa = await fabrica.pessoa()
+    terreno_a = await fabrica.terreno(pessoa)
+    terreno_b = await fabrica.terreno()
+    construcao = await fabrica.construcao(terreno_a)
+    await fabrica.obra(construcao, 80)
+
+    corpo = fabrica.corpo_construcao(terreno_b)
+    r = await fabrica.cliente.put(f"/contrucoes/{construcao}", json=corpo)
+    assert r.status_code == 200, r.text
+
+    antigo, novo = await documento("terreno", terreno_a), await documento("terreno", terreno_b)
+    assert gastos(antigo) == (0, 0)
+    assert gastos(novo) == (80, 1)
+    assert gastos(await documento("pessoa", pessoa)) == (0, 0)
+    assert construcao not in [str(c) for c in antigo.get("construcoes_ids", [])]
+    assert construcao in [str(c) for c in novo["construcoes_ids"]]
+    assert await sem_divergencias()
+
+
+async def test_atualizar_construcao_para_terreno_inexistente(fabrica):
+    construcao = await fabrica.construcao(await fabrica.terreno())
+    corpo = fabrica.corpo_construcao("0" * 24)
+    r = await fabrica.cliente.put(f"/contrucoes/{construcao}", json=corpo)
+    assert r.status_code == 404
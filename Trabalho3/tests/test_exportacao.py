@@ -0,0 +1,75 @@
+import csv
+import io
+import json
+
+import pytest
+
+import exportacao
+
+pytestmark = pytest.mark.anyio
+
+
+async def exportar(cliente, rota: str, consulta: dict = None, **params):
+    r = await cliente.post(f"{rota}/exportar", params=params, json=consulta)
+    assert r.status_code == 200, r.text
+    return r
+
+
+async def test_ndjson_com_filtro_e_campos(fabrica):
+    construcao = await fabrica.construcao(await fabrica.terreno())
+    for custo in (10, 20, 30):
+        await fabrica.obra(construcao, custo)
+
+    r = await exportar(
+        fabrica.cliente,
+        "/obras",
+        {"filtros": [{"campo": "custo", "op": "gte", "valor": 20}]},
+        fields="custo,contrucao_id",
+    )
+    assert r.headers["content-disposition"] == 'attachment; filename="obra.ndjson"'
+    linhas = [json.loads(l) for l in r.text.splitlines()]
+    assert sorted(l["custo"] for l in linhas) == [20, 30]
+    assert all(set(l) == {"id", "custo", "contrucao_id"} for l in linhas)
+
+
+async def test_csv_expande_aninhados_e_listas(fabrica):
+    pessoa = await fabrica.pessoa()
+    terreno = await fabrica.terreno(pessoa)
+
+    r = await exportar(fabrica.cliente, "/terrenos", formato="csv")
+    linhas = list(csv.DictReader(io.StringIO(r.text)))
+    assert len(linhas) == 1
+    assert linhas[0]["id"] == terreno
+    assert linhas[0]["endereco.cidade"] == "Natal"
+    assert linhas[0]["pessoas_ids"] == pessoa
+    assert list(linhas[0])[0] == "id"
+    # Os campos derivados gravados para a busca não são exportados
+    assert not any(c.startswith(("prefixo_", "chaves_")) for c in linhas[0])
+
+
+async def test_gzip_em_pedacos(fabrica, monkeypatch):
+    monkeypatch.setattr(exportacao, "LINHAS_POR_PEDACO", 2)
+    for _ in range(5):
+        await fabrica.pessoa()
+
+    r = await exportar(fabrica.cliente, "/pessoas", gzip=True)
+    assert r.headers["content-encoding"] == "gzip"
+    # O httpx já descompacta o corpo; o conteúdo tem uma linha por pessoa
+    assert len(r.text.splitlines()) == 5
+
+
+async def test_parquet(fabrica):
+    pyarrow = pytest.importorskip("pyarrow.parquet")
+    await fabrica.obra(await fabrica.construcao(await fabrica.terreno()), 15)
+
+    r = await exportar(fabrica.cliente, "/obras", formato="parquet", linhas_por_grupo=1)
+    tabela = pyarrow.read_table(io.BytesIO(r.content))
+    assert tabela.num_rows == 1
+    assert tabela.column("custo").to_pylist() == [15]
+
+
+async def test_pedido_invalido(cliente):
+    r = await cliente.post("/obras/exportar", params={"linhas_por_grupo": 0})
+    assert r.status_code == 400
+    r = await cliente.post("/obras/exportar", params={"fields": "inexistente"})
+    assert r.status_code == 400
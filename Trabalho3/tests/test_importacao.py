@@ -0,0 +1,94 @@
+import json
+
+import pytest
+from bson import ObjectId
+
+from conftest import endereco, gastos
+from routers.utils import map, verificar_contadores
+
+pytestmark = pytest.mark.anyio
+
+TERRENO = {
+    "largura": 10,
+    "altua": 20,
+    "disponivel": True,
+    "preco": 1000,
+    "descricao": "lote",
+    "endereco": endereco(),
+}
+CONSTRUCAO = {"nome": "casa", "descricao": "d", "custo_total": 5, "tipo": "casa", "area": 3}
+OBRA = {"nome": "obra", "descricao": "d", "inicio": "2024-01-01T00:00:00"}
+
+
+def ndjson(*linhas) -> bytes:
+    return "".join(json.dumps(l) + "\n" for l in linhas).encode()
+
+
+async def importar(cliente, corpo: bytes, **params) -> dict:
+    r = await cliente.post("/importar/", params=params, content=corpo)
+    assert r.status_code == 200, r.text
+    return r.json()
+
+
+async def test_referencias_entre_linhas_do_mesmo_arquivo(cliente):
+    corpo = ndjson(
+        {"entidade": "terreno", "id": "T1", **TERRENO},
+        {"entidade": "construcao", "id": "C1", **CONSTRUCAO, "terreno_id": "T1"},
+        {"entidade": "obra", **OBRA, "custo": 7, "contrucao_id": "C1"},
+        {"entidade": "obra", **OBRA, "custo": 3, "contrucao_id": "C1"},
+    )
+    # Lotes de uma linha obrigam cada filho a esperar o lote do pai
+    resumo = await importar(cliente, corpo, tamanho_lote=1)
+    assert resumo["inseridos"] == {"terreno": 1, "construcao": 1, "obra": 2}
+    assert resumo["erros"] == 0
+
+    terreno = await map["terreno"]["collection"].find_one({})
+    construcao = await map["construcao"]["collection"].find_one({})
+    obras = await map["obra"]["collection"].find({}).to_list(None)
+    assert construcao["terreno_id"] == terreno["_id"]
+    assert terreno["construcoes_ids"] == [construcao["_id"]]
+    assert sorted(construcao["obras_ids"]) == sorted(o["_id"] for o in obras)
+    assert {o["contrucao_id"] for o in obras} == {str(construcao["_id"])}
+    assert gastos(terreno) == (10, 2)
+    relatorio = await verificar_contadores()
+    assert all(r["divergentes"] == 0 for r in relatorio.values())
+
+
+async def test_erros_por_linha(cliente):
+    corpo = ndjson(
+        {"entidade": "obra", **OBRA, "custo": 1, "contrucao_id": "C1"},
+        {"entidade": "terreno", "id": "T1", **TERRENO, "largura": "larga"},
+        {"entidade": "construcao", "id": "C1", **CONSTRUCAO, "terreno_id": "T1"},
+        {"entidade": "construcao", "id": "C1", **CONSTRUCAO, "terreno_id": "T1"},
+        {"entidade": "construcao", **CONSTRUCAO, "terreno_id": str(ObjectId())},
+    ) + b"{nao e json\n"
+    resumo = await importar(cliente, corpo)
+    assert resumo["inseridos"] == {"terreno": 0, "construcao": 0, "obra": 0}
+    erros = {e["linha"]: e["erro"] for e in resumo["detalhes"]}
+    assert erros[1] == "contrucao_id C1 não encontrado"  # o pai vem depois
+    assert erros[2].startswith("largura:")
+    assert erros[3] == "terreno_id T1 não foi importado"
+    assert erros[4] == "id C1 repetido no arquivo"
+    assert "não encontrado" in erros[5]
+    assert erros[6].startswith("JSON inválido")
+
+
+async def test_csv_com_pai_existente(cliente, fabrica):
+    terreno = await fabrica.terreno()
+    corpo = (
+        "nome,descricao,custo_total,tipo,area,terreno_id\n"
+        f'galpão,"dois\npavimentos",100,galpao,50,{terreno}\n'
+        f"casa,,10,casa,5,{terreno}\n"
+    ).encode()
+    resumo = await importar(cliente, corpo, formato="csv", entidade="construcao")
+    assert resumo["inseridos"] == {"construcao": 1}
+    assert resumo["detalhes"][0]["linha"] == 4
+    construcao = await map["construcao"]["collection"].find_one({"nome": "galpão"})
+    assert construcao["descricao"] == "dois\npavimentos"
+    doc_terreno = await map["terreno"]["collection"].find_one({"_id": ObjectId(terreno)})
+    assert doc_terreno["construcoes_ids"] == [construcao["_id"]]
+
+
+async def test_parametros_invalidos(cliente):
+    r = await cliente.post("/importar/", params={"concorrencia": 0}, content=b"")
+    assert r.status_code == 400
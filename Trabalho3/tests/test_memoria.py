@@ -0,0 +1,137 @@
+import pytest
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError, OperationFailure
+
+from memoria import ClienteMemoria
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.fixture
+def banco():
+    return ClienteMemoria()["teste"]
+
+
+async def test_consultas_com_arrays_e_caminhos_aninhados(banco):
+    colecao = banco["docs"]
+    await colecao.insert_many(
+        [
+            {"n": 1, "tags": ["a", "b"], "endereco": {"cidade": "Natal"}},
+            {"n": 2, "tags": ["b"], "endereco": {"cidade": "Recife"}},
+            {"n": 3, "itens": [{"x": 1, "y": 2}, {"x": 3, "y": 4}]},
+        ]
+    )
+
+    async def ns(filtro) -> list:
+        return sorted(d["n"] for d in await colecao.find(filtro).to_list(None))
+
+    assert await ns({"tags": "b"}) == [1, 2]
+    assert await ns({"tags": {"$all": ["a", "b"]}}) == [1]
+    assert await ns({"tags": {"$size": 1}}) == [2]
+    assert await ns({"endereco.cidade": {"$in": ["Natal", "Caicó"]}}) == [1]
+    assert await ns({"endereco": {"$exists": False}}) == [3]
+    assert await ns({"itens": {"$elemMatch": {"x": 3, "y": 4}}}) == [3]
+    assert await ns({"itens": {"$elemMatch": {"x": 1, "y": 4}}}) == []
+    assert await ns({"$or": [{"n": {"$gt": 2}}, {"tags": {"$nin": ["b"]}}]}) == [3]
+    assert await ns({"endereco.cidade": {"$regex": "^rec", "$options": "i"}}) == [2]
+    with pytest.raises(OperationFailure):
+        await colecao.find({"n": {"$quase": 1}}).to_list(None)
+
+
+async def test_ordenacao_pular_e_limite(banco):
+    colecao = banco["docs"]
+    await colecao.insert_many([{"n": n} for n in (3, 1, 4, 1, 5)])
+    docs = await colecao.find({}, {"_id": 0}).sort("n", -1).skip(1).limit(2).to_list(None)
+    assert docs == [{"n": 4}, {"n": 3}]
+
+
+async def test_atualizacoes_e_upsert(banco):
+    colecao = banco["docs"]
+    await colecao.insert_one({"_id": 1, "n": 1, "tags": ["a"]})
+
+    await colecao.update_one(
+        {"_id": 1},
+        {"$inc": {"n": 2}, "$addToSet": {"tags": "a"}, "$push": {"lista": 7}},
+    )
+    assert await colecao.find_one({"_id": 1}) == {
+        "_id": 1,
+        "n": 3,
+        "tags": ["a"],
+        "lista": [7],
+    }
+
+    resultado = await colecao.update_one(
+        {"_id": 2}, {"$set": {"n": 5}, "$setOnInsert": {"criado": True}}, upsert=True
+    )
+    assert resultado.upserted_id == 2
+    assert await colecao.find_one({"_id": 2}) == {"_id": 2, "n": 5, "criado": True}
+
+    depois = await colecao.find_one_and_update(
+        {"_id": 2},
+        {"$unset": {"criado": ""}, "$max": {"n": 9}},
+        return_document=ReturnDocument.AFTER,
+    )
+    assert depois == {"_id": 2, "n": 9}
+
+
+async def test_documentos_sao_copiados(banco):
+    colecao = banco["docs"]
+    doc = {"_id": 1, "tags": ["a"]}
+    await colecao.insert_one(doc)
+    doc["tags"].append("b")
+    lido = await colecao.find_one({"_id": 1})
+    assert lido["tags"] == ["a"]
+    lido["tags"].append("c")
+    assert (await colecao.find_one({"_id": 1}))["tags"] == ["a"]
+
+
+async def test_indice_unico(banco):
+    colecao = banco["docs"]
+    await colecao.create_index("email", unique=True)
+    await colecao.insert_one({"email": "a@x"})
+    with pytest.raises(DuplicateKeyError):
+        await colecao.insert_one({"email": "a@x"})
+    await colecao.insert_one({"email": "b@x"})
+    with pytest.raises(DuplicateKeyError):
+        await colecao.update_one({"email": "b@x"}, {"$set": {"email": "a@x"}})
+    assert await colecao.count_documents({}) == 2
+
+
+async def test_agregacao_com_lookup_e_group(banco):
+    await banco["terrenos"].insert_many(
+        [{"_id": 1, "cidade": "Natal"}, {"_id": 2, "cidade": "Recife"}]
+    )
+    await banco["construcoes"].insert_many(
+        [
+            {"terreno_id": 1, "custo": 10},
+            {"terreno_id": 1, "custo": 20},
+            {"terreno_id": 2, "custo": 5},
+        ]
+    )
+
+    pipeline = [
+        {
+            "$lookup": {
+                "from": "terrenos",
+                "localField": "terreno_id",
+                "foreignField": "_id",
+                "as": "terreno",
+            }
+        },
+        {"$unwind": "$terreno"},
+        {"$group": {"_id": "$terreno.cidade", "total": {"$sum": "$custo"}, "n": {"$sum": 1}}},
+        {"$sort": {"total": -1}},
+    ]
+    docs = await banco["construcoes"].aggregate(pipeline).to_list(None)
+    assert docs == [{"_id": "Natal", "total": 30, "n": 2}, {"_id": "Recife", "total": 5, "n": 1}]
+
+
+async def test_texto_exige_indice_e_ignora_acentos_e_plurais(banco):
+    colecao = banco["docs"]
+    await colecao.insert_many([{"n": 1, "d": "Casas de pedra"}, {"n": 2, "d": "Apartamento"}])
+    with pytest.raises(OperationFailure):
+        await colecao.find({"$text": {"$search": "casa"}}).to_list(None)
+
+    await colecao.create_index([("d", "text")], default_language="portuguese")
+    docs = await colecao.find({"$text": {"$search": "CASA pédra"}}).to_list(None)
+    assert [d["n"] for d in docs] == [1]
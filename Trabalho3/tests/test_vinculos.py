@@ -0,0 +1,64 @@
+import pytest
+
+from conftest import documento, gastos
+
+pytestmark = pytest.mark.anyio
+
+
+async def test_vincular_e_desvincular_em_lote(fabrica):
+    pessoa = await fabrica.pessoa()
+    terrenos = [await fabrica.terreno() for _ in range(3)]
+    await fabrica.obra(await fabrica.construcao(terrenos[0]), 60)
+    corpo = {"pessoa_id": pessoa, "terrenos_ids": terrenos}
+
+    r = await fabrica.cliente.post("/pessoas/vincular-terrenos", json=corpo)
+    assert r.json() == {"vinculados": 3, "erros": []}
+    doc = await documento("pessoa", pessoa)
+    assert sorted(str(t) for t in doc["terrenos_ids"]) == sorted(terrenos)
+    assert gastos(doc) == (60, 1)
+    for terreno in terrenos:
+        assert [str(p) for p in (await documento("terreno", terreno))["pessoas_ids"]] == [pessoa]
+
+    # Repetir o vínculo não soma os gastos de novo
+    r = await fabrica.cliente.post("/pessoas/vincular-terrenos", json=corpo)
+    assert r.json()["vinculados"] == 0
+    assert gastos(await documento("pessoa", pessoa)) == (60, 1)
+
+    r = await fabrica.cliente.post(
+        "/pessoas/desvincular-terrenos", json={"pessoa_id": pessoa, "terrenos_ids": terrenos[:1]}
+    )
+    assert r.json() == {"desvinculados": 1, "erros": []}
+    doc = await documento("pessoa", pessoa)
+    assert sorted(str(t) for t in doc["terrenos_ids"]) == sorted(terrenos[1:])
+    assert gastos(doc) == (0, 0)
+    assert (await documento("terreno", terrenos[0]))["pessoas_ids"] == []
+
+
+async def test_vincular_com_referencias_inexistentes(fabrica):
+    pessoa = await fabrica.pessoa()
+    terreno = await fabrica.terreno()
+    ausente = "0" * 24
+    r = await fabrica.cliente.post(
+        "/pessoas/vincular-terrenos",
+        json={
+            "pares": [
+                {"pessoa_id": pessoa, "terreno_id": terreno},
+                {"pessoa_id": ausente, "terreno_id": terreno},
+                {"pessoa_id": pessoa, "terreno_id": ausente},
+            ]
+        },
+    )
+    resposta = r.json()
+    assert resposta["vinculados"] == 1
+    assert [e["erro"] for e in resposta["erros"]] == [
+        "Pessoa não encontrada",
+        "Terreno não encontrado",
+    ]
+
+
+async def test_vincular_id_invalido(fabrica):
+    r = await fabrica.cliente.post(
+        "/pessoas/vincular-terrenos",
+        json={"pessoa_id": "abc", "terrenos_ids": [await fabrica.terreno()]},
+    )
+    assert r.status_code == 400
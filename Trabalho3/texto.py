@@ -0,0 +1,137 @@
+"""Normalização de texto compartilhada pela busca textual.
+
+`radical` é uma redução leve de plurais do português (casas -> casa,
+construções -> construcao), usada pelo banco em memória como aproximação do
+stemmer Snowball do índice de texto do MongoDB. Ela não radicaliza como o
+Snowball (construir e construção viram construir e construcao, o Snowball
+reduz as duas a constru), então não serve para conferir resultados do
+servidor.
+
+`chaves_campo` e `chaves_busca` restringem a busca textual a um campo sem
+depender do stemmer: usam só o começo de cada palavra que o Snowball nunca
+altera (ver `inicio`).
+"""
+
+import re
+import unicodedata
+from typing import List, Set
+
+# Vogais do stemmer Snowball do português; ã e õ viram a~ e o~, e o ~ conta
+# como consoante
+_VOGAIS = set("aeiouáéíóúâêô")
+
+# Sufixo de plural e a terminação do singular, na ordem em que são testados
+_SUFIXOS_PLURAL = (
+    ("oes", "ao"),
+    ("aes", "ao"),
+    ("ais", "al"),
+    ("eis", "el"),
+    ("ois", "ol"),
+    ("res", "r"),
+    ("zes", "z"),
+    ("ses", "s"),
+    ("ns", "m"),
+    ("s", ""),
+)
+
+
+def normalizar(texto: str) -> str:
+    """Minúsculas e sem acentos."""
+    decomposto = unicodedata.normalize("NFKD", texto.lower())
+    return "".join(c for c in decomposto if not unicodedata.combining(c))
+
+
+def radical(palavra: str) -> str:
+    if len(palavra) <= 3:
+        return palavra
+    for sufixo, singular in _SUFIXOS_PLURAL:
+        if palavra.endswith(sufixo) and len(palavra) - len(sufixo) >= 2:
+            return palavra[: -len(sufixo)] + singular
+    return palavra
+
+
+def tokens(texto: str) -> List[str]:
+    """Radicais das palavras do texto normalizado."""
+    return [radical(t) for t in re.findall(r"\w+", normalizar(texto))]
+
+
+def termos_busca(busca: str):
+    """Separa a busca em termos, termos negados ("-termo") e frases ("...")."""
+    frases = [normalizar(f) for f in re.findall(r'"([^"]+)"', busca)]
+    resto = re.sub(r'"[^"]*"', " ", busca)
+    termos, negados = set(), set()
+    for palavra in resto.split():
+        destino = negados if palavra.startswith("-") else termos
+        destino.update(tokens(palavra.lstrip("-")))
+    for frase in frases:
+        termos.update(tokens(frase))
+    return termos, negados, frases
+
+
+def _forma_snowball(palavra: str) -> str:
+    return palavra.replace("ã", "a~").replace("õ", "o~")
+
+
+def _protegido(forma: str) -> int:
+    """Tamanho do começo da palavra que fica antes das regiões RV e R1 do
+    Snowball. Os sufixos só são removidos ou trocados dentro delas (R2 está
+    contida em R1), então esse começo é o mesmo na palavra e no radical."""
+    vogal = [letra in _VOGAIS for letra in forma]
+    if len(forma) < 3:
+        return len(forma)
+    if not vogal[1]:
+        rv = next((i + 1 for i in range(2, len(forma)) if vogal[i]), len(forma))
+    elif vogal[0]:
+        rv = next((i + 1 for i in range(2, len(forma)) if not vogal[i]), len(forma))
+    else:
+        rv = 3
+    r1 = next(
+        (i + 1 for i in range(1, len(forma)) if vogal[i - 1] and not vogal[i]), len(forma)
+    )
+    return min(rv, r1)
+
+
+def inicio(palavra: str) -> str:
+    """Começo normalizado da palavra que o Snowball não altera.
+
+    Duas palavras com o mesmo radical têm começos em que um é prefixo do
+    outro. O começo é calculado com e sem acentos, já que o servidor pode
+    radicalizar qualquer das duas formas, e fica o menor."""
+    palavra = palavra.lower()
+    sem_acentos = normalizar(palavra)
+    forma = _forma_snowball(palavra)
+    limite, posicao, tamanho = _protegido(forma), 0, 0
+    for letra in palavra:
+        if posicao >= limite:
+            break
+        posicao += len(_forma_snowball(letra))
+        tamanho += 1
+    return sem_acentos[: min(tamanho, _protegido(sem_acentos))]
+
+
+def chaves_campo(texto: str) -> Set[str]:
+    """Chaves gravadas para cada campo de texto: o começo de cada palavra,
+    marcado com "=", e todos os prefixos dele."""
+    chaves = set()
+    for palavra in re.findall(r"\w+", texto):
+        comeco = inicio(palavra)
+        chaves.add("=" + comeco)
+        chaves.update(comeco[:n] for n in range(1, len(comeco) + 1))
+    return chaves
+
+
+def chaves_busca(busca: str) -> Set[str]:
+    """Chaves dos termos não negados da busca (inclusive os das frases).
+
+    Um campo com uma palavra de mesmo radical que um termo tem uma chave em
+    comum com ele: o começo mais curto dos dois, puro (prefixo gravado do
+    campo) ou marcado (prefixo marcado do termo)."""
+    chaves = set()
+    for palavra in re.findall(r'-?[^\s"]+', busca):
+        if palavra.startswith("-"):
+            continue
+        for parte in re.findall(r"\w+", palavra):
+            comeco = inicio(parte)
+            chaves.add(comeco)
+            chaves.update("=" + comeco[:n] for n in range(1, len(comeco) + 1))
+    return chaves